@@ -0,0 +1,219 @@
+"""
+Micro-benchmark comparing the Observer's timer wheel with the per-second
+bin tables it replaced.
+
+The flow keys and timestamps of every IP packet in a trace are extracted
+first, then replayed through both timer implementations in the same way the
+Observer drives them, and flows that time out are moved onto an expiry timer
+before being emitted. With the bin tables, every packet pushes back its
+flow's idle timer. With the timer wheel, as in the Observer, the idle timer
+is armed once for each flow and re-armed from the time of the flow's last
+packet when it fires.
+
+The bin tables file the expiry of flows that go idle during a capture gap
+under a second that has already been passed, so those flows are never
+emitted, and fewer flows are counted for them.
+
+Usage::
+
+    python3 benchmarks/timers.py [PCAPFILE]
+
+If no trace is given, ``pathspider/tests/data/real.pcap`` is used. If that
+trace or python-libtrace is not available, a synthetic trace is generated.
+"""
+
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pathspider.timerwheel import TimerWheel  # pylint: disable=wrong-import-position
+
+IDLE_TIMEOUT = 30
+EXPIRY_TIMEOUT = 5
+REPEAT = 5
+
+
+class BinTimers:
+    """
+    The idle and expiry bin tables previously used by the Observer, keyed by
+    quantised seconds and holding sets of flow IDs.
+    """
+
+    def __init__(self):
+        self.ptq = 0
+        self.idle_bins = {}
+        self.expiry_bins = {}
+        self.idle_bin = {}
+        self.expiring = set()
+
+    def packet(self, pt, fid):
+        if fid in self.expiring:
+            return
+        new_idle_bin = math.ceil(pt + IDLE_TIMEOUT)
+        old_idle_bin = self.idle_bin.get(fid, 0)
+        if new_idle_bin > old_idle_bin:
+            if old_idle_bin in self.idle_bins:
+                self.idle_bins[old_idle_bin] -= set((fid, ))
+            if new_idle_bin in self.idle_bins:
+                self.idle_bins[new_idle_bin] |= set((fid, ))
+            else:
+                self.idle_bins[new_idle_bin] = set((fid, ))
+            self.idle_bin[fid] = new_idle_bin
+
+    def tick(self, pt):
+        emitted = 0
+        next_ptq = math.ceil(pt)
+        if next_ptq <= self.ptq:
+            return 0
+        elif self.ptq == 0:
+            self.ptq = next_ptq
+            return 0
+        for bint in range(self.ptq + 1, next_ptq + 1):
+            if bint in self.idle_bins:
+                for fid in self.idle_bins[bint].copy():
+                    del self.idle_bin[fid]
+                    self.expiring.add(fid)
+                    expiry_bin = math.ceil(self.ptq + EXPIRY_TIMEOUT)
+                    if expiry_bin in self.expiry_bins:
+                        self.expiry_bins[expiry_bin] |= set((fid, ))
+                    else:
+                        self.expiry_bins[expiry_bin] = set((fid, ))
+                del self.idle_bins[bint]
+            if bint in self.expiry_bins:
+                emitted += len(self.expiry_bins[bint])
+                self.expiring -= self.expiry_bins[bint]
+                del self.expiry_bins[bint]
+        self.ptq = next_ptq
+        return emitted
+
+
+class WheelTimers:
+    """
+    The timer wheel now used by the Observer, holding the next idle or expiry
+    deadline for each flow.
+    """
+
+    def __init__(self, resolution):
+        self.timers = TimerWheel(resolution)
+        self.pkt_last = {}
+        self.expiring = set()
+
+    def packet(self, pt, fid):
+        if fid not in self.pkt_last:
+            self.timers.schedule(fid, pt + IDLE_TIMEOUT)
+        self.pkt_last[fid] = pt
+
+    def tick(self, pt):
+        if pt <= self.timers.until:
+            return 0
+        emitted = 0
+        for fid in self.timers.advance(pt):
+            if fid in self.expiring:
+                self.expiring.remove(fid)
+                del self.pkt_last[fid]
+                emitted += 1
+                continue
+            idle = self.pkt_last[fid] + IDLE_TIMEOUT
+            if not self.timers.is_due(idle):
+                self.timers.schedule(fid, idle)
+                continue
+            self.expiring.add(fid)
+            self.timers.schedule(fid, idle + EXPIRY_TIMEOUT)
+        return emitted
+
+
+def read_trace(filename):
+    import plt as libtrace
+    from pathspider.observer import _flow4_ids
+    from pathspider.observer import _flow6_ids
+
+    if not os.path.exists(filename):
+        raise OSError("No such file")
+    trace = libtrace.trace("pcapfile:" + filename)  # pylint: disable=no-member
+    trace.start()
+    pkt = libtrace.packet()  # pylint: disable=no-member
+    packets = []
+    while trace.read_packet(pkt):
+        try:
+            if pkt.ip:
+                (fid, _) = _flow4_ids(pkt.ip)
+            elif pkt.ip6:
+                (fid, _) = _flow6_ids(pkt.ip6)
+            else:
+                continue
+        except ValueError:
+            continue
+        packets.append((pkt.seconds, fid))
+    return packets
+
+
+def synthetic_trace(count=500000):
+    """
+    Generate a trace of short flows with exponentially distributed packet
+    spacing, interrupted by a few capture gaps of a minute or more.
+    """
+
+    random.seed(0)
+    packets = []
+    start = 1500000000.0
+    fid = 0
+    while len(packets) < count:
+        start += random.expovariate(500)
+        pt = start
+        for _ in range(1 + int(random.expovariate(1 / 8))):
+            packets.append((pt, fid.to_bytes(13, "big")))
+            pt += random.expovariate(5)
+        fid += 1
+    packets.sort()
+    packets = packets[:count]
+
+    # shift everything after a few random points to make capture gaps
+    for index in sorted(random.sample(range(count), 5)):
+        gap = random.uniform(60, 600)
+        packets[index:] = [(pt + gap, fid) for (pt, fid) in packets[index:]]
+    return packets
+
+
+def bench(timers, packets):
+    start = time.perf_counter()
+    emitted = 0
+    for (pt, fid) in packets:
+        emitted += timers.tick(pt)
+        timers.packet(pt, fid)
+    return (time.perf_counter() - start, emitted)
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), "..", "pathspider", "tests", "data",
+        "real.pcap")
+    try:
+        packets = read_trace(filename)
+        print("{} packets from {}".format(len(packets), filename))
+    except (ImportError, OSError) as e:
+        print("unable to read {} ({}), using a synthetic trace".format(
+            filename, e))
+        packets = synthetic_trace()
+        print("{} synthetic packets".format(len(packets)))
+
+    # the implementations are run in turn, and the best of the runs of each
+    # is reported, to reduce the noise from other load on the machine
+    implementations = [("bin tables (1s)", BinTimers),
+                       ("timer wheel (1s)", lambda: WheelTimers(1)),
+                       ("timer wheel (100ms)", lambda: WheelTimers(0.1))]
+    results = {name: [] for (name, _) in implementations}
+    for _ in range(REPEAT):
+        for (name, timers) in implementations:
+            results[name].append(bench(timers(), packets))
+    for (name, _) in implementations:
+        (elapsed, emitted) = min(results[name])
+        print("{:<24} {:8.3f}s {:10.0f} pkt/s {:8d} flows emitted".format(
+            name, elapsed, len(packets) / elapsed, emitted))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,17 @@ the sender.
 
 import sys
 import time
+import asyncio
+import json
 import logging
 import collections
+import functools
 import threading
 import multiprocessing as mp
 import queue
 from datetime import datetime
 
+from pathspider.flowrecord import FlowBatch
 from pathspider.network import ipv4_address
 from pathspider.network import ipv6_address
 from pathspider.network import ipv4_address_public
@@ -38,9 +42,39 @@ PORT_FAILED_AGAIN = -1
 QUEUE_SIZE = 1000
 QUEUE_SLEEP = 0.5
 
+FLOW_BATCH_SIZE = 100
+FLOW_BATCH_INTERVAL = 0.5
+FLOW_FINISH_GRACE = 2
+
+MERGE_BATCH_SIZE = 100
+MERGE_LATENCY_SAMPLES = 10000
+
+COMBINE_BATCH_SIZE = 100
+COMBINE_BATCH_INTERVAL = 0.5
+
+RESULT_TIMEOUT = 120
+COMPARE_TIMEOUT = 300
+MERGE_TABLE_SIZE = 100000
+
+MERGE_RESULT = "result"
+MERGE_FLOW = "flow"
+MERGE_JOB = "job"
+
 SHUTDOWN_SENTINEL = "SHUTDOWN_SENTINEL"
 NO_FLOW = None
 
+#: The spider whose jobs are combined in a combiner process
+_combining_spider = None
+
+def _init_combiner(spider):
+    global _combining_spider # pylint: disable=global-statement
+    _combining_spider = spider
+
+def _combine_jobs(jobs):
+    for job in jobs:
+        _combining_spider.combine_job(job)
+    return _combining_spider.encode_jobs(jobs)
+
 class Spider:
     """
     A spider consists of a configurator (which alternates between two system
@@ -85,6 +119,14 @@ class Spider:
         self.args = args
         self.libtrace_uri = libtrace_uri
         self.server_mode = server_mode
+        self.observer_count = max(getattr(args, 'observers', 1), 1)
+        self.merger_count = max(getattr(args, 'mergers', 1), 1)
+        self.merger_processes = []
+        self.combiner_count = max(getattr(args, 'combiners', 0), 0)
+        self.combiner_pool = None
+        self.combine_batch = []
+        self.combine_batch_start = None
+        self.expected = None
 
         self.__initialize_queues()
         self.__set_interface_addresses()
@@ -106,7 +148,16 @@ class Spider:
         self.flowtab = {}
         self.flowreap = collections.deque()
         self.flowreap_size = min(self.worker_count * 100, 10000)
+        self.resreap = collections.deque()
+        self.comparereap = collections.deque()
+        self.result_timeout = RESULT_TIMEOUT
+        self.compare_timeout = COMPARE_TIMEOUT
+        self.merge_table_size = MERGE_TABLE_SIZE
+        self.expired_results = 0
+        self.expired_jobs = 0
+        self.late_results = 0
         self.outqueue = queue.Queue(QUEUE_SIZE)
+        self.merge_latency = collections.deque(maxlen=MERGE_LATENCY_SAMPLES)
 
     def __set_interface_addresses(self):
         if self.libtrace_uri.startswith('int'):
@@ -135,33 +186,155 @@ class Spider:
 
     def _connect_wrapper(self, job, config, connect=None):
         start = str(datetime.utcnow())
-        if connect is None:
-            conn = self.connect(job, config) # pylint: disable=no-member
-        else:
+        self._connecting(job)
+        conn = None
+        try:
+            if connect is None:
+                conn = self.connect(job, config) # pylint: disable=no-member
+            else:
+                if not hasattr(connect, '__self__'):
+                    connect = connect.__get__(self)
+                conn = connect(job, config)
+        finally:
+            self._connected(job, conn)
+        conn['spdr_start'] = start
+        return conn
+
+    async def _async_connect_wrapper(self, job, config, connect):
+        """
+        Perform a connection from an event loop, as
+        :meth:`_connect_wrapper` does from a worker thread. The connection
+        function may be a coroutine function, which is awaited, or an
+        ordinary function, which is run in the event loop's default
+        executor.
+        """
+
+        start = str(datetime.utcnow())
+        self._connecting(job, wait=False)
+        if self.expected is not None:
+            # the address must reach the observers before the connection
+            # starts, but the event loop is not blocked waiting for it
+            await asyncio.wrap_future(self.expected.written())
+        conn = None
+        try:
             if not hasattr(connect, '__self__'):
                 connect = connect.__get__(self)
-            conn = connect(job, config)
+            if asyncio.iscoroutinefunction(connect):
+                conn = await connect(job, config)
+            else:
+                loop = asyncio.get_event_loop()
+                conn = await loop.run_in_executor(None, connect, job, config)
+        finally:
+            self._connected(job, conn)
         conn['spdr_start'] = start
         return conn
 
-    def create_observer(self):
+    def _connecting(self, job, wait=True):
+        if self.expected is not None:
+            self.expected.connecting(job['dip'], wait)
+
+    def _connected(self, job, conn):
+        # connections that leave their replies outstanding, such as forged
+        # packets, give how long the observers should wait for them
+        grace = None if conn is None else conn.pop('spdr_grace', None)
+        expected = self.expected
+        if expected is not None:
+            sp = None if conn is None else conn.get('sp')
+            expected.connected(job['dip'], sp)
+            if sp:
+                # the connection is over, so the observers need not
+                # wait for its flow to go idle
+                expected.finished(job['dip'], sp, grace)
+
+    def create_observer(self, shard=0):
         """
         Create a flow observer.
 
         This function is called by the base Spider logic to get an instance
         of :class:`pathspider.observer.Observer` configured with the function
         chains that are requried by the plugin.
+
+        :param shard: The shard of the traffic this observer should analyse,
+                      when more than one observer is in use
+        :type shard: int
         """
 
         self.__logger.info("Creating observer")
         if len(self.chains) > 0:
             from pathspider.observer import Observer
+            from pathspider.bpf import combine_filters
+            from pathspider.bpf import shard_filter
+            bpf_filter = combine_filters(
+                self.observer_filter(),
+                shard_filter(shard, self.observer_count))
+            self.__logger.debug("Observer capture filter: %s", bpf_filter)
+            expected = None
+            if self.expected is not None:
+                expected = self.expected.observer_view()
             return Observer(self.libtrace_uri,
-                            chains=self.chains) # pylint: disable=no-member
+                            chains=self.chains, # pylint: disable=no-member
+                            bpf_filter=bpf_filter,
+                            expected=expected)
         else:
             from pathspider.observer import DummyObserver
             return DummyObserver()
 
+    def observer_filter(self):
+        """
+        Build a BPF capture filter selecting the traffic that is relevant to
+        this measurement, so that other traffic on the interface is dropped
+        before it reaches the Observer.
+
+        The filter selects traffic to or from the addresses of the interface
+        in use and, if the transport protocol of the connections can be
+        determined from the ``--connect`` argument, only that protocol and
+        ICMP. No filter is used for offline analysis or if disabled with
+        ``--no-capture-filter``. Plugins that know more about their traffic
+        may override this function.
+
+        :return: A BPF filter expression, or ``None`` to analyse all traffic
+        :rtype: str
+        """
+
+        from pathspider.bpf import CONNECT_PROTOCOLS
+        from pathspider.bpf import traffic_filter
+
+        if (not self.libtrace_uri.startswith('int') or
+                getattr(self.args, 'no_capture_filter', False)):
+            return None
+
+        protocols = []
+        connect = getattr(self.args, 'connect', None)
+        if connect in CONNECT_PROTOCOLS:
+            protocols.append(CONNECT_PROTOCOLS[connect])
+
+        return traffic_filter(self.source, protocols)
+
+    def create_expected_flows(self):
+        """
+        Create the registry of expected flows, into which the workers
+        announce their connections. The Observers use it to only track flows
+        to or from addresses that connections were made to, and to complete
+        the flow of each connection shortly after it has ended. The merger
+        uses it to only hold on to flows that a result is expected for.
+
+        The registry is only used for live measurements in client mode, and
+        not if disabled with ``--no-capture-filter``. Plugins whose traffic
+        does not go directly to the address of the job should override this
+        function to return ``None``.
+
+        :return: The registry, or ``None`` to track all flows
+        :rtype: pathspider.registry.ExpectedFlows
+        """
+
+        if (self.server_mode or not self.libtrace_uri.startswith('int') or
+                getattr(self.args, 'no_capture_filter', False) or
+                (getattr(self.args, 'connect', None) or '').startswith('tor')):
+            return None
+
+        from pathspider.registry import ExpectedFlows
+        return ExpectedFlows(grace=FLOW_FINISH_GRACE)
+
     def _key(self, obj):
         if self.server_mode:
             objkey = (obj['sip'], obj['sp'])
@@ -169,109 +342,367 @@ class Spider:
             objkey = (obj['dip'], obj['sp'])
         return objkey
 
-    def _merge_flows(self):
-        try:
-            flow = self.flowqueue.get_nowait()
-        except queue.Empty:
-            time.sleep(QUEUE_SLEEP)
-            return True
-        else:
+    def _read_flows(self):
+        """
+        Thread to pass flows from the observers on to the merger, through the
+        same queue as the results from the workers, so that the merger can
+        wait for both at once.
+        """
+
+        while self.running:
+            try:
+                flow = self.flowqueue.get(timeout=QUEUE_SLEEP)
+            except queue.Empty:
+                continue
+
             if flow == SHUTDOWN_SENTINEL:
-                self.__logger.debug("stopping flow merging on sentinel")
-                return False
-
-            flowkey = self._key(flow)
-            self.__logger.debug("got a flow (" + repr(flowkey) + ")")
-
-            if flowkey in self.restab:
-                self.__logger.debug("merging flow")
-                self.merge(flow, self.restab[flowkey])
-                del self.restab[flowkey]
-            elif flowkey in self.flowtab:
-                self.__logger.debug("won't merge duplicate flow")
-            else:
-                # Create a new flow
-                self.flowtab[flowkey] = flow
-
-                # And reap the oldest, if the reap queue is full
-                self.flowreap.append(flowkey)
-                if len(self.flowreap) > self.flowreap_size:
-                    try:
-                        del self.flowtab[self.flowreap.popleft()]
-                    except KeyError:
-                        pass
-            return True
+                self.observers_running -= 1
+                if self.observers_running > 0:
+                    self.__logger.debug("observer stopped, %d still running",
+                                        self.observers_running)
+                    continue
+                self.__logger.debug("all observers stopped")
+                self.resqueue.put((MERGE_FLOW, time.monotonic(), flow))
+                return
 
-    def _merge_results(self):
-        try:
-            res = self.resqueue.get_nowait()
-        except queue.Empty:
-            time.sleep(QUEUE_SLEEP)
-            self.__logger.debug("result queue is empty")
-            return True
+            self.resqueue.put((MERGE_FLOW, time.monotonic(), flow))
+
+    def _merge_flows(self, flow):
+        if flow == SHUTDOWN_SENTINEL:
+            self.__logger.debug("stopping flow merging on sentinel")
+            return False
+
+        if isinstance(flow, FlowBatch):
+            for batched_flow in flow:
+                self._merge_flow(batched_flow)
         else:
-            if res == SHUTDOWN_SENTINEL:
-                self.__logger.debug("stopping result merging on sentinel")
-                return False
-            if 'spdr_state' in res.keys() and res['spdr_state'] == CONN_SKIPPED:
-                # handle skipped results
-                return True
-
-            reskey = self._key(res)
-            self.__logger.debug("got a result (" + repr(reskey) + ")")
-
-            if reskey in self.restab and res['sp'] == PORT_FAILED:
-                # both connections failed, but need to be distinguished
-                reskey = (reskey[0], PORT_FAILED_AGAIN)
-
-            if reskey in self.flowtab:
-                self.__logger.debug("merging result")
-                self.merge(self.flowtab[reskey], res)
-                del self.flowtab[reskey]
-            elif reskey in self.restab:
-                self.__logger.debug("won't merge duplicate result")
-            else:
-                self.restab[reskey] = res
+            self._merge_flow(flow)
+        return True
+
+    def _merge_flow(self, flow):
+        flowkey = self._key(flow)
+        self.__logger.debug("got a flow (" + repr(flowkey) + ")")
+
+        if flowkey in self.restab:
+            self.__logger.debug("merging flow")
+            self.merge(flow, self.restab[flowkey])
+            del self.restab[flowkey]
+        elif flowkey in self.flowtab:
+            self.__logger.debug("won't merge duplicate flow")
+        elif (self.expected is not None and
+              not self.expected.is_expected(flowkey)):
+            self.__logger.debug("discarding unexpected flow")
+        else:
+            # Create a new flow
+            self.flowtab[flowkey] = flow
 
-            self.resqueue.task_done()
+            # And reap the oldest, if the reap queue is full
+            self.flowreap.append(flowkey)
+            if len(self.flowreap) > self.flowreap_size:
+                try:
+                    del self.flowtab[self.flowreap.popleft()]
+                except KeyError:
+                    pass
+
+    def _merge_results(self, res):
+        if res == SHUTDOWN_SENTINEL:
+            self.__logger.debug("stopping result merging on sentinel")
+            return False
+        if 'spdr_state' in res.keys() and res['spdr_state'] == CONN_SKIPPED:
+            # handle skipped results, for which no flow will be merged
+            if self.expected is not None and 'sp' in res:
+                self.expected.discard(self._key(res))
             return True
+        if len(self.chains) == 0:
+            # there's no observer, so there will be no flows
+            self.merge(NO_FLOW, res)
+            return True
+
+        reskey = self._key(res)
+        self.__logger.debug("got a result (" + repr(reskey) + ")")
+
+        if reskey in self.restab and res['sp'] == PORT_FAILED:
+            # both connections failed, but need to be distinguished
+            reskey = (reskey[0], PORT_FAILED_AGAIN)
+
+        if reskey in self.flowtab:
+            self.__logger.debug("merging result")
+            self.merge(self.flowtab[reskey], res)
+            del self.flowtab[reskey]
+        elif reskey in self.restab:
+            self.__logger.debug("won't merge duplicate result")
+        else:
+            self.restab[reskey] = res
+            self.resreap.append(
+                (time.monotonic() + self.result_timeout, reskey, res))
+
+        # a flow for this result will now be matched through the restab
+        if self.expected is not None:
+            self.expected.discard(self._key(res))
+
+        return True
 
     def merger(self):
         """
         Thread to merge results from the workers and the observer.
+
+        Results and flows arrive on the same queue, so the merger wakes up as
+        soon as either is available. Everything that has arrived by then is
+        merged in one batch. The time each item spent waiting in the queue is
+        recorded in :attr:`merge_latency`.
+
+        Results that find no flow within :attr:`result_timeout` seconds are
+        merged with :data:`NO_FLOW`, rather than being held until shutdown.
+        Jobs whose configurations have not all been merged within
+        :attr:`compare_timeout` seconds are dropped.
+
+        If more than one merger was requested, this thread only passes each
+        result and flow on to the merger process for its address, and the
+        merging is done by those processes.
         """
 
-        if len(self.chains) == 0:
-            self.__logger.warning("Merger is not expecting flows from the Observer")
-            # Immediately merge with NO_FLOW when there's no chains, as there's
-            # going to also be no observer and so no flows.
-            while self.running:
-                try:
-                    res = self.resqueue.get_nowait()
-                except queue.Empty:
-                    time.sleep(QUEUE_SLEEP)
-                    self.__logger.debug("result queue is empty")
-                    continue
-                if res == SHUTDOWN_SENTINEL:
-                    break
-                if not ('spdr_state' in res.keys() and res['spdr_state'] == CONN_SKIPPED):
-                    self.merge(NO_FLOW, res)
+        if self.merger_count > 1:
+            self._route_merges()
         else:
-            merging_flows = True
-            merging_results = True
+            self._merge_loop(self.resqueue)
 
-            while self.running and (merging_results or merging_flows):
+    def _next_merge_items(self, inqueue):
+        items = []
+        try:
+            items.append(inqueue.get(timeout=QUEUE_SLEEP))
+            while len(items) < MERGE_BATCH_SIZE:
+                items.append(inqueue.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    def _merge_loop(self, inqueue):
+        merging_results = True
+        merging_flows = len(self.chains) > 0
+        if not merging_flows:
+            self.__logger.warning("Merger is not expecting flows from the Observer")
 
-                if merging_flows and self.flowqueue.qsize() >= self.resqueue.qsize():
-                    merging_flows = self._merge_flows()
+        while self.running and (merging_results or merging_flows):
+            items = self._next_merge_items(inqueue)
+
+            now = time.monotonic()
+            for (source, enqueued, item) in items:
+                self.merge_latency.append(now - enqueued)
+                if source == MERGE_FLOW:
+                    merging_flows = self._merge_flows(item)
+                elif source == MERGE_JOB:
+                    (jobId, job) = item
+                    if len(job.get('missing_configs', ())) == self._config_count: # pylint: disable=no-member
+                        # abandoned before any of its connections completed,
+                        # so there are no results to wait for
+                        self._complete_job(job, [])
+                    else:
+                        self.jobtab[jobId] = job
+                else:
+                    merging_results = self._merge_results(item)
+                inqueue.task_done()
 
-                elif merging_results:
-                    merging_results = self._merge_results()
+            self._expire_results(now)
+            if self.combiner_pool is not None:
+                self._flush_combine_batch(now)
 
         # One more pass during shutdown, to clean up any leftovers
         for res_item in self.restab.items():
             res = res_item[1]
             self.merge(NO_FLOW, res)
+        self.restab.clear()
+        self.resreap.clear()
+        # any jobs still waiting for results will not get them now
+        self._expire_results(float('inf'))
+
+        # wait for the combiners to pass on the last jobs
+        if self.combiner_pool is not None:
+            self._flush_combine_batch()
+            self.combiner_pool.close()
+            if self.running:
+                self.combiner_pool.join()
+
+        if self.expired_results > 0 or self.expired_jobs > 0:
+            self.__logger.info("expired %d results without a flow and %d "
+                               "incomplete jobs", self.expired_results,
+                               self.expired_jobs)
+        if self.late_results > 0:
+            self.__logger.info("dropped %d results that arrived after their "
+                               "jobs expired", self.late_results)
+        percentiles = self.merge_latency_percentiles()
+        if percentiles is not None:
+            self.__logger.info("merge latency: 50%% %.3fs, 90%% %.3fs, "
+                               "99%% %.3fs, max %.3fs", *percentiles)
+
+    def _merger_shard(self, address):
+        return hash(address) % self.merger_count
+
+    def _shard_flows(self, flow):
+        """
+        Split flows from an observer between the merger processes, by the
+        address that the merger keys them on.
+
+        :return: A list of ``(shard, flows)`` pairs
+        :rtype: list
+        """
+
+        field = 'sip' if self.server_mode else 'dip'
+        if isinstance(flow, FlowBatch):
+            if field in flow.names:
+                index = flow.names.index(field)
+                shards = collections.defaultdict(list)
+                for row in flow.rows:
+                    shards[self._merger_shard(row[index])].append(row)
+                return [(shard, FlowBatch(flow.names, rows))
+                        for (shard, rows) in shards.items()]
+            flows = list(flow)
+        else:
+            flows = [flow]
+        return [(self._merger_shard(f[field]), f) for f in flows]
+
+    def _route_merges(self):
+        """
+        Pass results and flows on to the merger processes. All configurations
+        of a job have the same address, so each job is merged and compared by
+        a single merger process, which is sent the job record along with the
+        first of its results.
+        """
+
+        merging_results = True
+        merging_flows = len(self.chains) > 0
+
+        while self.running and (merging_results or merging_flows):
+            items = self._next_merge_items(self.resqueue)
+
+            now = time.monotonic()
+            for (source, enqueued, item) in items:
+                self.merge_latency.append(now - enqueued)
+                if item == SHUTDOWN_SENTINEL:
+                    for merge_queue in self.merge_queues:
+                        merge_queue.put((source, enqueued, item))
+                    if source == MERGE_FLOW:
+                        merging_flows = False
+                    else:
+                        merging_results = False
+                elif source == MERGE_FLOW:
+                    for (shard, flows) in self._shard_flows(item):
+                        self.merge_queues[shard].put(
+                            (MERGE_FLOW, enqueued, flows))
+                elif source == MERGE_JOB:
+                    job = item[1]
+                    address = job['sip'] if self.server_mode else job['dip']
+                    self.merge_queues[self._merger_shard(address)].put(
+                        (MERGE_JOB, enqueued, item))
+                else:
+                    address = item['sip'] if self.server_mode else item['dip']
+                    merge_queue = self.merge_queues[
+                        self._merger_shard(address)]
+                    job = self.jobtab.pop(item['jobId'], None)
+                    if job is not None:
+                        merge_queue.put(
+                            (MERGE_JOB, enqueued, (item['jobId'], job)))
+                    merge_queue.put((MERGE_RESULT, enqueued, item))
+                self.resqueue.task_done()
+
+        if self.running:
+            # wait for the merger processes to pass on their last results
+            self.merge_collector_thread.join()
+            for merger_process in self.merger_processes:
+                merger_process.join()
+            self.__logger.debug("merger processes joined")
+
+    def _merger_process(self, shard):
+        """
+        Merge the results and flows for one shard of the addresses, in a
+        merger process. Merged jobs are passed back to the spider process on
+        :attr:`merged_queue`, followed by
+        :data:`SHUTDOWN_SENTINEL`.
+        """
+
+        # the registry of expected flows is only kept up to date in the
+        # spider process, and flows were already filtered by the observers
+        self.expected = None
+        self.outqueue = self.merged_queue
+        try:
+            self._merge_loop(self.merge_queues[shard])
+        except: # pylint: disable=W0702
+            self.__logger.exception("exception occurred in merger %d", shard)
+        finally:
+            self.merged_queue.put(SHUTDOWN_SENTINEL)
+
+    def _collect_merged(self):
+        """
+        Thread to pass jobs merged by the merger processes on to the output
+        queue.
+        """
+
+        running = self.merger_count
+        while running > 0:
+            job = self.merged_queue.get()
+            if job == SHUTDOWN_SENTINEL:
+                running -= 1
+            else:
+                self.outqueue.put(job)
+
+    def _expire_results(self, now):
+        """
+        Merge results that have waited too long for a flow with
+        :data:`NO_FLOW`, and pass on jobs that have waited too long for the
+        results of their other configurations without them, as described for
+        :meth:`combine_job`. The oldest entries are also
+        expired whenever either table holds more than
+        :attr:`merge_table_size` entries.
+
+        :param now: The current time, from :func:`time.monotonic`
+        :type now: float
+        """
+
+        while self.resreap:
+            (deadline, reskey, res) = self.resreap[0]
+            if deadline > now and len(self.restab) <= self.merge_table_size:
+                break
+            self.resreap.popleft()
+            if self.restab.get(reskey) is res:
+                # still waiting for a flow
+                del self.restab[reskey]
+                self.expired_results += 1
+                self.merge(NO_FLOW, res)
+
+        while self.comparereap:
+            (deadline, jobId) = self.comparereap[0]
+            if (deadline > now and
+                    len(self.comparetab) <= self.merge_table_size):
+                break
+            self.comparereap.popleft()
+            flows = self.comparetab.pop(jobId, None)
+            if flows is not None:
+                # a result for another configuration was lost
+                self.__logger.warning("expiring incomplete job %s with %d "
+                                      "of %d configurations", jobId,
+                                      len(flows), self._config_count) # pylint: disable=no-member
+                self.expired_jobs += 1
+                job = self.jobtab.pop(jobId, None)
+                if job is not None:
+                    self._complete_job(job, flows)
+
+    def merge_latency_percentiles(self, percentiles=(50, 90, 99, 100)):
+        """
+        Get percentiles of the time that recent results and flows spent
+        waiting for the merger.
+
+        :param percentiles: The percentiles to get
+        :type percentiles: tuple(float)
+        :return: The latency in seconds at each percentile, or ``None`` if
+                 nothing has been merged
+        :rtype: list(float)
+        """
+
+        latency = sorted(self.merge_latency)
+        if len(latency) == 0:
+            return None
+        return [latency[min(len(latency) - 1,
+                            int(len(latency) * percentile / 100))]
+                for percentile in percentiles]
 
     def merge(self, flow, res):
         """
@@ -316,31 +747,140 @@ class Spider:
 
         self.__logger.debug("Result: " + str(flow))
 
+        if flow['jobId'] not in self.jobtab:
+            # the job was already passed on as incomplete without this
+            # result, and would otherwise be expired again
+            self.late_results += 1
+            return
+
         if flow['jobId'] not in self.comparetab:
             self.comparetab[flow['jobId']] = []
+            self.comparereap.append(
+                (time.monotonic() + self.compare_timeout, flow['jobId']))
         self.comparetab[flow['jobId']].append(flow)
 
-        if len(self.comparetab[flow['jobId']]) == self._config_count: # pylint: disable=no-member
+        # the connections of an abandoned job that did not complete were
+        # never passed on for merge
+        missing = self.jobtab[flow['jobId']].get('missing_configs', ())
+        if (len(self.comparetab[flow['jobId']]) + len(missing) ==
+                self._config_count): # pylint: disable=no-member
             flows = self.comparetab.pop(flow['jobId'])
-            flows.sort(key=lambda x: x['config'])
+            self._complete_job(self.jobtab.pop(flow['jobId']), flows)
+
+    def _complete_job(self, job, flows):
+        """
+        Pass on a job with the flows merged for its configurations, to have
+        its conditions added and be output.
+
+        :param job: The job record
+        :type job: dict
+        :param flows: The merged flows, which for a job that expired before
+                      the results of all of its configurations arrived are
+                      only those that did arrive
+        :type flows: list(dict)
+        """
+
+        flows.sort(key=lambda x: x['config'])
+        job['flow_results'] = flows
+        if len(flows) > 0:
             start = min([flow['spdr_start'] for flow in flows])
             stop = max([flow['spdr_stop'] for flow in flows])
-            job = self.jobtab.pop(flow['jobId'])
-            job['flow_results'] = flows
             job['time'] = {'from': start, 'to': stop}
-            job['missed_flows'] = 0
-            for flow in flows:
-                if not flow['observed']:
-                    job['missed_flows'] = job['missed_flows'] + 1
-            job['conditions'] = self.combine_flows(flows)
-            if job['conditions'] is not None:
-                if "pathspider.not_observed" in job['conditions']:
-                    self.__logger.debug("At least one flow was not observed and so conditions could not be fully generated (if at all)")
-                if job['missed_flows'] > 0:
-                    job['conditions'].append("pathspider.missed_flows:" + str(job['missed_flows']))
-            else:
-                job.pop('conditions')
+        job['missed_flows'] = 0
+        for flow in flows:
+            if not flow['observed']:
+                job['missed_flows'] = job['missed_flows'] + 1
+        if len(flows) < self._config_count: # pylint: disable=no-member
+            merged = {flow['config'] for flow in flows}
+            job['missing_configs'] = [
+                config for config in range(self._config_count) # pylint: disable=no-member
+                if config not in merged]
+        if self.combiner_pool is None:
+            self.combine_job(job)
             self.outqueue.put(job)
+        else:
+            if len(self.combine_batch) == 0:
+                self.combine_batch_start = time.monotonic()
+            self.combine_batch.append(job)
+            if len(self.combine_batch) >= COMBINE_BATCH_SIZE:
+                self._flush_combine_batch()
+
+    def combine_job(self, job):
+        """
+        Add the conditions for a job, once all of its flows have been merged,
+        using :meth:`combine_flows`. A job missing the results of some of its
+        configurations, listed in ``missing_configs``, is not combined, and
+        is given the ``pathspider.incomplete`` condition instead.
+
+        :param job: The job record, with its merged flows in ``flow_results``
+        :type job: dict
+        """
+
+        if 'missing_configs' in job:
+            job['conditions'] = ["pathspider.incomplete"]
+        else:
+            job['conditions'] = self.combine_flows(job['flow_results'])
+        if job['conditions'] is not None:
+            if "pathspider.not_observed" in job['conditions']:
+                self.__logger.debug("At least one flow was not observed and so conditions could not be fully generated (if at all)")
+            if job['missed_flows'] > 0:
+                job['conditions'].append("pathspider.missed_flows:" + str(job['missed_flows']))
+        else:
+            job.pop('conditions')
+
+    def encode_jobs(self, jobs):
+        """
+        Encode job records for output, as one JSON object per line. The
+        merged flows are only included if ``--output-flows`` was given.
+
+        :param jobs: The job records to encode
+        :type jobs: list(dict)
+        :rtype: bytes
+        """
+
+        output_flows = getattr(self.args, 'output_flows', True)
+        lines = []
+        for job in jobs:
+            if not output_flows:
+                job.pop("flow_results", None)
+                job.pop("missed_flows", None)
+            lines.append(json.dumps(job))
+        lines.append("")
+        return "\n".join(lines).encode()
+
+    def _flush_combine_batch(self, now=None):
+        """
+        Hand the batch of completed jobs to the combiner processes, if it is
+        full or, when ``now`` is given, has been waiting for long enough. The
+        encoded jobs are placed on :attr:`outqueue` as a single
+        :class:`bytes` chunk.
+        """
+
+        if len(self.combine_batch) == 0 or (
+                now is not None and len(self.combine_batch) < COMBINE_BATCH_SIZE
+                and now - self.combine_batch_start < COMBINE_BATCH_INTERVAL):
+            return
+        self.combiner_pool.apply_async(
+            _combine_jobs, (self.combine_batch,), callback=self.outqueue.put,
+            error_callback=functools.partial(self._combine_failed,
+                                             len(self.combine_batch)))
+        self.combine_batch = []
+
+    def _combine_failed(self, count, error):
+        """
+        Called by the combiner pool when combining a batch of jobs raised an
+        exception. The jobs of the batch are lost, so PATHspider is
+        terminated, as when any other thread raises an exception.
+        """
+
+        self.__logger.error("combining a batch of %d jobs failed. terminating.",
+                            count, exc_info=error)
+        if self.exception is None:
+            self.exception = error
+        # the pool can't be terminated from its own result handler thread,
+        # which this is called from
+        threading.Thread(target=self.terminate, name="terminate",
+                         daemon=True).start()
 
     def combine_flows(self, flows):
         pass
@@ -356,9 +896,11 @@ class Spider:
             self.terminate()
 
     def _finalise_conns(self, job, jobId, conns):
-        # Pass results on for merge
-        config = 0
-        for conn in conns:
+        # Pass results on for merge; the connections of an abandoned job
+        # that did not complete are None
+        for (config, conn) in enumerate(conns):
+            if conn is None:
+                continue
             conn['spdr_stop'] = str(datetime.utcnow())
             conn['config'] = config
             if self.server_mode:
@@ -366,8 +908,7 @@ class Spider:
             else:
                 conn['dip'] = job['dip']
             conn['jobId'] = jobId
-            self.resqueue.put(conn)
-            config += 1
+            self.resqueue.put((MERGE_RESULT, time.monotonic(), conn))
 
     def start(self):
         """
@@ -375,12 +916,20 @@ class Spider:
 
          * Setting the running flag
          * Create and start an observer
-         * Start the merger thread
+         * Start the merger thread, and any merger processes
          * Start the configurator thread
          * Start the worker threads
 
         The number of worker threads to start was given when activating the
-        plugin.
+        plugin. If more than one observer was requested, and the plugin uses
+        the observer, that many observer processes are started, each
+        analysing its own shard of the traffic and all feeding the same flow
+        queue. Likewise, if more than one merger was requested, that many
+        merger processes are started, each merging the results and flows for
+        its own share of the target addresses. Otherwise, if combiners were
+        requested, a pool of that many processes is started to combine and
+        encode completed jobs, which are then placed on :attr:`outqueue` in
+        encoded chunks of :class:`bytes` rather than as job records.
         """
 
         self.__logger.info("starting pathspider")
@@ -393,17 +942,59 @@ class Spider:
             # set the running flag
             self.running = True
 
-            # create an observer and start its process
-            self.observer = self.create_observer()
-            self.observer_process = mp.Process(
-                args=(self.observer.run_flow_enqueuer,
-                      self.flowqueue,
-                      self.observer_shutdown_queue),
-                target=self.exception_wrapper,
-                name='observer',
-                daemon=True)
-            self.observer_process.start()
-            self.__logger.debug("observer forked")
+            # create the observers and start their processes
+            if len(self.chains) == 0:
+                self.observer_count = 1
+            self.observers_running = self.observer_count
+            if len(self.chains) > 0:
+                self.expected = self.create_expected_flows()
+            self.observer_processes = []
+            for shard in range(self.observer_count):
+                observer = self.create_observer(shard)
+                observer_process = mp.Process(
+                    args=(observer.run_flow_enqueuer,
+                          self.flowqueue,
+                          self.observer_shutdown_queue,
+                          FLOW_BATCH_SIZE,
+                          FLOW_BATCH_INTERVAL),
+                    target=self.exception_wrapper,
+                    name='observer_{}'.format(shard),
+                    daemon=True)
+                self.observer_processes.append(observer_process)
+                observer_process.start()
+            if self.expected is not None:
+                self.expected.views_started()
+            self.__logger.debug("%d observer(s) forked", self.observer_count)
+
+            # fork the merger processes, if any, before starting any threads
+            self.merger_processes = []
+            if self.merger_count > 1:
+                self.merge_queues = [mp.JoinableQueue(QUEUE_SIZE)
+                                     for _ in range(self.merger_count)]
+                self.merged_queue = mp.Queue(QUEUE_SIZE)
+                for shard in range(self.merger_count):
+                    merger_process = mp.Process(
+                        args=(shard,),
+                        target=self._merger_process,
+                        name='merger_{}'.format(shard),
+                        daemon=True)
+                    self.merger_processes.append(merger_process)
+                    merger_process.start()
+                self.__logger.debug("%d merger(s) forked", self.merger_count)
+
+                self.merge_collector_thread = threading.Thread(
+                    target=self._collect_merged,
+                    name="merge_collector",
+                    daemon=True)
+                self.merge_collector_thread.start()
+            elif self.combiner_count > 0:
+                # combine jobs in a pool of processes, started before any
+                # threads so that each has a copy of this spider
+                self.combiner_pool = mp.Pool(self.combiner_count,
+                                             initializer=_init_combiner,
+                                             initargs=(self,))
+                self.__logger.debug("%d combiner(s) forked",
+                                    self.combiner_count)
 
             # now start up ecnspider, backwards
             self.merger_thread = threading.Thread(
@@ -414,6 +1005,15 @@ class Spider:
             self.merger_thread.start()
             self.__logger.debug("merger up")
 
+            if len(self.chains) > 0:
+                self.flow_reader_thread = threading.Thread(
+                    args=(self._read_flows,),
+                    target=self.exception_wrapper,
+                    name="flow_reader",
+                    daemon=True)
+                self.flow_reader_thread.start()
+                self.__logger.debug("flow reader up")
+
             self.configurator_thread = threading.Thread(
                 args=(self.configurator,),
                 target=self.exception_wrapper,
@@ -459,13 +1059,20 @@ class Spider:
                     worker.join()
             self.__logger.debug("all workers joined")
 
-            # Tell observer to shut down
-            self.observer_shutdown_queue.put(True)
-            self.observer_process.join()
+            # Write any announcements to the observers still queued
+            if self.expected is not None:
+                self.expected.close()
+
+            # Tell observers to shut down
+            for _ in self.observer_processes:
+                self.observer_shutdown_queue.put(True)
+            for observer_process in self.observer_processes:
+                observer_process.join()
             self.__logger.debug("observer shutdown")
 
             # Tell merger to shut down
-            self.resqueue.put(SHUTDOWN_SENTINEL)
+            self.resqueue.put((MERGE_RESULT, time.monotonic(),
+                               SHUTDOWN_SENTINEL))
             self.merger_thread.join()
             self.__logger.debug("merger shutdown")
 
@@ -499,8 +1106,9 @@ class Spider:
         self.stopping = True
         self.running = False
 
-        # terminate observer
-        self.observer_shutdown_queue.put(True)
+        # terminate observers
+        for _ in self.observer_processes:
+            self.observer_shutdown_queue.put(True)
 
         # drain queues
         try:
@@ -528,6 +1136,9 @@ class Spider:
                 worker.join()
         self.__logger.debug("all workers joined")
 
+        if self.expected is not None:
+            self.expected.close()
+
         if self.configurator_thread and \
                 (threading.current_thread() != self.configurator_thread):
             self.configurator_thread.join()
@@ -537,9 +1148,19 @@ class Spider:
             self.merger_thread.join()
             self.__logger.debug("merger joined")
 
-        self.observer_process.join()
+        for observer_process in self.observer_processes:
+            observer_process.join()
         self.__logger.debug("observer joined")
 
+        for merger_process in self.merger_processes:
+            merger_process.terminate()
+            merger_process.join()
+        self.__logger.debug("mergers joined")
+
+        if self.combiner_pool is not None:
+            self.combiner_pool.terminate()
+            self.__logger.debug("combiners terminated")
+
         self.outqueue.put(SHUTDOWN_SENTINEL)
         self.__logger.info("termination complete")
 
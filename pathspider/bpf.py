@@ -0,0 +1,124 @@
+"""
+.. module:: pathspider.bpf
+   :synopsis: Builders for BPF capture filters used by the Observer
+
+This module contains functions that build BPF capture filter expressions, in
+the syntax accepted by libpcap and libtrace, for attaching to the Observer's
+packet source so that unwanted packets are dropped in the kernel.
+
+"""
+
+#: The transport protocol used by each type of connection that plugins can
+#: be asked to perform with ``--connect``
+CONNECT_PROTOCOLS = {
+    'tcp': 'tcp',
+    'tcpsyn': 'tcp',
+    'http': 'tcp',
+    'https': 'tcp',
+    'dnstcp': 'tcp',
+    'dnsudp': 'udp',
+}
+
+#: ICMPv4 types carrying a quotation of the packet that caused them
+ICMP4_QUOTATION_TYPES = (3, 4, 5, 11, 12)
+
+#: ICMPv6 types carrying a quotation of the packet that caused them
+ICMP6_QUOTATION_TYPES = (1, 2, 3, 4)
+
+def _any_of(field, values):
+    return "(" + " or ".join("{} == {}".format(field, v) for v in values) + ")"
+
+def shard_filter(shard, shards):
+    """
+    Build a filter selecting one shard of the traffic on an interface, for
+    running several Observers on the same interface.
+
+    Packets are assigned to shards by a hash of their source and destination
+    addresses that is the same in both directions, so all packets of a flow
+    are seen by the same Observer. ICMP messages carrying a quotation are
+    assigned by the addresses in the quotation, so that they reach the same
+    Observer as the flow that caused them. Non-IP packets are only passed to
+    the first shard.
+
+    :param shard: The number of the shard to select, from 0
+    :type shard: int
+    :param shards: The total number of shards
+    :type shards: int
+    :return: A BPF filter expression, or ``None`` if there is only one shard
+    :rtype: str
+    """
+
+    if shards <= 1:
+        return None
+
+    icmp4_quote = "icmp and " + _any_of("icmp[0]", ICMP4_QUOTATION_TYPES)
+    icmp6_quote = "ip6[6] == 58 and " + _any_of("ip6[40]", ICMP6_QUOTATION_TYPES)
+
+    # hash on the low 32 bits of each address
+    clauses = [
+        "(ip and not ({}) and (ip[12:4] ^ ip[16:4]) % {} == {})".format(
+            icmp4_quote, shards, shard),
+        "({} and (icmp[20:4] ^ icmp[24:4]) % {} == {})".format(
+            icmp4_quote, shards, shard),
+        "(ip6 and not ({}) and (ip6[20:4] ^ ip6[36:4]) % {} == {})".format(
+            icmp6_quote, shards, shard),
+        "({} and (ip6[68:4] ^ ip6[84:4]) % {} == {})".format(
+            icmp6_quote, shards, shard),
+    ]
+    if shard == 0:
+        clauses.append("(not ip and not ip6)")
+
+    return " or ".join(clauses)
+
+def traffic_filter(addresses=(), protocols=()):
+    """
+    Build a filter selecting the traffic to or from any of the given
+    addresses that uses one of the given transport protocols. ICMP and ICMPv6
+    messages are always selected when filtering on protocols, as they may
+    carry information about flows using the other protocols.
+
+    :param addresses: The IPv4 and IPv6 addresses to select traffic for. If
+                      empty, traffic is not selected by address. ``None``
+                      entries are ignored.
+    :type addresses: iterable
+    :param protocols: The transport protocols to select, as BPF protocol
+                      names (e.g. ``tcp``). If empty, traffic is not selected
+                      by protocol.
+    :type protocols: iterable
+    :return: A BPF filter expression, or ``None`` if no traffic is excluded
+    :rtype: str
+    """
+
+    clauses = []
+
+    addresses = [address for address in addresses if address]
+    if len(addresses) > 0:
+        clauses.append("(" + " or ".join(
+            "host {}".format(address) for address in addresses) + ")")
+
+    protocols = sorted(set(protocols))
+    if len(protocols) > 0:
+        clauses.append("(" + " or ".join(protocols + ["icmp", "icmp6"]) + ")")
+
+    if len(clauses) == 0:
+        return None
+    return " and ".join(clauses)
+
+def combine_filters(*filters):
+    """
+    Combine filters so that only packets selected by all of them are
+    selected.
+
+    :param filters: BPF filter expressions, any of which may be ``None`` to
+                    select all packets
+    :return: A BPF filter expression, or ``None`` if all of the filters
+             were ``None``
+    :rtype: str
+    """
+
+    filters = [bpf for bpf in filters if bpf is not None]
+    if len(filters) == 0:
+        return None
+    elif len(filters) == 1:
+        return filters[0]
+    return " and ".join("({})".format(bpf) for bpf in filters)
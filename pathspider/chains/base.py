@@ -16,19 +16,27 @@ class Chain:
     class to be directly used by PATHspider plugins.
     """
 
-    def new_flow(self, rec, ip):
+    #: The fields that this chain adds to flow records, as a sequence of
+    #: ``(name, default)`` pairs. Every new flow record starts with these
+    #: fields set to their defaults, which should be immutable values. It is
+    #: recommended to use ``None`` for fields that are only set once something
+    #: has been observed.
+    fields = ()
+
+    def new_flow(self, rec, ip): # pylint: disable=no-self-use,unused-argument
         """
-        This function is called for every new flow to initialise a flow record
-        with the fields that will be used by this chain. It is recommended to
-        initialise all fields to None until other functions have set values for
-        them to make clear which fields are set by this chain and to avoid key
-        errors later.
+        This function is called for every new flow, after the fields declared
+        in :attr:`fields` have been set to their defaults. Chains only need to
+        override it to set fields from the packet that created the flow, or to
+        discard the flow.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IP or IPv6 packet that triggered the creation of a new
                    flow record
         :type ip: plt.ip or plt.ip6
+        :return: True if flow should be kept, False if flow should be discarded
+        :rtype: bool
         """
 
-        raise NotImplementedError("Cannot create a new flow with an abstract Observer chain")
+        return True
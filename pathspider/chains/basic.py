@@ -37,6 +37,18 @@ class BasicChain(Chain):
     +------------+------+-----------------------------------------------------+
     """
 
+    fields = (
+        ('sip', None),
+        ('dip', None),
+        ('proto', None),
+        ('sp', None),
+        ('dp', None),
+        ('pkt_fwd', 0),
+        ('pkt_rev', 0),
+        ('oct_fwd', 0),
+        ('oct_rev', 0),
+    )
+
     def _extract_ports(self, ip):
         if ip.udp:
             return (ip.udp.src_port, ip.udp.dst_port)
@@ -51,14 +63,8 @@ class BasicChain(Chain):
         """
 
         # Extract addresses and ports
-        (rec['sip'], rec['dip'], rec['proto']) = (str(ip.src_prefix), str(ip.dst_prefix), ip.proto)
-        (rec['sp'], rec['dp']) = self._extract_ports(ip)
-
-        # Initialize counters
-        rec['pkt_fwd'] = 0
-        rec['pkt_rev'] = 0
-        rec['oct_fwd'] = 0
-        rec['oct_rev'] = 0
+        (rec.sip, rec.dip, rec.proto) = (str(ip.src_prefix), str(ip.dst_prefix), ip.proto)
+        (rec.sp, rec.dp) = self._extract_ports(ip)
 
         # we want to keep this flow
         return True
@@ -75,10 +81,10 @@ class BasicChain(Chain):
         """
 
         if rev:
-            rec["pkt_rev"] += 1
-            rec["oct_rev"] += ip.size
+            rec.pkt_rev += 1
+            rec.oct_rev += ip.size
         else:
-            rec["pkt_fwd"] += 1
-            rec["oct_fwd"] += ip.size
+            rec.pkt_fwd += 1
+            rec.oct_fwd += ip.size
 
         return True
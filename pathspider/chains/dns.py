@@ -23,22 +23,10 @@ class DNSChain(Chain):
     +------------------------+------+-----------------------------------------+
     """
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``False``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['dns_response_valid'] = False
-
-        return True
+    #: For a new flow, all fields will be initialised to ``False``.
+    fields = (
+        ('dns_response_valid', False),
+    )
 
     def tcp(self, rec, tcp, rev):
         """
@@ -50,7 +38,7 @@ class DNSChain(Chain):
             if it was a response (not a query).
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the TCP packet that was observed to be part of this flow
         :type ip: plt.tcp
         :param rev: ``True`` if the packet was in the reverse direction, ``False`` if
@@ -75,7 +63,7 @@ class DNSChain(Chain):
             if it was a response (not a query).
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the UDP packet that was observed to be part of this flow
         :type ip: plt.udp
         :param rev: ``True`` if the packet was in the reverse direction, ``False`` if
@@ -95,10 +83,10 @@ class DNSChain(Chain):
                 dns = ldns(payload)
                 if dns.is_ok():
                     if dns.is_response:
-                        rec['dns_response_valid'] = True
+                        rec.dns_response_valid = True
         except ImportError:
             raise RuntimeError("python-libtrace is not installed! "
                                "Cannot dissect DNS!")
         except ValueError:
             pass # Wasn't a DNS payload
-        return not rec['dns_response_valid']
+        return not rec.dns_response_valid
@@ -38,24 +38,13 @@ class DSCPChain(Chain):
     +-----------------------+------+------------------------------------------------+
     """
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``None``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['dscp_mark_syn_fwd'] = None
-        rec['dscp_mark_syn_rev'] = None
-        rec['dscp_mark_data_fwd'] = None
-        rec['dscp_mark_data_rev'] = None
-        return True
+    #: For a new flow, all fields will be initialised to ``None``.
+    fields = (
+        ('dscp_mark_syn_fwd', None),
+        ('dscp_mark_syn_rev', None),
+        ('dscp_mark_data_fwd', None),
+        ('dscp_mark_data_rev', None),
+    )
 
     def ip4(self, rec, ip, rev):
         """
@@ -67,7 +56,7 @@ class DSCPChain(Chain):
             relevant field.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv4 packet that was observed to be part of this flow
         :type ip: plt.ip
         :param rev: True if the packet was in the reverse direction, False if
@@ -89,7 +78,7 @@ class DSCPChain(Chain):
             relevant field.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv6 packet that was observed to be part of this flow
         :type ip: plt.ip6
         :param rev: True if the packet was in the reverse direction, False if
@@ -107,7 +96,10 @@ class DSCPChain(Chain):
     
         if ip.tcp:
             if ip.tcp.flags & TCP_SYN == TCP_SYN:
-                rec['dscp_mark_syn_rev' if rev else 'dscp_mark_syn_fwd'] = dscp
+                if rev:
+                    rec.dscp_mark_syn_rev = dscp
+                else:
+                    rec.dscp_mark_syn_fwd = dscp
                 return True
             if ip.version == 4:
                 if ip.pkt_len == (ip.hdr_len + ip.tcp.doff) * 4: # No payload
@@ -117,6 +109,8 @@ class DSCPChain(Chain):
                    return True
     
         # If not TCP or TCP non-SYN
-        data_key = 'dscp_mark_data_rev' if rev else 'dscp_mark_data_fwd'
-        rec[data_key] = rec[data_key] or dscp
+        if rev:
+            rec.dscp_mark_data_rev = rec.dscp_mark_data_rev or dscp
+        else:
+            rec.dscp_mark_data_fwd = rec.dscp_mark_data_fwd or dscp
         return True
@@ -58,25 +58,11 @@ class ECNChain(Chain):
     +-------------------+------+----------------------------------------------------+
     """
 
-    def new_flow(self, rec, ip): # pylint: disable=unused-argument
-        """
-        For a new flow, all fields will be initialised to ``False``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        for d in ['fwd', 'rev']:
-            for t in ['syn', 'data']:
-                for f in ['ect0', 'ect1', 'ce']:
-                    rec['ecn_{}_{}_{}'.format(f, t, d)] = False
-
-        return True
+    #: For a new flow, all fields will be initialised to ``False``.
+    fields = tuple(('ecn_{}_{}_{}'.format(f, t, d), False)
+                   for d in ['fwd', 'rev']
+                   for t in ['syn', 'data']
+                   for f in ['ect0', 'ect1', 'ce'])
 
     def ip4(self, rec, ip, rev):
         """
@@ -87,7 +73,7 @@ class ECNChain(Chain):
             field will be set to ``True``.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv4 packet that was observed to be part of this flow
         :type ip: plt.ip
         :param rev: True if the packet was in the reverse direction, False if
@@ -108,7 +94,7 @@ class ECNChain(Chain):
             field will be set to ``True``.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv6 packet that was observed to be part of this flow
         :type ip: plt.ip6
         :param rev: True if the packet was in the reverse direction, False if
@@ -140,6 +126,6 @@ class ECNChain(Chain):
             else:
                 t = 'data'
             d = 'rev' if rev else 'fwd'
-            rec['{}_{}_{}'.format(ipmark, t, d)] = True
+            setattr(rec, '{}_{}_{}'.format(ipmark, t, d), True)
 
         return True
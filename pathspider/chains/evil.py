@@ -35,25 +35,14 @@ class EvilChain(Chain):
     +-----------------------+------+------------------------------------------------+
     """
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``None``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
+    #: For a new flow, all fields will be initialised to ``None``.
+    fields = (
+        ('evilbit_syn_fwd', None),
+        ('evilbit_syn_rev', None),
+        ('evilbit_data_fwd', None),
+        ('evilbit_data_rev', None),
+    )
 
-        rec['evilbit_syn_fwd'] = None
-        rec['evilbit_syn_rev'] = None
-        rec['evilbit_data_fwd'] = None
-        rec['evilbit_data_rev'] = None
-        return True
-    
     def ip4(self, rec, ip, rev):
         """
         Records evil bit markings from an IPv4 header.
@@ -63,7 +52,7 @@ class EvilChain(Chain):
             the relevant field will record whether the Evil Bit was set.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv4 packet that was observed to be part of this flow
         :type ip: plt.ip
         :param rev: True if the packet was in the reverse direction, False if
@@ -76,7 +65,10 @@ class EvilChain(Chain):
             
         if ip.tcp:
             if ip.tcp.flags & TCP_SYN == TCP_SYN:
-                rec['evilbit_syn_rev' if rev else 'evilbit_syn_fwd'] = evil
+                if rev:
+                    rec.evilbit_syn_rev = evil
+                else:
+                    rec.evilbit_syn_fwd = evil
                 return True
             if ip.version == 4:
                 if ip.pkt_len == (ip.hdr_len + ip.tcp.doff) * 4: # No payload
@@ -86,7 +78,10 @@ class EvilChain(Chain):
                    return True
 
         # If not TCP or TCP non-SYN
-        data_key = 'evilbit_data_rev' if rev else 'evilbit_data_fwd'
-        if rec[data_key] is None:
-            rec[data_key] = evil
+        if rev:
+            if rec.evilbit_data_rev is None:
+                rec.evilbit_data_rev = evil
+                return True
+        elif rec.evilbit_data_fwd is None:
+            rec.evilbit_data_fwd = evil
             return True
@@ -37,21 +37,10 @@ class ICMPChain(Chain):
     +----------------------+--------+-------------------------------------------------------------+
     """
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``False``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['icmp_unreachable'] = False
-        return True
+    #: For a new flow, all fields will be initialised to ``False``.
+    fields = (
+        ('icmp_unreachable', False),
+    )
 
     def icmp4(self, rec, ip, q, rev): # pylint: disable=no-self-use,unused-argument
         """
@@ -62,7 +51,7 @@ class ICMPChain(Chain):
             message is seen in the reverse direction.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv4 packet that was observed to be part of this flow
                    and contained an ICMPv4 header
         :type ip: plt.ip
@@ -78,8 +67,8 @@ class ICMPChain(Chain):
         """
 
         if rev and ip.icmp.type == ICMP4_UNREACHABLE:
-            rec['icmp_unreachable'] = True
-        return not rec['icmp_unreachable']
+            rec.icmp_unreachable = True
+        return not rec.icmp_unreachable
 
     def icmp6(self, rec, ip6, q, rev): # pylint: disable=no-self-use,unused-argument
         """
@@ -90,7 +79,7 @@ class ICMPChain(Chain):
             message is seen in the reverse direction.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv6 packet that was observed to be part of this flow
                    and contained an ICMPv6 header
         :type ip: plt.ip6
@@ -106,5 +95,5 @@ class ICMPChain(Chain):
         """
 
         if rev and ip6.icmp6.type == ICMP6_UNREACHABLE:
-            rec['icmp_unreachable'] = True
-        return not rec['icmp_unreachable']
+            rec.icmp_unreachable = True
+        return not rec.icmp_unreachable
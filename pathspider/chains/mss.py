@@ -34,25 +34,13 @@ class MSSChain(Chain):
     +------------------+--------+-----------------------------------------------------------------+
     """
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``None``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['mss_len_fwd'] = None
-        rec['mss_len_rev'] = None
-        rec['mss_value_fwd'] = None
-        rec['mss_value_rev'] = None
-
-        return True
+    #: For a new flow, all fields will be initialised to ``None``.
+    fields = (
+        ('mss_len_fwd', None),
+        ('mss_len_rev', None),
+        ('mss_value_fwd', None),
+        ('mss_value_rev', None),
+    )
 
     def tcp(self, rec, tcp, rev): # pylint: disable=unused-argument
         """
@@ -64,7 +52,7 @@ class MSSChain(Chain):
             option will be recorded in the flow.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the TCP segment that was observed to be part of this flow
         :type ip: plt.tcp
         :param rev: True if the packet was in the reverse direction, False if
@@ -82,8 +70,12 @@ class MSSChain(Chain):
 
         if TO_MSS in opts:
             mss = bytes(opts[TO_MSS])
-            rec['mss_len_' + ('rev' if rev else 'fwd')] = len(mss) + 2
-            rec['mss_value_' + ('rev' if rev else 'fwd')] = int.from_bytes(mss, byteorder="big")
+            if rev:
+                rec.mss_len_rev = len(mss) + 2
+                rec.mss_value_rev = int.from_bytes(mss, byteorder="big")
+            else:
+                rec.mss_len_fwd = len(mss) + 2
+                rec.mss_value_fwd = int.from_bytes(mss, byteorder="big")
 
         # tell observer to keep going
         return True
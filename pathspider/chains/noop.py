@@ -17,16 +17,21 @@ class NoOpChain(Chain):
     for the purpose of documentation and testing.
     """
 
+    #: The fields that this chain adds to flow records, as a sequence of
+    #: ``(name, default)`` pairs. Every new flow record starts with these
+    #: fields set to their defaults.
+    fields = ()
+
     def new_flow(self, rec, ip): # pylint: disable=unused-argument
         """
-        This function is called for every new flow to initialise a flow record
-        with the fields that will be used by this chain. It is recommended to
-        initialise all fields to None until other functions have set values for
-        them to make clear which fields are set by this chain and to avoid key
-        errors later.
+        This function is called for every new flow, after the fields declared
+        in ``fields`` have been set to their defaults. It can be used to set
+        fields from the packet that created the flow. If a chain does not need
+        to do this, or to discard flows, it does not need to provide this
+        function.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IP or IPv6 packet that triggered the creation of a new
                    flow record
         :type ip: plt.ip or plt.ip6
@@ -41,7 +46,7 @@ class NoOpChain(Chain):
         to record details for fields present in the IPv4 header.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv4 packet that was observed to be part of this flow
         :type ip: plt.ip
         :param rev: True if the packet was in the reverse direction, False if
@@ -60,7 +65,7 @@ class NoOpChain(Chain):
         to record details for fields present in the IPv6 header.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv6 packet that was observed to be part of this flow
         :type ip: plt.ip6
         :param rev: True if the packet was in the reverse direction, False if
@@ -85,7 +90,7 @@ class NoOpChain(Chain):
                   message
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv4 packet that was observed to be part of this flow
                    and contained an ICMPv4 header
         :type ip: plt.ip
@@ -114,7 +119,7 @@ class NoOpChain(Chain):
                   message
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param ip: the IPv6 packet that was observed to be part of this flow
                    and contained an ICMPv6 header
         :type ip: plt.ip6
@@ -137,7 +142,7 @@ class NoOpChain(Chain):
         to record details for fields present in the TCP header.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the TCP segment that was observed to be part of this flow
         :type ip: plt.tcp
         :param rev: True if the packet was in the reverse direction, False if
@@ -156,7 +161,7 @@ class NoOpChain(Chain):
         to record details for fields present in the UDP header.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the UDP segment that was observed to be part of this flow
         :type ip: plt.udp
         :param rev: True if the packet was in the reverse direction, False if
@@ -135,31 +135,17 @@ class TCPChain(Chain):
     +----------------------+------+---------------------------------------------------------+
     """
 
-    def new_flow(self, rec, ip): # pylint: disable=W0613
-        """
-        For a new flow, all fields will be initialised to ``False`` except
-        ``tcp_synflags_*`` which will be set to ``None``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['tcp_synflags_fwd'] = None
-        rec['tcp_synflags_rev'] = None
-
-        rec['tcp_fin_fwd'] = False
-        rec['tcp_fin_rev'] = False
-        rec['tcp_rst_fwd'] = False
-        rec['tcp_rst_rev'] = False
-
-        rec['tcp_connected'] = False
-
-        return True
+    #: For a new flow, all fields will be initialised to ``False`` except
+    #: ``tcp_synflags_*`` which will be set to ``None``.
+    fields = (
+        ('tcp_synflags_fwd', None),
+        ('tcp_synflags_rev', None),
+        ('tcp_fin_fwd', False),
+        ('tcp_fin_rev', False),
+        ('tcp_rst_fwd', False),
+        ('tcp_rst_rev', False),
+        ('tcp_connected', False),
+    )
 
     def tcp(self, rec, tcp, rev):
         """
@@ -186,7 +172,7 @@ class TCPChain(Chain):
             considered complete.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the TCP segment that was observed to be part of this flow
         :type ip: plt.tcp
         :param rev: True if the packet was in the reverse direction, False if
@@ -198,25 +184,28 @@ class TCPChain(Chain):
         """
 
         if tcp.syn_flag:
-            rec['tcp_synflags_rev' if rev else 'tcp_synflags_fwd'] = tcp.flags
+            if rev:
+                rec.tcp_synflags_rev = tcp.flags
+            else:
+                rec.tcp_synflags_fwd = tcp.flags
 
         # This test is intended to catch the completion of the 3WHS.
-        if (not rec['tcp_connected'] and rev == 0 and
-                rec['tcp_synflags_fwd'] is not None and
-                rec['tcp_synflags_rev'] is not None and
-                rec['tcp_synflags_fwd'] & TCP_SYN == TCP_SYN and
-                rec['tcp_synflags_rev'] & TCP_SA == TCP_SA and
+        if (not rec.tcp_connected and rev == 0 and
+                rec.tcp_synflags_fwd is not None and
+                rec.tcp_synflags_rev is not None and
+                rec.tcp_synflags_fwd & TCP_SYN == TCP_SYN and
+                rec.tcp_synflags_rev & TCP_SA == TCP_SA and
                 tcp.ack_flag):
-            rec['tcp_connected'] = True
+            rec.tcp_connected = True
 
         if tcp.fin_flag and rev:
-            rec['tcp_fin_fwd'] = True
+            rec.tcp_fin_fwd = True
         if tcp.fin_flag and not rev:
-            rec['tcp_fin_rev'] = True
+            rec.tcp_fin_rev = True
         if tcp.rst_flag and rev:
-            rec['tcp_rst_rev'] = True
+            rec.tcp_rst_rev = True
         if tcp.rst_flag and not rev:
-            rec['tcp_rst_fwd'] = True
+            rec.tcp_rst_fwd = True
 
-        return not ((rec['tcp_fin_fwd'] and rec['tcp_fin_rev']) or
-                    rec['tcp_rst_fwd'] or rec['tcp_rst_rev'])
+        return not ((rec.tcp_fin_fwd and rec.tcp_fin_rev) or
+                    rec.tcp_rst_fwd or rec.tcp_rst_rev)
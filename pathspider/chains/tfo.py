@@ -56,28 +56,16 @@ class TFOChain(Chain):
         else:
             return (None, None)
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``int(0)``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['tfo_synkind'] = 0
-        rec['tfo_ackkind'] = 0
-        rec['tfo_synclen'] = 0
-        rec['tfo_ackclen'] = 0
-        rec['tfo_seq'] = 0
-        rec['tfo_dlen'] = 0
-        rec['tfo_ack'] = 0
-
-        return True
+    #: For a new flow, all fields will be initialised to ``int(0)``.
+    fields = (
+        ('tfo_synkind', 0),
+        ('tfo_ackkind', 0),
+        ('tfo_synclen', 0),
+        ('tfo_ackclen', 0),
+        ('tfo_seq', 0),
+        ('tfo_dlen', 0),
+        ('tfo_ack', 0),
+    )
 
     def tcp(self, rec, tcp, rev): # pylint: disable=unused-argument
         """
@@ -106,7 +94,7 @@ class TFOChain(Chain):
             direction will be recorded in the ``tfo_ack`` field.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the TCP segment that was observed to be part of this flow
         :type ip: plt.tcp
         :param rev: True if the packet was in the reverse direction, False if
@@ -124,19 +112,19 @@ class TFOChain(Chain):
         if tcp.syn_flag and not tcp.ack_flag:
             (tfo_kind, tfo_cookie) = self._cookie(tcp)
             if tfo_kind is not None:
-                rec['tfo_synkind'] = tfo_kind
-                rec['tfo_synclen'] = len(tfo_cookie)
-                rec['tfo_seq'] = tcp.seq_nbr
-                rec['tfo_dlen'] = len(tcp.data) - tcp.doff*4
-                rec['tfo_ack'] = 0
+                rec.tfo_synkind = tfo_kind
+                rec.tfo_synclen = len(tfo_cookie)
+                rec.tfo_seq = tcp.seq_nbr
+                rec.tfo_dlen = len(tcp.data) - tcp.doff*4
+                rec.tfo_ack = 0
 
         # Look for ACK of TFO data (and cookie)
-        elif tcp.syn_flag and tcp.ack_flag and rec['tfo_synkind']:
-            rec['tfo_ack'] = tcp.ack_nbr
+        elif tcp.syn_flag and tcp.ack_flag and rec.tfo_synkind:
+            rec.tfo_ack = tcp.ack_nbr
             (tfo_kind, tfo_cookie) = self._cookie(tcp)
             if tfo_kind is not None:
-                rec['tfo_ackkind'] = tfo_kind
-                rec['tfo_ackclen'] = len(tfo_cookie)
+                rec.tfo_ackkind = tfo_kind
+                rec.tfo_ackclen = len(tfo_cookie)
 
         # tell observer to keep going
         return True
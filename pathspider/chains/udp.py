@@ -27,29 +27,18 @@ class UDPChain(Chain):
     +---------------------------+------+---------------------------------------+
     """
 
-    def new_flow(self, rec, ip):
-        """
-        For a new flow, all fields will be initialised to ``None``.
-
-        :param rec: the flow record
-        :type rec: dict
-        :param ip: the IP or IPv6 packet that triggered the creation of a new
-                   flow record
-        :type ip: plt.ip or plt.ip6
-        :return: Always ``True``
-        :rtype: bool
-        """
-
-        rec['udp_zero_checksum_fwd'] = None
-        rec['udp_zero_checksum_rev'] = None
-        return True
+    #: For a new flow, all fields will be initialised to ``None``.
+    fields = (
+        ('udp_zero_checksum_fwd', None),
+        ('udp_zero_checksum_rev', None),
+    )
 
     def udp(self, rec, udp, rev):
         """
         Records details from UDP datagram about the UDP header.
 
         :param rec: the flow record
-        :type rec: dict
+        :type rec: pathspider.flowrecord.FlowRecord
         :param tcp: the UDP packet that was observed to be part of this flow
         :type ip: plt.udp
         :param rev: ``True`` if the packet was in the reverse direction, ``False`` if
@@ -59,6 +48,9 @@ class UDPChain(Chain):
         :rtype: bool
         """
 
-        rec['udp_zero_checksum_rev' if rev else 'udp_zero_checksum_fwd'] = udp.checksum == 0
+        if rev:
+            rec.udp_zero_checksum_rev = udp.checksum == 0
+        else:
+            rec.udp_zero_checksum_fwd = udp.checksum == 0
 
         return True
@@ -11,6 +11,9 @@ from straight.plugin import load
 from pathspider.base import PluggableSpider
 from pathspider.base import SHUTDOWN_SENTINEL
 from pathspider.network import interface_up
+from pathspider.writer import COMPRESSION_SUFFIXES
+from pathspider.writer import OutputWriter
+from pathspider.writer import compression_for
 
 plugins = load("pathspider.plugins", subclasses=PluggableSpider)
 
@@ -94,17 +97,29 @@ def run_measurement(args):
 
         threading.Thread(target=job_feeder, args=(args.input, spider)).start()
 
-        with open(args.output, 'w') as outputfile:
-            logger.info("opening output file "+args.output)
+        compression = args.compress
+        if compression is None:
+            compression = compression_for(args.output)
+        rotate_size = None
+        if args.rotate_size is not None:
+            rotate_size = args.rotate_size * 1000000
+
+        with OutputWriter(args.output, compression=compression,
+                          threads=args.compress_threads,
+                          rotate_size=rotate_size,
+                          rotate_interval=args.rotate_interval,
+                          write_metadata=not args.output.startswith("/dev/")
+                          ) as outputfile:
             while True:
                 result = spider.outqueue.get()
                 if result == SHUTDOWN_SENTINEL:
                     logger.info("output complete")
                     break
-                if not args.output_flows:
-                    result.pop("flow_results", None)
-                    result.pop("missed_flows", None)
-                outputfile.write(json.dumps(result) + "\n")
+                if isinstance(result, bytes):
+                    # already encoded by the combiners
+                    outputfile.write(result)
+                else:
+                    outputfile.write(spider.encode_jobs([result]))
                 logger.debug("wrote a result")
                 spider.outqueue.task_done()
 
@@ -127,6 +142,21 @@ def register_args(subparsers):
                         help="The interface to use for the observer. (Default: eth0)")
     parser.add_argument('-w', '--workers', type=int, default=20,
                         help="Number of workers to use. (Default: 20)")
+    parser.add_argument('--observers', type=int, default=1,
+                        help=("Number of observer processes to share the "
+                              "captured traffic between. (Default: 1)"))
+    parser.add_argument('--mergers', type=int, default=1,
+                        help=("Number of processes to merge results and flows "
+                              "in. (Default: 1)"))
+    parser.add_argument('--combiners', type=int, default=0,
+                        help=("Number of processes to combine flows into "
+                              "conditions and encode results in, when using "
+                              "a single merger. (Default: 0, combine in the "
+                              "merger)"))
+    parser.add_argument('--no-capture-filter', action='store_true',
+                        help=("Analyse all traffic on the interface, instead "
+                              "of only the traffic generated by the "
+                              "measurement"))
     parser.add_argument('--input', default='/dev/stdin', metavar='INPUTFILE',
                         help=("A file containing a list of PATHspider jobs. "
                               "Defaults to standard input."))
@@ -137,6 +167,19 @@ def register_args(subparsers):
                               "Defaults to standard output."))
     parser.add_argument('--output-flows', action='store_true',
                         help="Include flow results in output.")
+    parser.add_argument('--compress', choices=sorted(COMPRESSION_SUFFIXES),
+                        help=("Compress the output as it is written. "
+                              "(Default: guessed from the output file name)"))
+    parser.add_argument('--compress-threads', type=int, default=0,
+                        metavar='THREADS',
+                        help=("Number of threads to compress blocks of output "
+                              "in. (Default: 0, compress as a single stream)"))
+    parser.add_argument('--rotate-size', type=int, metavar='MB',
+                        help=("Start a new output file after this many "
+                              "megabytes of results"))
+    parser.add_argument('--rotate-interval', type=float, metavar='SECONDS',
+                        help=("Start a new output file after this many "
+                              "seconds"))
 
     # Set the command entry point
     parser.set_defaults(cmd=run_measurement)
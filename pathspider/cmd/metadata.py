@@ -3,29 +3,63 @@ import bz2
 import dateutil.parser
 import json
 import logging
+import multiprocessing as mp
+import os
 import sys
 
 from straight.plugin import load
 
-def metadata_from_ps_ndjson(fp):
-    y = None
-    z = None
+from pathspider.writer import ResultTimes
 
-    for line in fp:
-        d = json.loads(line)
+#: The size of the blocks read when scanning results
+SCAN_BLOCK_SIZE = 1 << 24
 
+def _slow_times(lines, times):
+    # results whose times are not in the fixed format need decoding
+    for line in lines.splitlines():
+        if len(line.strip()) == 0:
+            continue
+        d = json.loads(line.decode())
         a = dateutil.parser.parse(d['time']['from'])
         b = dateutil.parser.parse(d['time']['to'])
+        times.add(a.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                  b.strftime("%Y-%m-%d %H:%M:%S.%f"))
 
-        if y is None or a < y:
-            y = a
-        
-        if z is None or b > z:
-            z = b    
+def scan_ps_ndjson(fp, times, length=None):
+    '''
+    Scan results for their times, reading large blocks from a binary file.
+
+    :param fp: the file to read results from, positioned at the start of a
+               result
+    :param times: the times to update
+    :type times: pathspider.writer.ResultTimes
+    :param length: the number of bytes to read, or None to read to the end
+    :type length: int
+    '''
+    remainder = b""
+    while length is None or length > 0:
+        size = SCAN_BLOCK_SIZE if length is None else min(length, SCAN_BLOCK_SIZE)
+        block = fp.read(size)
+        if len(block) == 0:
+            break
+        if length is not None:
+            length -= len(block)
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            remainder += block
+            continue
+        lines = remainder + block[:end]
+        remainder = block[end:]
+        if times.update(lines) != lines.count(b"\n"):
+            _slow_times(lines, times)
+    if len(remainder.strip()) > 0:
+        if times.update(remainder) != 1:
+            _slow_times(remainder, times)
 
-    return {'_time_start': y.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            '_time_end': z.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "_file_type": "pathspider-v2-ndjson-bz2"}
+def metadata_from_ps_ndjson(fp):
+    times = ResultTimes()
+    scan_ps_ndjson(fp, times)
+    return times.metadata()
 
 FILETYPE_MAP = { 'ps-ndjson': metadata_from_ps_ndjson }
 
@@ -37,7 +71,7 @@ def extract_metadata_for(filename, metadata_fn):
     else:
         open_fn = open
     
-    with open_fn(filename) as fp:
+    with open_fn(filename, 'rb') as fp:
         metadata = metadata_fn(fp)
 
     return metafilename, metadata
@@ -56,15 +90,67 @@ def write_metadata(metafilename, metadata):
     with open(metafilename, mode="w") as mfp:
         json.dump(metadata, mfp, indent=2)
 
+def _scan_chunk(chunk):
+    (filename, start, length) = chunk
+    times = ResultTimes()
+    if filename.endswith(".bz2"):
+        with bz2.open(filename, 'rb') as fp:
+            scan_ps_ndjson(fp, times)
+    else:
+        with open(filename, 'rb') as fp:
+            fp.seek(start)
+            scan_ps_ndjson(fp, times, length)
+    return (times.start, times.end)
+
+def ps_ndjson_chunks(filename, chunk_size):
+    '''
+    Split a results file into chunks, each starting at the start of a result,
+    that can be scanned separately. Compressed files are scanned whole.
+
+    :return: list of tuple -- filename, offset and length of each chunk
+    '''
+    if filename.endswith(".bz2"):
+        return [(filename, 0, None)]
+
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, 'rb') as fp:
+        while offsets[-1] + chunk_size < size:
+            fp.seek(offsets[-1] + chunk_size)
+            fp.readline()
+            if fp.tell() >= size:
+                break
+            offsets.append(fp.tell())
+    offsets.append(size)
+    return [(filename, start, end - start)
+            for (start, end) in zip(offsets, offsets[1:])]
+
 def metadata(args):
     logger = logging.getLogger("metadata")
 
-    for filename in args.files:
-        logger.info('processing %s...' % (filename,))
-        sys.stdout.flush()
+    processes = getattr(args, 'processes', 1)
+    if args.filetype == 'ps-ndjson' and processes > 1:
+        # scan all files, and chunks of large uncompressed files, in parallel
+        chunks = []
+        for filename in args.files:
+            chunks.extend(ps_ndjson_chunks(filename, SCAN_BLOCK_SIZE * 4))
+        logger.info('processing %d files in %d chunks...' % (len(args.files), len(chunks)))
+        with mp.Pool(processes) as pool:
+            results = pool.map(_scan_chunk, chunks)
+        file_times = {filename: ResultTimes() for filename in args.files}
+        for ((filename, _, _), (start, end)) in zip(chunks, results):
+            if start is not None:
+                file_times[filename].add(start, end)
+        extracted = [(filename + ".meta.json", file_times[filename].metadata())
+                     for filename in args.files]
+    else:
+        extracted = []
+        for filename in args.files:
+            logger.info('processing %s...' % (filename,))
+            sys.stdout.flush()
+            extracted.append(extract_metadata_for(filename, FILETYPE_MAP[args.filetype]))
 
-        meta_filename, meta_data = extract_metadata_for(filename, FILETYPE_MAP[args.filetype])
-        
+    for (meta_filename, meta_data) in extracted:
         if args.extra is not None:
             add_extra_meta_data(meta_data, args.extra)
         
@@ -78,6 +164,8 @@ def register_args(subparsers):
                         metavar="FILETYPE", default="ps-ndjson")
     parser.add_argument("--extra", nargs='+', help="Additional metadata tags",
                         metavar="TAG:VAL")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="Number of processes to scan files in")
     # Set the command entry point
     parser.set_defaults(cmd=metadata)
     
\ No newline at end of file
@@ -2,6 +2,8 @@
 import argparse
 import logging
 import json
+import multiprocessing as mp
+import os
 import queue
 import signal
 import sys
@@ -11,15 +13,59 @@ from straight.plugin import load
 
 from pathspider.base import SHUTDOWN_SENTINEL
 from pathspider.base import QUEUE_SIZE
+from pathspider.base import FLOW_BATCH_SIZE
+from pathspider.base import FLOW_BATCH_INTERVAL
 
 from pathspider.chains.base import Chain
 
+from pathspider.bpf import shard_filter
+
+from pathspider.flowrecord import FlowBatch
+
 from pathspider.observer import Observer
 
 from pathspider.network import interface_up
 
 chains = load("pathspider.chains", subclasses=Chain)
 
+#: The suffixes of the files in an input directory that are read as captures
+PCAP_SUFFIXES = (".pcap", ".pcap.gz", ".pcap.bz2", ".pcap.xz")
+
+def input_uris(inputs):
+    """
+    Expand the inputs given on the command line into a list of libtrace URIs.
+    Directories are expanded to the pcap files they contain, in name order.
+    Interface names are given the "int:" prefix, and file names the
+    "pcapfile:" prefix, unless they already carry a libtrace format.
+    """
+
+    uris = []
+    for name in inputs:
+        if ":" in name:
+            uris.append(name)
+        elif os.path.isdir(name):
+            uris.extend("pcapfile:" + os.path.join(name, filename)
+                        for filename in sorted(os.listdir(name))
+                        if filename.endswith(PCAP_SUFFIXES))
+        elif name.endswith(PCAP_SUFFIXES) or name.startswith("/"):
+            uris.append("pcapfile:" + name)
+        else:
+            uris.append("int:" + name)
+    return uris
+
+def run_shard(uris, chosen_chains, shard, shards, flowqueue, irqueue):
+    """
+    Run an Observer over its shard of the packets read from ``uris``. Used as
+    the target for each process when observing with more than one process.
+    """
+
+    # interrupts are passed on by the parent through the irqueue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    observer = Observer(uris, chosen_chains,
+                        bpf_filter=shard_filter(shard, shards))
+    observer.run_flow_enqueuer(flowqueue, irqueue,
+                               FLOW_BATCH_SIZE, FLOW_BATCH_INTERVAL)
+
 def run_observer(args):
     logger = logging.getLogger("pathspider")
 
@@ -30,19 +76,18 @@ def run_observer(args):
         print("\nSpider safely!")
         sys.exit(0)
 
-    interface = args.interface
+    uris = input_uris(args.interface or ["eth0"])
 
-    if not ":" in args.interface:
-        if interface.endswith(".pcap") or interface.startswith("/"):
-            interface = "pcapfile:" + interface
-        else:
-            interface = "int:" + interface
-
-    if interface.startswith("int:") and not interface_up(interface[4:]):
-        logger.error("The chosen interface is not up! Cannot continue.")
-        logger.error("Try --help for more information.")
+    if len(uris) == 0:
+        logger.error("No pcap files found in the input! Cannot continue.")
         sys.exit(1)
 
+    for uri in uris:
+        if uri.startswith("int:") and not interface_up(uri[4:]):
+            logger.error("The chosen interface is not up! Cannot continue.")
+            logger.error("Try --help for more information.")
+            sys.exit(1)
+
     logger.info("creating observer...")
 
     chosen_chains = []
@@ -55,26 +100,48 @@ def run_observer(args):
         logger.error("Unable to find one or more of the requested chains.")
         logger.error("Try --list-chains to list the available chains.")
 
-    observer_shutdown_queue = queue.Queue(QUEUE_SIZE)
-    flowqueue = queue.Queue(QUEUE_SIZE)
+    processes = max(args.processes, 1)
+    if processes == 1:
+        observer_shutdown_queue = queue.Queue(QUEUE_SIZE)
+        flowqueue = queue.Queue(QUEUE_SIZE)
+
+        observer = Observer(uris, chosen_chains)
 
-    observer = Observer(interface, chosen_chains)
+        logger.info("starting observer...")
+        threading.Thread(target=observer.run_flow_enqueuer, args=(flowqueue,observer_shutdown_queue)).start()
+    else:
+        observer_shutdown_queue = mp.Queue(processes)
+        flowqueue = mp.Queue(QUEUE_SIZE)
 
-    logger.info("starting observer...")
-    threading.Thread(target=observer.run_flow_enqueuer, args=(flowqueue,observer_shutdown_queue)).start()
+        logger.info("starting %d observer processes...", processes)
+        for shard in range(processes):
+            mp.Process(target=run_shard,
+                       args=(uris, chosen_chains, shard, processes,
+                             flowqueue, observer_shutdown_queue),
+                       name='observer_{}'.format(shard),
+                       daemon=True).start()
 
     logger.info("opening output file " + args.output)
     with open(args.output, 'w') as outputfile:
         logger.info("registering interrupt...")
         def signal_handler(signal, frame):
-            observer_shutdown_queue.put(True)
+            for _ in range(processes):
+                observer_shutdown_queue.put(True)
         signal.signal(signal.SIGINT, signal_handler)
+        running = processes
         while True:
             result = flowqueue.get()
             if result == SHUTDOWN_SENTINEL:
+                running -= 1
+                if running > 0:
+                    continue
                 logger.info("output complete")
                 break
-            outputfile.write(json.dumps(result) + "\n")
+            if isinstance(result, FlowBatch):
+                for flow in result:
+                    outputfile.write(json.dumps(flow) + "\n")
+            else:
+                outputfile.write(json.dumps(result) + "\n")
             logger.debug("wrote a result")
 
 def register_args(subparsers):
@@ -91,11 +158,22 @@ def register_args(subparsers):
                                    formatter_class=SubcommandHelpFormatter)
     parser.add_argument('--list-chains', help="Prints a list of available chains",
                         action='store_true')
-    parser.add_argument('-i', '--interface', default="eth0",
+    parser.add_argument('-i', '--interface', action='append',
                         help=("The interface to use for the observer. If this "
                               "argument ends with '.pcap' then it will instead "
-                              "be treated as a PCAP file for offline analysis. "
-                              "(Default: eth0)"))
+                              "be treated as a PCAP file for offline analysis, "
+                              "and if it is a directory then the PCAP files "
+                              "it contains will be analysed. May be given "
+                              "more than once to analyse consecutive PCAP "
+                              "files as one capture. (Default: eth0)"))
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help=("Number of observer processes to share the "
+                              "packets between, by a hash of their "
+                              "addresses. Each process reads and decodes "
+                              "all of the input, keeping only its share of "
+                              "the flows, so this helps when analysing the "
+                              "flows rather than reading the input limits "
+                              "the rate. (Default: 1)"))
     parser.add_argument('--output', default='/dev/stdout', metavar='OUTPUTFILE',
                         help=("The file to output results data to. "
                               "Defaults to standard output."))
@@ -1,111 +1,258 @@
-
 import pycurl
 import argparse
 import logging
 import json
-import bz2
 import os
 import sys
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from argparse import Namespace
-import pathspider.cmd.metadata as metadata 
+import pathspider.cmd.metadata as metadata
+from pathspider.writer import BLOCK_SIZE
+from pathspider.writer import OutputWriter
+
+UPLOAD_RETRIES = 3
 
-def compress_file(filename):
+def compress_file(filename, threads=0):
     '''
         compress file to bz2 if not already done
-        
+
+        The file is compressed block by block, in parallel if ``threads`` is
+        given, into a temporary file that is only renamed once complete. A
+        complete compressed file left by an earlier, interrupted upload is
+        reused if it is newer than the file itself.
+
         :param filename: filename of file to compress
         :type filename: str
+        :param threads: number of threads to compress blocks in
+        :type threads: int
         :return: str -- filename of compressed file
     '''
     if filename.endswith(".bz2"):
         return filename
-    else:
-        new_filename = filename + ".bz2"
-        compressionLevel = 9
-        with open(filename, 'rb') as data:
-            fh = open(new_filename, "wb")
-            fh.write(bz2.compress(data.read(), compressionLevel))
-            fh.close()
+
+    new_filename = filename + ".bz2"
+    if (os.path.exists(new_filename) and
+            os.path.getmtime(new_filename) >= os.path.getmtime(filename)):
         return new_filename
 
-def is_duplicate(url):
+    part_filename = new_filename + ".part"
+    with open(filename, 'rb') as data:
+        with OutputWriter(part_filename, compression='bz2',
+                          threads=threads) as writer:
+            for block in iter(lambda: data.read(BLOCK_SIZE), b""):
+                writer.write(block)
+    os.replace(part_filename, new_filename)
+    return new_filename
+
+class PTOClient:
     '''
-        True if file is in campaign else False
-        
-        :param url: filename of file to check
+        Client for the raw data upload API of a PTO server, using a single
+        curl handle so that its connection is reused between requests.
+        A client must only be used by one thread at a time.
+
+        :param url: base url of the raw data API
         :type url: str
-        :return: bool -- True if file is duplicate else False
+        :param campaign: name of campaign the data belongs to
+        :type campaign: str
+        :param token: authentification token for PTO API
+        :type token: str
     '''
-    answer = send_http_request(url)
-    try:
-        json.loads(answer)
-        return True
-    except:
-        return False
-
-def send_http_request(url, headers=[], filename=None):
+
+    def __init__(self, url, campaign, token):
+        self.baselink = (url + campaign + "/" if url.endswith('/')
+                         else url + "/" + campaign + "/")
+        self._token = token
+        self._curl = pycurl.Curl()
+
+    def close(self):
+        self._curl.close()
+
+    def request(self, url, headers=[], filename=None, head=False):
+        '''
+            Send a request to the PTO server, uploading the contents of a
+            file if one is given.
+
+            :param url: url to send the request to
+            :type url: str
+            :param headers: additional http headers
+            :type headers: list of str
+            :param filename: filename of file to upload
+            :type filename: str
+            :param head: make a HEAD request
+            :type head: bool
+            :return: tuple -- http status and answer from server
+        '''
+        buffer = BytesIO()
+        c = self._curl
+        # reset the options, but keep the connection
+        c.reset()
+        c.setopt(c.URL, url)
+        c.setopt(c.WRITEDATA, buffer)
+        c.setopt(pycurl.HTTPHEADER, ["Authorization: APIKEY " + self._token] + headers)
+        if filename is not None:
+            # upload the contents of this file --data-binary @file
+            c.setopt(c.UPLOAD, 1)
+            c.setopt(c.INFILESIZE_LARGE, os.path.getsize(filename))
+            with open(filename, "rb") as fh:
+                # File must be kept open while Curl object is using it
+                c.setopt(c.READDATA, fh)
+                c.perform()
+        else:
+            if head:
+                c.setopt(c.NOBODY, 1)
+            c.perform()
+        status = c.getinfo(c.RESPONSE_CODE)
+        return (status, buffer.getvalue().decode('iso-8859-1'))
+
+    def get_metadata(self, url):
+        '''
+            Get the metadata for a file in the campaign
+
+            :param url: url of the file
+            :type url: str
+            :return: dict -- metadata, or None if there is no such file
+        '''
+        (_, answer) = self.request(url)
+        try:
+            return json.loads(answer)
+        except ValueError:
+            return None
+
+    def data_size(self, url):
+        '''
+            Get the size of the data uploaded for a file
+
+            :param url: url of the data
+            :type url: str
+            :return: int -- size of the data, or None if there is none
+        '''
+        (status, _) = self.request(url, head=True)
+        if status != 200:
+            return None
+        return self._curl.getinfo(pycurl.CONTENT_LENGTH_DOWNLOAD_T)
+
+    def upload_data(self, filename, url, filetype):
+        '''
+            Uploads datafile to campaign on PTO server
+
+            :param url: url to upload file to
+            :type url: str
+            :param filename: filename of file to upload
+            :type filename: str
+            :param filetyp: "data" or "metadata"
+            :type filetype: str
+            :return: tuple -- success and data link or answer from server
+        '''
+        if filetype == 'metadata':
+            headers = ["Content-type: application/json"]
+        else:
+            headers=["Content-type: application/bzip2"]
+        (_, answer) = self.request(url, headers=headers, filename=filename)
+        try:
+            data = json.loads(answer)
+            return (True, data["__data"])
+        except (ValueError, KeyError, TypeError):
+            return (False, answer)
+
+def upload_file(client, filename, metafilename, threads=0):
     '''
-        Uploads file to campaign on PTO server
-        
-        :param url: name of campaign the data belongs to
-        :type url: str
-        :param filename: filename of file to compress
+        Uploads a file and its metadata to a campaign on the PTO.
+
+        If the metadata is already on the server, but the data is missing or
+        incomplete (because an earlier upload was interrupted), only the data
+        is uploaded. If both are there, nothing is uploaded.
+
+        :param client: client for the PTO server
+        :type client: PTOClient
+        :param filename: filename of file to compress and upload
         :type filename: str
-        :param headers: additional http headers
-        :type headers: str
-        :return: str -- answer from server
+        :param metafilename: filename of metadata file
+        :type metafilename: str
+        :param threads: number of threads to compress blocks in
+        :type threads: int
+        :return: bool -- True if the file is on the server
     '''
-    buffer = BytesIO()
-    c = pycurl.Curl()
-    #set curl options
-    c.setopt(c.URL, url)
-    c.setopt(c.WRITEDATA, buffer)
-    # add extra headers
-    c.setopt(pycurl.HTTPHEADER, ["Authorization: APIKEY " + TOKEN] + headers)
-    if not filename == None:
-        # upload the contents of this file --data-binary @file
-        c.setopt(c.UPLOAD, 1)
-        file = open(filename, "rb")
-        c.setopt(c.READDATA, file)
-        c.perform()
-        c.close()
-        # File must be kept open while Curl object is using it
-        file.close()
-    else:
-        c.perform()
-        c.close()
-    return buffer.getvalue().decode('iso-8859-1')
-
-def upload_data(filename, url, filetype):
+    logger = logging.getLogger("uploader")
+
+    link = client.baselink + os.path.basename(metafilename).split(".")[0] + ".ndjson.bz2"
+    logger.debug("checking url: " + link)
+    existing = client.get_metadata(link)
+    compressed = compress_file(filename, threads)
+
+    data_link = None
+    if existing is not None and isinstance(existing, dict):
+        data_link = existing.get("__data")
+        if (data_link is not None and
+                client.data_size(data_link) == os.path.getsize(compressed)):
+            logger.info('File %s already exists.' % os.path.basename(filename))
+            return True
+        logger.info('Resuming upload of %s' % os.path.basename(filename))
+
+    for attempt in range(UPLOAD_RETRIES):
+        try:
+            if data_link is None:
+                #upload and read out data link for data upload
+                success, data_link = client.upload_data(metafilename, link, 'metadata')
+                if not success:
+                    logger.info('Uploading metadata failed')
+                    logger.debug('Unexpected answer. Excepted .json. Instead was: %s' % str(data_link))
+                    data_link = None
+                    continue
+                logger.info('Uploaded metadata')
+
+            success, answer = client.upload_data(compressed, data_link, 'data')
+            if success:
+                logger.info('Uploaded data')
+                logger.info('Upload complete')
+                return True
+            logger.info('Uploading data failed')
+            logger.debug('Unexpected answer. Excepted .json. Instead was: %s' % str(answer))
+        except pycurl.error as e:
+            logger.info('Upload of %s interrupted (attempt %d): %s' %
+                        (os.path.basename(filename), attempt + 1, e))
+    return False
+
+def upload_files(url, campaign, token, files, parallel=1, threads=0):
     '''
-        Uploads datafile to campaign on PTO server
-        
-        :param url: url to upload file to
-        :type url: str
-        :param filename: filename of file to upload
-        :type filename: str
-        :param filetyp: "data" or "metadata"
-        :type filetype: str    
+        Uploads files to a campaign on the PTO, several at a time. Each
+        uploading thread reuses its own connection to the server.
+
+        :param files: pairs of data and metadata filenames
+        :type files: list of tuple
+        :param parallel: number of files to upload at a time
+        :type parallel: int
+        :param threads: number of threads to compress blocks in
+        :type threads: int
+        :return: list of str -- filenames of files that failed to upload
     '''
-    if filetype == 'metadata':
-        headers = ["Content-type: application/json"]
-    else:
-        headers=["Content-type: application/bzip2"]
-    answer = send_http_request(url, headers=headers, filename=filename)
-    try:
-        data = json.loads(answer)
-        return (True, data["__data"])
-    except:
-        return (False, answer)
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def upload(filename, metafilename):
+        if not hasattr(local, 'client'):
+            local.client = PTOClient(url, campaign, token)
+            with clients_lock:
+                clients.append(local.client)
+        return upload_file(local.client, filename, metafilename, threads)
+
+    with ThreadPoolExecutor(max(parallel, 1)) as pool:
+        results = list(pool.map(lambda f: upload(*f), files))
+    for client in clients:
+        client.close()
+
+    return [filename for ((filename, _), success) in zip(files, results)
+            if not success]
 
 def main(url, campaign, token, filename, metafilename):
     '''
         Uploads a given file to a campaign on the PTO using the provided token.
         Also creates and uploads the neccessary meta data.
         Prevents overwriting existing files on PTO
-        
+
         :param campaign: name of campaign the data belongs to
         :type campaign: str
         :param filename: filename of file to compress and upload
@@ -118,55 +265,49 @@ def main(url, campaign, token, filename, metafilename):
     logger = logging.getLogger("uploader")
     logger.debug("started uploader")
 
-    global TOKEN
-    TOKEN = token
+    failed = upload_files(url, campaign, token, [(filename, metafilename)])
+    if len(failed) > 0:
+        sys.exit(1)
 
-    BASELINK = url + campaign + "/" if url.endswith('/') else url + "/" + campaign + "/"
+def uploader(args):
+    logger = logging.getLogger("uploader")
+    logger.debug("started uploader")
 
-    # check if metadata already exist on server
-    url = BASELINK + os.path.basename(filename + '.bz2')
-    logger.debug("checking url: " + url)
-    if not is_duplicate(url):
-        link = BASELINK + os.path.basename(metafilename).split(".")[0] + ".ndjson.bz2"
-        for filetype in ['metadata', 'data']:
-            logger.debug('Start processing %s' % filetype)
-            if filetype == 'metadata':
-                #upload and read out data link for data upload
-                success, data_link = upload_data(metafilename, link, filetype)
-            else:
-                # compress data if necessary and upload data
-                success, data_link = upload_data(compress_file(filename), data_link, filetype)
-            if not success:
-                logger.info('Uploading %s failed' % filetype)
-                logger.debug('Unexpected answer. Excepted .json. Instead was: %s' % str(data_link))
-                break
-            else:
-                logger.info('Uploaded %s' % filetype)
-        logger.info('Upload complete')
-    else:
-        logger.info('File %s already exists.' % os.path.basename(filename))
+    if args.metadata is not None and len(args.filenames) > 1:
+        logger.error("--metadata can only be used when uploading one file")
         sys.exit(1)
 
-def uploader(args):
-    if args.metadata is None:
-        #create metadata
-        metadata_args = Namespace(files=[args.filename], filetype="ps-ndjson", extra=args.add)
-        metadata.metadata(metadata_args)
-        metafilename = args.filename +  ".meta.json"
-    else:
-        metafilename = args.metadata
-    main(args.url, args.campaign, args.token, args.filename, metafilename)
+    files = []
+    for filename in args.filenames:
+        if args.metadata is None:
+            #create metadata
+            metadata_args = Namespace(files=[filename], filetype="ps-ndjson", extra=args.add)
+            metadata.metadata(metadata_args)
+            metafilename = filename +  ".meta.json"
+        else:
+            metafilename = args.metadata
+        files.append((filename, metafilename))
+
+    failed = upload_files(args.url, args.campaign, args.token, files,
+                          args.parallel, args.compress_threads)
+    for filename in failed:
+        logger.error('Uploading %s failed' % filename)
+    if len(failed) > 0:
+        sys.exit(1)
 
 def register_args(subparsers):
     parser = subparsers.add_parser(name='upload',
                                    help="Uploads data to PTO\nCreates metadata if not provided")
 
-    parser.add_argument("filename", help="Data file in .ndjson", metavar="FILENAME")
+    parser.add_argument("filenames", nargs='+', help="Data files in .ndjson", metavar="FILENAME")
     parser.add_argument("--campaign", help="Campaign the data belongs to")
     parser.add_argument("--token", help="Authentification token")
     parser.add_argument("--metadata", help="Metadata filename. Ignores --add", metavar="FILENAME")
     parser.add_argument("--add", nargs='+', help="Additional metadata entry", metavar="TAG:VAL")
     parser.add_argument("--url", default='https://v3.pto.mami-project.eu/raw/', help="URL for PTO data upload")
+    parser.add_argument("--parallel", type=int, default=1, help="Number of files to upload at a time")
+    parser.add_argument("--compress-threads", type=int, default=0, metavar="THREADS",
+                        help="Number of threads to compress blocks of data in")
 
     # Set the command entry point
     parser.set_defaults(cmd=uploader)
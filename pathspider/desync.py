@@ -1,4 +1,6 @@
 import time
+import asyncio
+import functools
 import logging
 import queue
 import uuid
@@ -8,11 +10,17 @@ from pathspider.base import CONN_DISCARD
 from pathspider.base import QUEUE_SLEEP
 from pathspider.base import SHUTDOWN_SENTINEL
 
+ENGINE_THREADS = "threads"
+ENGINE_ASYNCIO = "asyncio"
+
+ASYNC_CONCURRENCY = 100
+
 
 class DesynchronizedSpider(Spider):
     # pylint: disable=W0223
 
     connections = []
+    async_connections = []
 
     def __init__(self, worker_count, libtrace_uri, args, server_mode=False):
         super().__init__(worker_count, libtrace_uri, args, server_mode)
@@ -21,6 +29,16 @@ class DesynchronizedSpider(Spider):
 
         self._config_count = len(self.connections)
 
+        self.engine = getattr(self.args, 'engine', ENGINE_THREADS)
+        self.concurrency = max(getattr(self.args, 'concurrency',
+                                       ASYNC_CONCURRENCY), 1)
+        if self.engine == ENGINE_ASYNCIO and len(self.async_connections) == 0:
+            self.__logger.warning("Plugin has no asynchronous connections, "
+                                  "using a thread per connection")
+            self.engine = ENGINE_THREADS
+        if self.engine == ENGINE_ASYNCIO:
+            self._config_count = len(self.async_connections)
+
         if hasattr(self.args, 'connect') and self.args.connect.startswith('tor'):
             self.__logger.warning("Clamping worker count to one to avoid overloading Tor!")
             self.worker_count = 1
@@ -51,8 +69,21 @@ class DesynchronizedSpider(Spider):
 
         If the job fetched is the SHUTDOWN_SENTINEL, then the worker will
         terminate as this indicates that all the jobs have now been processed.
+
+        With the asyncio engine, the worker instead runs an event loop that
+        performs the jobs using :attr:`async_connections`, see
+        :meth:`async_worker`.
         """
 
+        if self.engine == ENGINE_ASYNCIO:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.async_worker(worker_number))
+            finally:
+                loop.close()
+            return
+
         worker_active = True
 
         while self.running:
@@ -103,6 +134,93 @@ class DesynchronizedSpider(Spider):
             else:
                 break
 
+    async def async_worker(self, worker_number):
+        """
+        This coroutine provides the logic for a worker using the asyncio
+        engine.
+
+        :param worker_number: The unique number of the worker.
+        :type worker_number: int
+
+        Jobs are fetched from the job queue and performed concurrently, with
+        up to :attr:`concurrency` jobs in progress at a time. The connections
+        for each job are performed in turn, using :attr:`async_connections`,
+        and the results are passed to the merger as for the threaded worker.
+
+        If the job fetched is the SHUTDOWN_SENTINEL, no further jobs are
+        fetched and the worker terminates once the jobs in progress are
+        complete.
+        """
+
+        loop = asyncio.get_event_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        failed = []
+
+        def job_done(task):
+            tasks.discard(task)
+            slots.release()
+            if not task.cancelled() and task.exception() is not None:
+                failed.append(task.exception())
+
+        while self.running and len(failed) == 0:
+            await slots.acquire()
+            try:
+                # wait for a job in the executor, so that connections in
+                # progress are not held up
+                job = await loop.run_in_executor(
+                    None, functools.partial(self.jobqueue.get,
+                                            timeout=QUEUE_SLEEP))
+            except queue.Empty:
+                slots.release()
+                continue
+
+            # Break on shutdown sentinel
+            if job == SHUTDOWN_SENTINEL:
+                slots.release()
+                self.jobqueue.task_done()
+                self.__logger.debug("shutting down worker %d on sentinel",
+                                    worker_number)
+                break
+
+            self.__logger.debug("got a job: " + repr(job))
+            task = loop.create_task(self._async_job(job))
+            tasks.add(task)
+            task.add_done_callback(job_done)
+
+        if len(tasks) > 0:
+            await asyncio.wait(list(tasks))
+        if len(failed) > 0:
+            raise failed[0]
+
+        with self.active_worker_lock:
+            self.active_worker_count -= 1
+            self.__logger.debug("%d workers still active",
+                                self.active_worker_count)
+
+    async def _async_job(self, job):
+        jobId = uuid.uuid1().hex
+        conns = []
+        should_discard = False
+
+        for config in range(0, len(self.async_connections)):
+            conn = await self._async_connect_wrapper(
+                job, config, connect=self.async_connections[config])
+            if 'spdr_state' in conn:
+                if conn['spdr_state'] == CONN_DISCARD:
+                    should_discard = True
+            conns.append(conn)
+
+        if not should_discard:
+            # Save job record for combiner
+            self.jobtab[jobId] = job
+
+            # Pass results on for merge
+            self._finalise_conns(job, jobId, conns)
+
+        self.__logger.debug("job complete: " + repr(job))
+        self.jobqueue.task_done()
+
     @classmethod
     def register_args(cls, subparsers):
         # pylint: disable=no-member
@@ -113,6 +231,22 @@ class DesynchronizedSpider(Spider):
             type=int,
             help=("The timeout to use for attempted "
                   "connections in seconds (Default: 5)"))
+        if len(cls.async_connections) > 0:
+            parser.add_argument(
+                "--engine",
+                type=str,
+                choices=[ENGINE_THREADS, ENGINE_ASYNCIO],
+                default=ENGINE_THREADS,
+                help=("How workers perform connections: one at a time in "
+                      "each worker thread, or many at a time from an event "
+                      "loop in each worker thread (Default: threads)"))
+            parser.add_argument(
+                "--concurrency",
+                type=int,
+                default=ASYNC_CONCURRENCY,
+                help=("The number of jobs each worker performs at a time "
+                      "with the asyncio engine (Default: {})".format(
+                          ASYNC_CONCURRENCY)))
         if hasattr(cls, "connect_supported"):
             parser.add_argument(
                 "--connect",
@@ -122,6 +256,12 @@ class DesynchronizedSpider(Spider):
                 metavar="[{}]".format("|".join(cls.connect_supported)),
                 help="Type of connection to perform (Default: {})".format(
                     cls.connect_supported[0]))
+            if "https" in cls.connect_supported:
+                parser.add_argument(
+                    "--share-tls-sessions",
+                    action='store_true',
+                    help=("Resume TLS sessions with servers seen before, "
+                          "instead of a full handshake for every connection"))
             for connect in cls.connect_supported:
                 if connect.startswith('tor'):
                     parser.add_argument(
@@ -0,0 +1,195 @@
+"""
+.. module:: pathspider.flowrecord
+   :synopsis: Compact flow records built from the fields declared by chains
+
+This module contains the flow record type used by PATHspider's Observer. Each
+flow analysis chain declares the fields it adds to flow records, along with
+their default values, and the Observer combines these into a single record
+type with a slot for each field. New records are created with all defaults
+already in place, and are only converted to a :class:`dict` when the flow is
+emitted.
+
+Chains should read and write fields as attributes of the record. For
+compatibility with chains written for dictionary flow records, records also
+support item access, and fields that were not declared by any chain may be
+added in this way.
+
+For passing flows between processes, records can be packed into a
+:class:`FlowBatch`, which carries the field names once and a plain tuple of
+values for each flow.
+
+"""
+
+import keyword
+
+
+class FlowRecord:
+    """
+    Base class for the flow record types created by :func:`record_type`.
+    """
+
+    __slots__ = ()
+
+    #: The names of the declared fields
+    _fields = ()
+
+    #: The names of the declared fields, in order
+    _names = ()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        return self.__dict__[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            self.__dict__[key] = value
+
+    def __contains__(self, key):
+        return key in self._fields or key in self.__dict__
+
+    def get(self, key, default=None):
+        """
+        Get the value of a field, or ``default`` if there is no such field.
+        """
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """
+        Convert the flow record to a :class:`dict`, with the declared fields in
+        the order they were declared followed by any other fields that were
+        added.
+
+        :rtype: dict
+        """
+
+        raise NotImplementedError("Cannot convert an abstract flow record")
+
+    def to_tuple(self):
+        """
+        Convert the flow record to a tuple of the values of the declared
+        fields, in the order they were declared. If any other fields were
+        added, a :class:`dict` of these is appended to the tuple.
+
+        :rtype: tuple
+        """
+
+        raise NotImplementedError("Cannot convert an abstract flow record")
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.to_dict())
+
+
+def record_type(fields, name="FlowRecord"):
+    """
+    Create a flow record type for the given fields.
+
+    :param fields: The fields for the record type, as ``(name, default)``
+                   pairs. A field may appear more than once as long as the
+                   default is the same each time. Defaults are shared between
+                   records, so should be immutable.
+    :type fields: iterable
+    :param name: The name of the new type
+    :type name: str
+    :return: A subclass of :class:`FlowRecord` whose constructor takes no
+             arguments and sets all fields to their defaults
+    :rtype: type
+    """
+
+    names = []
+    defaults = {}
+    for (field, default) in fields:
+        if (not field.isidentifier() or keyword.iskeyword(field) or
+                field.startswith("_") or hasattr(FlowRecord, field)):
+            raise ValueError("Invalid flow record field name: " + repr(field))
+        if field in defaults:
+            if defaults[field] != default:
+                raise ValueError("Conflicting defaults for flow record "
+                                 "field: " + field)
+            continue
+        names.append(field)
+        defaults[field] = default
+    names = tuple(names)
+
+    # Generate the constructor and the conversion to dict, so that neither
+    # needs to loop over the fields at run time
+    namespace = {"_d{}".format(i): defaults[field]
+                 for (i, field) in enumerate(names)}
+    source = ["def __init__(self):"]
+    source.extend("    self.{} = _d{}".format(field, i)
+                  for (i, field) in enumerate(names))
+    source.append("    pass")
+    source.append("def to_dict(self):")
+    source.append("    rec = {" + ", ".join(
+        "{0!r}: self.{0}".format(field) for field in names) + "}")
+    source.append("    rec.update(self.__dict__)")
+    source.append("    return rec")
+    source.append("def to_tuple(self):")
+    source.append("    values = (" + "".join(
+        "self.{}, ".format(field) for field in names) + ")")
+    source.append("    if self.__dict__:")
+    source.append("        return values + (self.__dict__, )")
+    source.append("    return values")
+    exec("\n".join(source), namespace)  # pylint: disable=exec-used
+
+    return type(name, (FlowRecord, ), {
+        "__slots__": names + ("__dict__", ),
+        "_fields": frozenset(names),
+        "_names": names,
+        "__init__": namespace["__init__"],
+        "to_dict": namespace["to_dict"],
+        "to_tuple": namespace["to_tuple"],
+    })
+
+
+class FlowBatch:
+    """
+    A batch of flow records in a compact form for passing between processes.
+    Iterating over the batch gives each flow record as a :class:`dict`.
+
+    :param names: The names of the declared fields of the records
+    :type names: tuple(str)
+    :param rows: The records, as returned by :meth:`FlowRecord.to_tuple`
+    :type rows: list(tuple)
+    """
+
+    __slots__ = ('names', 'rows')
+
+    def __init__(self, names, rows):
+        self.names = names
+        self.rows = rows
+
+    @classmethod
+    def pack(cls, records):
+        """
+        Pack a list of flow records, which must all be of the same type, into
+        a batch.
+
+        :param records: The flow records to pack
+        :type records: list(FlowRecord)
+        :rtype: FlowBatch
+        """
+
+        return cls(type(records[0])._names, # pylint: disable=protected-access
+                   [rec.to_tuple() for rec in records])
+
+    def __reduce__(self):
+        return (FlowBatch, (self.names, self.rows))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        names = self.names
+        count = len(names)
+        for row in self.rows:
+            rec = dict(zip(names, row))
+            if len(row) > count:
+                rec.update(row[count])
+            yield rec
@@ -1,9 +1,10 @@
 
 import logging
 
-from scapy.all import send
-
+from pathspider.base import FLOW_FINISH_GRACE
 from pathspider.desync import DesynchronizedSpider
+from pathspider.inject import injector
+from pathspider.inject import source_port
 
 from pathspider.chains.basic import BasicChain
 
@@ -11,6 +12,7 @@ class ForgeSpider(DesynchronizedSpider):
 
     chains = [BasicChain]
     packets = 0
+    forge_bytes = None
 
     def __init__(self, worker_count, libtrace_uri, args, server_mode=False):
         super().__init__(worker_count, libtrace_uri, args, server_mode)
@@ -20,27 +22,25 @@ class ForgeSpider(DesynchronizedSpider):
         self.connections = [self.connect] * self.packets # pylint: disable=no-member
 
     def connect(self, job, seq):
-        pkt = self.forge(job, seq)
-        send(pkt, verbose=0)
-        return {'sp': pkt.getlayer(1).sport}
+        """
+        Forge a packet and send it. If the plugin provides a
+        ``forge_bytes()`` function, taking the same arguments as
+        ``forge()`` and returning the packet already built, as
+        :class:`bytes`, that is used instead of ``forge()``.
+        """
+
+        if self.forge_bytes is not None:
+            pkt = self.forge_bytes(job, seq) # pylint: disable=not-callable
+        else:
+            # build the packet once, so that random fields such as the
+            # source port are only chosen once
+            pkt = bytes(self.forge(job, seq))
+        injector().send(job['dip'], pkt)
+
+        # the reply is still to come, so the observers wait for it for as
+        # long as a connection would before completing the flow
+        return {'sp': source_port(pkt),
+                'spdr_grace': self.args.timeout + FLOW_FINISH_GRACE}
 
     def forge(self, job, config):
         raise NotImplementedError("Cannot register an abstract plugin")
-
-    @classmethod
-    def register_args(cls, subparsers):
-        # pylint: disable=no-member
-        parser = subparsers.add_parser(cls.name, help=cls.description)
-        parser.set_defaults(spider=cls)
-        if hasattr(cls, "connect_supported"):
-            parser.add_argument(
-                "--connect",
-                type=str,
-                choices=cls.connect_supported,
-                default=cls.connect_supported[0],
-                metavar="[{}]".format("|".join(cls.connect_supported)),
-                help="Type of connection to perform (Default: {})".format(
-                    cls.connect_supported[0]))
-
-        if hasattr(cls, "extra_args"):
-            cls.extra_args(parser)
@@ -1,5 +1,16 @@
+import asyncio
+import collections
+import heapq
+import ipaddress
+import itertools
+import os
+import random
+import select
 import struct
 import socket
+import threading
+import time
+from concurrent.futures import Future
 
 from dnslib.dns import DNSError, DNSRecord, DNSQuestion, QTYPE
 from scapy.all import RandShort
@@ -8,6 +19,15 @@ from pathspider.base import CONN_OK
 from pathspider.base import CONN_TIMEOUT
 from pathspider.base import CONN_FAILED
 
+#: The number of sockets, each bound to its own port, the DNS engine keeps
+#: for each source address
+DNS_ENGINE_SOCKETS = 256
+
+#: The time, in seconds, for which the DNS engine avoids sending another
+#: query to the same server from the same port, so that the Observer sees
+#: each query as a flow of its own
+DNS_PORT_HOLD = 30
+
 
 class PSDNSRecord(DNSRecord):
     def spider_send(self, source, job, conn_timeout, tcp=False):
@@ -70,6 +90,71 @@ class PSDNSRecord(DNSRecord):
             sock.close()
         return (response, sp)
 
+    async def spider_send_async(self, source, job, conn_timeout, tcp=False):
+        """
+        Send packet to nameserver and return response and source port,
+        without blocking the event loop this coroutine runs in.
+        """
+        loop = asyncio.get_event_loop()
+        data = self.pack()
+        if ':' in job['dip']:
+            inet = socket.AF_INET6
+        else:
+            inet = socket.AF_INET
+        if tcp:
+            if len(data) > 65535:
+                raise ValueError("Packet length too long: %d" % len(data))
+            data = struct.pack("!H", len(data)) + data
+            sock = socket.socket(inet, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(inet, socket.SOCK_DGRAM)
+        try:
+            if ':' in job['dip']:
+                sock.bind((source[1], 0))
+            else:
+                sock.bind((source[0], 0))
+            sp = sock.getsockname()[1]
+            sock.setblocking(False)
+            await asyncio.wait_for(
+                loop.sock_connect(sock, (job['dip'], job['dp'])), conn_timeout)
+            await loop.sock_sendall(sock, data)
+            response = None
+            try:
+                if tcp:
+                    response = await asyncio.wait_for(
+                        self._recv_tcp_async(loop, sock), conn_timeout)
+                else:
+                    response = await asyncio.wait_for(
+                        loop.sock_recv(sock, 8192), conn_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if response is not None:
+                try:
+                    PSDNSRecord().parse(response)
+                except DNSError:
+                    response = None
+        finally:
+            sock.close()
+        return (response, sp)
+
+    @staticmethod
+    async def _recv_tcp_async(loop, sock):
+        response = b""
+        while len(response) < 2:
+            data = await loop.sock_recv(sock, 8192)
+            if len(data) == 0:
+                return None
+            response += data
+        length = struct.unpack("!H", response[:2])[0]
+        while len(response) - 2 < length:
+            data = await loop.sock_recv(sock, 8192)
+            if len(data) == 0:
+                return None
+            response += data
+        if len(response) > 2:
+            return response[2:]
+        return None
+
 
 def connect_dns_tcp(source, job, conn_timeout):
     """
@@ -110,3 +195,294 @@ def connect_dns(source, job, conn_timeout, tcp=False):
         return {'sp': 0, 'spdr_state': CONN_FAILED}
     except ValueError: # Caused by domain names that don't fit in a DNS query (this should never happen)
         return {'sp': 0, 'spdr_state': CONN_FAILED}
+
+async def connect_dns_tcp_async(source, job, conn_timeout):
+    """
+    This helper coroutine will perform a DNS query over a TCP connection, as
+    :func:`connect_dns_tcp` does, without blocking the event loop it runs in.
+    """
+
+    return await connect_dns_async(source, job, conn_timeout, tcp=True)
+
+async def connect_dns_udp_async(source, job, conn_timeout):
+    """
+    This helper coroutine will perform a DNS query over UDP, as
+    :func:`connect_dns_udp` does, without blocking the event loop it runs in.
+    The query is sent by the :class:`DNSEngine` shared by all the workers in
+    the process.
+    """
+
+    return await asyncio.wrap_future(
+        dns_engine().submit(source, job, conn_timeout))
+
+async def connect_dns_async(source, job, conn_timeout, tcp=False):
+    """
+    This helper coroutine will perform a DNS query, as :func:`connect_dns`
+    does, without blocking the event loop it runs in.
+    """
+
+    try:
+        q = PSDNSRecord(q=DNSQuestion(job['domain'], QTYPE.A))
+        response, sp = await q.spider_send_async(source, job, conn_timeout,
+                                                 tcp=tcp)
+        if response is None:
+            return {'sp': sp, 'spdr_state': CONN_FAILED}
+        return {'sp': sp, 'spdr_state': CONN_OK}
+    except asyncio.TimeoutError:
+        return {'sp': 0, 'spdr_state': CONN_TIMEOUT}
+    except TypeError:  # Caused by not having a v4/v6 address when trying to bind
+        return {'sp': 0, 'spdr_state': CONN_FAILED}
+    except OSError:
+        return {'sp': 0, 'spdr_state': CONN_FAILED}
+    except ValueError: # Caused by domain names that don't fit in a DNS query (this should never happen)
+        return {'sp': 0, 'spdr_state': CONN_FAILED}
+
+def pack_query(domain):
+    """
+    Pack a query for the A record of a domain, with a zero transaction ID.
+    This is the same query as :class:`PSDNSRecord` or Scapy pack, but without
+    building a record first.
+
+    :param domain: The domain to query
+    :type domain: str
+    :rtype: bytes
+    """
+
+    labels = domain.encode("idna").rstrip(b".").split(b".")
+    qname = b"".join(bytes((len(label),)) + label for label in labels if label)
+    return (struct.pack("!HHHHHH", 0, 0x0100, 1, 0, 0, 0) + qname +
+            b"\0" + struct.pack("!HH", QTYPE.A, 1))
+
+class DNSEngine:
+    """
+    Sends DNS queries over UDP for many threads at a time, from a pool of
+    sockets bound to distinct ports, with all the replies received by a
+    single epoll loop in the engine's own thread.
+
+    Many queries may be outstanding on each socket, and replies are matched
+    to queries by the port they are received on and their transaction ID.
+    Successive queries to the same server are sent from different ports, so
+    that the Observer sees each as a flow of its own, unless more than
+    ``sockets`` queries are sent to the server within ``port_hold`` seconds.
+
+    Replies are checked only for their source, transaction ID and response
+    flag, and not parsed, as the Observer parses them when it analyses the
+    flow.
+
+    :param sockets: The number of sockets to use for each source address
+    :type sockets: int
+    :param port_hold: The time, in seconds, before a port is used again for
+                      a query to the same server
+    :type port_hold: float
+    """
+
+    def __init__(self, sockets=DNS_ENGINE_SOCKETS, port_hold=DNS_PORT_HOLD):
+        self._socket_count = sockets
+        self._port_hold = port_hold
+
+        self._epoll = select.epoll()
+        (self._wake_read, self._wake_write) = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        self._epoll.register(self._wake_read, select.EPOLLIN)
+
+        self._lock = threading.Lock()
+        self._requests = []
+        self._woken = False
+
+        self._pools = {}
+        self._sockets = {}
+        self._servers = collections.OrderedDict()
+        self._pending = {}
+        self._deadlines = []
+        self._tokens = itertools.count()
+        self._pid = os.getpid()
+
+        self.running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name="dns_engine",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, source, job, conn_timeout):
+        """
+        Send a query for the A record of the job's domain.
+
+        :param source: The IPv4 and IPv6 source addresses
+        :type source: tuple
+        :param job: The job, giving the server address and port, and the
+                    domain to query
+        :type job: dict
+        :param conn_timeout: The time to wait for a reply, in seconds
+        :type conn_timeout: int
+        :return: A future for the connection record
+        :rtype: concurrent.futures.Future
+        """
+
+        future = Future()
+        try:
+            data = pack_query(job['domain'])
+        except ValueError: # domain names that don't fit in a query
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return future
+        if ':' in job['dip']:
+            local = (socket.AF_INET6, source[1])
+        else:
+            local = (socket.AF_INET, source[0])
+        if local[1] is None or not self.running:
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return future
+
+        with self._lock:
+            self._requests.append((local, job['dip'], job['dp'], data,
+                                   time.monotonic() + conn_timeout, future))
+            wake = not self._woken
+            self._woken = True
+        if wake:
+            os.write(self._wake_write, b"\0")
+        return future
+
+    def close(self):
+        """
+        Stop the engine. Any queries still outstanding fail.
+        """
+
+        self.running = False
+        os.write(self._wake_write, b"\0")
+        self._thread.join()
+
+    def _pool(self, local):
+        pool = self._pools.get(local)
+        if pool is None:
+            pool = []
+            for _ in range(self._socket_count):
+                sock = socket.socket(local[0], socket.SOCK_DGRAM)
+                sock.bind((local[1], 0))
+                sock.setblocking(False)
+                self._sockets[sock.fileno()] = (sock, sock.getsockname()[1])
+                self._epoll.register(sock.fileno(), select.EPOLLIN)
+                pool.append(sock)
+            self._pools[local] = pool
+        return pool
+
+    def _next_socket(self, local, dip, now):
+        # each server has its own rotation through the sockets, so that it
+        # is sent successive queries from different ports
+        key = (local, dip)
+        (index, _) = self._servers.pop(key, (random.randrange(self._socket_count), 0))
+        self._servers[key] = ((index + 1) % self._socket_count,
+                              now + self._port_hold)
+        while self._servers:
+            (oldest, (_, expiry)) = next(iter(self._servers.items()))
+            if expiry > now:
+                break
+            del self._servers[oldest]
+        return self._pool(local)[index]
+
+    def _send(self, request, now):
+        (local, dip, dp, data, deadline, future) = request
+        try:
+            sock = self._next_socket(local, dip, now)
+        except (TypeError, OSError): # no v4/v6 address to bind to
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return
+        fd = sock.fileno()
+        txid = random.getrandbits(16)
+        while (fd, txid) in self._pending:
+            txid = random.getrandbits(16)
+        try:
+            sock.sendto(struct.pack("!H", txid) + data[2:], (dip, dp))
+        except OSError:
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return
+        token = next(self._tokens)
+        self._pending[(fd, txid)] = (future, dip, dp, token)
+        heapq.heappush(self._deadlines, (deadline, token, fd, txid))
+
+    def _add_requests(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+            self._woken = False
+        now = time.monotonic()
+        for request in requests:
+            self._send(request, now)
+
+    def _receive(self, fd):
+        (sock, sp) = self._sockets[fd]
+        while True:
+            try:
+                (data, server) = sock.recvfrom(8192)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. an ICMP error for an earlier query; the query itself
+                # will time out
+                continue
+            if len(data) < 12 or not data[2] & 0x80:
+                continue
+            txid = struct.unpack("!H", data[:2])[0]
+            pending = self._pending.get((fd, txid))
+            if pending is None:
+                continue
+            (future, dip, dp, _) = pending
+            if server[1] != dp or (server[0] != dip and
+                                   ipaddress.ip_address(server[0]) !=
+                                   ipaddress.ip_address(dip)):
+                continue
+            del self._pending[(fd, txid)]
+            future.set_result({'sp': sp, 'spdr_state': CONN_OK})
+
+    def _expire(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            (_, token, fd, txid) = heapq.heappop(self._deadlines)
+            pending = self._pending.get((fd, txid))
+            # the query may have been answered, and its ID reused
+            if pending is None or pending[3] != token:
+                continue
+            del self._pending[(fd, txid)]
+            pending[0].set_result({'sp': self._sockets[fd][1],
+                                   'spdr_state': CONN_FAILED})
+
+    def _run(self):
+        while self.running:
+            if self._deadlines:
+                timeout = max(self._deadlines[0][0] - time.monotonic(), 0)
+            else:
+                timeout = -1
+            for (fd, _) in self._epoll.poll(timeout):
+                if fd == self._wake_read:
+                    self._add_requests()
+                else:
+                    self._receive(fd)
+            self._expire(time.monotonic())
+
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+        for request in requests:
+            request[5].set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+        for (future, _, _, _) in self._pending.values():
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+        self._pending = {}
+        for (sock, _) in self._sockets.values():
+            sock.close()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def dns_engine():
+    """
+    Get the :class:`DNSEngine` shared by all the workers in this process,
+    starting it if it is not yet running.
+    """
+
+    global _engine # pylint: disable=global-statement
+    with _engine_lock:
+        if _engine is None or _engine._pid != os.getpid(): # pylint: disable=protected-access
+            _engine = DNSEngine()
+        return _engine
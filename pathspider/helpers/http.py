@@ -1,4 +1,9 @@
 
+import asyncio
+import os
+import select
+import threading
+from concurrent.futures import Future
 from io import BytesIO
 
 import pycurl
@@ -6,18 +11,71 @@ import pycurl
 from pathspider.base import CONN_OK
 from pathspider.base import CONN_FAILED
 
-def connect_http(source, job, conn_timeout, curlopts=None, curlinfos=None):
+#: The longest time, in milliseconds, the engine waits before driving its
+#: transfers again when cURL has no descriptors for it to wait on, as while
+#: a name is being resolved
+HTTP_ENGINE_IDLE_WAIT = 100
+
+#: The number of curl handles each thread keeps for reuse
+CURL_POOL_SIZE = 2
+
+#: The number of curl handles the HTTP engine keeps for reuse, once their
+#: transfers are complete
+HTTP_ENGINE_POOL_SIZE = 64
+
+#: The curl handles kept for reuse by each thread
+_handles = threading.local()
+
+def _get_handle():
+    handles = getattr(_handles, 'pool', None)
+    if handles:
+        c = handles.pop()
+        # clears the options, but not the caches or the share
+        c.reset()
+        return c
+    return pycurl.Curl()
+
+def _release_handle(c):
+    handles = getattr(_handles, 'pool', None)
+    if handles is None:
+        handles = _handles.pool = []
+    if len(handles) < CURL_POOL_SIZE:
+        handles.append(c)
+    else:
+        c.close()
+
+_share = None
+_share_lock = threading.Lock()
+
+def http_share():
     """
-    This helper function will perform a TCP connection. It will not perform
-    any special action in the event that this is the experimental flow,
-    but can be customised on a per-call basis through the curlopts argument.
+    Get the :class:`pycurl.CurlShare` shared by all the workers in this
+    process. It shares TLS session IDs and the DNS cache between transfers,
+    so that a TLS handshake with a server seen before can be resumed, but
+    not connections, so that each transfer is still made on a new TCP
+    connection.
+    """
+
+    global _share # pylint: disable=global-statement
+    with _share_lock:
+        if _share is None:
+            _share = pycurl.CurlShare()
+            _share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+            _share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        return _share
+
+def _setup_http(c, source, job, conn_timeout, curlopts, share):
+    """
+    Set the options for an HTTP transfer on a curl handle.
+
+    :return: The buffers the response header and body are written to, or
+             ``None`` if an option could not be set
+    :rtype: tuple
     """
 
     if 'dp' not in job:
         job['dp'] = 80
 
-    c = pycurl.Curl()
-
     if curlopts is None:
         curlopts = {}
 
@@ -54,33 +112,65 @@ def connect_http(source, job, conn_timeout, curlopts=None, curlinfos=None):
     curlopts[pycurl.FRESH_CONNECT] = 1
     curlopts[pycurl.FORBID_REUSE] = 1
 
+    c.unsetopt(pycurl.SHARE)
+    if share is not None:
+        c.setopt(pycurl.SHARE, share)
+    else:
+        c.setopt(pycurl.SSL_SESSIONID_CACHE, 0)
+
     for o in curlopts:
         try:
             c.setopt(o, curlopts[o])
         except TypeError:
-            return {'spdr_state': CONN_FAILED, 'sp': 0}
+            return None
+
+    return (header, body)
+
+def connect_http(source, job, conn_timeout, curlopts=None, curlinfos=None,
+                 share=None):
+    """
+    This helper function will perform a TCP connection. It will not perform
+    any special action in the event that this is the experimental flow,
+    but can be customised on a per-call basis through the curlopts argument.
+
+    The transfer is made with a curl handle reused from an earlier transfer
+    by the same thread where possible. TLS sessions are only resumed if a
+    share from :func:`http_share` is given as ``share``, and are otherwise
+    negotiated afresh for each transfer, as with a new handle.
+    """
 
+    c = _get_handle()
     try:
-        c.perform()
-        sp = c.getinfo(pycurl.LOCAL_PORT)
-        code = c.getinfo(pycurl.RESPONSE_CODE)
-        info = {}
-        if curlinfos is not None:
-            for curlinfo in curlinfos:
-                info[curlinfo] = c.getinfo(curlinfo)
-        c.close()
-        return {
-            'sp': sp,
-            'spdr_state': CONN_OK,
-            'http_response_code': code,
-            'http_response_header': header.getvalue().decode('utf-8', 'backslashreplace'),
-            'http_response_body': body.getvalue().decode('utf-8', 'backslashreplace'),
-            'http_info': info,
-        }
-    except pycurl.error: # TODO: Catch timeout seperately
-        return {'spdr_state': CONN_FAILED, 'sp': 0}
-
-def connect_https(source, job, conn_timeout, curlopts=None, curlinfos=None):
+        buffers = _setup_http(c, source, job, conn_timeout, curlopts, share)
+        if buffers is None:
+            return {'spdr_state': CONN_FAILED, 'sp': 0}
+        (header, body) = buffers
+
+        try:
+            c.perform()
+            return _http_result(c, header, body, curlinfos)
+        except pycurl.error: # TODO: Catch timeout seperately
+            return {'spdr_state': CONN_FAILED, 'sp': 0}
+    finally:
+        _release_handle(c)
+
+def _http_result(c, header, body, curlinfos):
+    sp = c.getinfo(pycurl.LOCAL_PORT)
+    code = c.getinfo(pycurl.RESPONSE_CODE)
+    info = {}
+    if curlinfos is not None:
+        for curlinfo in curlinfos:
+            info[curlinfo] = c.getinfo(curlinfo)
+    return {
+        'sp': sp,
+        'spdr_state': CONN_OK,
+        'http_response_code': code,
+        'http_response_header': header.getvalue().decode('utf-8', 'backslashreplace'),
+        'http_response_body': body.getvalue().decode('utf-8', 'backslashreplace'),
+        'http_info': info,
+    }
+
+def _https_curlopts(job, curlopts):
     if 'dp' not in job:
         job['dp'] = 443
 
@@ -94,11 +184,9 @@ def connect_https(source, job, conn_timeout, curlopts=None, curlinfos=None):
 
     if pycurl.URL not in curlopts:
         if 'domain' in job:
-            url = "http://" + job['domain'] + ":" + str(job['dp']) + "/"
+            curlopts[pycurl.URL] = "https://" + job['domain'] + ":" + str(job['dp']) + "/"
         else:
-            url = "http://" + ipString + ":" + str(job['dp']) + "/"
-    else:
-        curlopts[pycurl.URL] = url
+            curlopts[pycurl.URL] = "https://" + ipString + ":" + str(job['dp']) + "/"
 
     if pycurl.SSL_VERIFYHOST not in curlopts:
         curlopts[pycurl.SSL_VERIFYHOST] = 0
@@ -106,4 +194,269 @@ def connect_https(source, job, conn_timeout, curlopts=None, curlinfos=None):
     if pycurl.SSL_VERIFYPEER not in curlopts:
         curlopts[pycurl.SSL_VERIFYPEER] = 0
 
-    return connect_http(source, job, conn_timeout, curlopts, curlinfos)
+    return curlopts
+
+def connect_https(source, job, conn_timeout, curlopts=None, curlinfos=None,
+                  share=None):
+    curlopts = _https_curlopts(job, curlopts)
+    return connect_http(source, job, conn_timeout, curlopts, curlinfos, share)
+
+class HTTPEngine:
+    """
+    Performs HTTP transfers for many coroutines at a time, all driven by a
+    single :class:`pycurl.CurlMulti` in the engine's own thread, rather than
+    each holding a worker thread in :meth:`pycurl.Curl.perform`.
+
+    Transfers are prepared and started by :func:`submit_http` or
+    :func:`submit_https`, with all of their per-transfer options, so that
+    the configurator of :class:`~pathspider.sync.SynchronizedSpider` or each
+    event loop of :class:`~pathspider.desync.DesynchronizedSpider` can have
+    many transfers in progress at once. The results are the same records as
+    when the transfer is performed by :func:`connect_http`.
+
+    The engine keeps the curl handles of completed transfers for reuse by
+    later transfers, see :meth:`handle`.
+
+    The engine's thread sleeps on the descriptors of its transfers, for no
+    longer than cURL's own timeout, and is woken through a pipe when a new
+    transfer is submitted.
+    """
+
+    def __init__(self):
+        self._multi = pycurl.CurlMulti()
+        (self._wake_read, self._wake_write) = os.pipe()
+        os.set_blocking(self._wake_read, False)
+
+        self._lock = threading.Lock()
+        self._requests = []
+        self._woken = False
+
+        self._transfers = {}
+        self._handles_lock = threading.Lock()
+        self._handles = []
+        self._pid = os.getpid()
+
+        self.running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name="http_engine",
+                                        daemon=True)
+        self._thread.start()
+
+    def handle(self):
+        """
+        Get a curl handle for a transfer, reused from a completed transfer
+        where possible, with its options cleared but its caches kept.
+
+        :rtype: pycurl.Curl
+        """
+
+        with self._handles_lock:
+            c = self._handles.pop() if self._handles else None
+        if c is None:
+            return pycurl.Curl()
+        c.reset()
+        return c
+
+    def release(self, c):
+        """
+        Return a curl handle that is no longer in use, for reuse by a later
+        transfer.
+
+        :param c: The curl handle
+        :type c: pycurl.Curl
+        """
+
+        with self._handles_lock:
+            if len(self._handles) < HTTP_ENGINE_POOL_SIZE:
+                self._handles.append(c)
+                return
+        c.close()
+
+    def submit(self, c, header, body, curlinfos=None):
+        """
+        Start a transfer.
+
+        :param c: The curl handle for the transfer, with all options set.
+                  Once the transfer is complete, the engine keeps the handle
+                  for reuse, see :meth:`release`.
+        :type c: pycurl.Curl
+        :param header: The buffer the handle writes the response header to
+        :type header: io.BytesIO
+        :param body: The buffer the handle writes the response body to
+        :type body: io.BytesIO
+        :param curlinfos: The curl information to include in the result
+        :type curlinfos: set
+        :return: A future for the connection record
+        :rtype: concurrent.futures.Future
+        """
+
+        future = Future()
+        if not self.running:
+            self.release(c)
+            future.set_result({'spdr_state': CONN_FAILED, 'sp': 0})
+            return future
+
+        with self._lock:
+            self._requests.append((c, header, body, curlinfos, future))
+            wake = not self._woken
+            self._woken = True
+        if wake:
+            os.write(self._wake_write, b"\0")
+        return future
+
+    def close(self):
+        """
+        Stop the engine. Any transfers still in progress fail.
+        """
+
+        self.running = False
+        os.write(self._wake_write, b"\0")
+        self._thread.join()
+
+    def _add_requests(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+            self._woken = False
+        for (c, header, body, curlinfos, future) in requests:
+            self._transfers[c] = (header, body, curlinfos, future)
+            self._multi.add_handle(c)
+
+    def _finish(self, c, ok):
+        (header, body, curlinfos, future) = self._transfers.pop(c)
+        self._multi.remove_handle(c)
+        result = {'spdr_state': CONN_FAILED, 'sp': 0}
+        if ok:
+            try:
+                result = _http_result(c, header, body, curlinfos)
+            except pycurl.error:
+                pass
+        self.release(c)
+        future.set_result(result)
+
+    def _perform(self):
+        while True:
+            (ret, _) = self._multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        while True:
+            (queued, ok_list, err_list) = self._multi.info_read()
+            for c in ok_list:
+                self._finish(c, True)
+            for (c, _, _) in err_list:
+                self._finish(c, False)
+            if queued == 0:
+                break
+
+    def _wait(self):
+        poller = select.poll()
+        poller.register(self._wake_read, select.POLLIN)
+        if self._transfers:
+            (readers, writers, errors) = self._multi.fdset()
+            for fd in set(readers) | set(writers) | set(errors):
+                events = 0
+                if fd in readers:
+                    events |= select.POLLIN
+                if fd in writers:
+                    events |= select.POLLOUT
+                poller.register(fd, events)
+            timeout = self._multi.timeout()
+            if not (readers or writers or errors):
+                if timeout < 0 or timeout > HTTP_ENGINE_IDLE_WAIT:
+                    timeout = HTTP_ENGINE_IDLE_WAIT
+        else:
+            # nothing to drive until a transfer is submitted
+            timeout = -1
+        for (fd, _) in poller.poll(timeout):
+            if fd == self._wake_read:
+                self._add_requests()
+
+    def _run(self):
+        while self.running:
+            self._perform()
+            self._wait()
+
+        self._add_requests()
+        for c in list(self._transfers):
+            self._finish(c, False)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def http_engine():
+    """
+    Get the :class:`HTTPEngine` shared by all the workers in this process,
+    starting it if it is not yet running.
+    """
+
+    global _engine # pylint: disable=global-statement
+    with _engine_lock:
+        if _engine is None or _engine._pid != os.getpid(): # pylint: disable=protected-access
+            _engine = HTTPEngine()
+        return _engine
+
+def submit_http(source, job, conn_timeout, curlopts=None, curlinfos=None,
+                engine=None, share=None):
+    """
+    This helper function will start an HTTP transfer with cURL, as
+    :func:`connect_http` performs, without waiting for it to complete. The
+    transfer is performed by an :class:`HTTPEngine`, the one shared by all
+    the workers in the process unless another is given as ``engine``.
+
+    :return: A future for the connection record
+    :rtype: concurrent.futures.Future
+    """
+
+    if engine is None:
+        engine = http_engine()
+
+    c = engine.handle()
+    buffers = _setup_http(c, source, job, conn_timeout, curlopts, share)
+    if buffers is None:
+        engine.release(c)
+        future = Future()
+        future.set_result({'spdr_state': CONN_FAILED, 'sp': 0})
+        return future
+    (header, body) = buffers
+    return engine.submit(c, header, body, curlinfos)
+
+def submit_https(source, job, conn_timeout, curlopts=None, curlinfos=None,
+                 engine=None, share=None):
+    """
+    This helper function will start an HTTPS transfer with cURL, as
+    :func:`connect_https` performs, without waiting for it to complete.
+    """
+
+    curlopts = _https_curlopts(job, curlopts)
+    return submit_http(source, job, conn_timeout, curlopts, curlinfos, engine,
+                       share)
+
+async def connect_http_async(source, job, conn_timeout, curlopts=None,
+                             curlinfos=None, engine=None, share=None):
+    """
+    This helper coroutine will perform an HTTP transfer with cURL, as
+    :func:`connect_http` does, without blocking the event loop it runs in.
+    The transfer is performed by an :class:`HTTPEngine`, as by
+    :func:`submit_http`, so that an event loop can have many transfers in
+    progress at once.
+    """
+
+    return await asyncio.wrap_future(
+        submit_http(source, job, conn_timeout, curlopts, curlinfos, engine,
+                    share))
+
+async def connect_https_async(source, job, conn_timeout, curlopts=None,
+                              curlinfos=None, engine=None, share=None):
+    """
+    This helper coroutine will perform an HTTPS transfer with cURL, as
+    :func:`connect_https` does, without blocking the event loop it runs in.
+    """
+
+    return await asyncio.wrap_future(
+        submit_https(source, job, conn_timeout, curlopts, curlinfos, engine,
+                     share))
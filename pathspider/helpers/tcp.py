@@ -1,9 +1,27 @@
 
+import asyncio
+import ctypes
+import errno
+import heapq
+import os
+import random
+import select
 import socket
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import Future
 
 from pathspider.base import CONN_OK
 from pathspider.base import CONN_TIMEOUT
 from pathspider.base import CONN_FAILED
+from pathspider.chains.tcp import TCP_SA
+from pathspider.inject import IPPROTO_TCP
+from pathspider.inject import TCP_RST
+from pathspider.inject import TCP_SYN
+from pathspider.inject import PacketTemplate
+from pathspider.inject import injector
 
 def connect_tcp(source, job, conn_timeout, sockopts=None):
     """
@@ -44,3 +62,587 @@ def connect_tcp(source, job, conn_timeout, sockopts=None):
         return {'sp': 0, 'spdr_state': CONN_FAILED}
     except OSError:
         return {'sp': 0, 'spdr_state': CONN_FAILED}
+
+async def connect_tcp_async(source, job, conn_timeout, sockopts=None):
+    """
+    This helper coroutine will perform a TCP connection, as
+    :func:`connect_tcp` does, without blocking the event loop it runs in.
+    """
+
+    if sockopts is None:
+        sockopts = []
+
+    if not isinstance(conn_timeout, int):
+        raise RuntimeError("Plugin did not set TCP connect conn_timeout.")
+
+    sock = None
+    try:
+        if ":" in job['dip']:
+            sock = socket.socket(socket.AF_INET6)
+            sock.bind((source[1], 0))
+        else:
+            sock = socket.socket(socket.AF_INET)
+            sock.bind((source[0], 0))
+
+        for o in sockopts:
+            sock.setsockopt(*o)
+
+        sock.setblocking(False)
+        loop = asyncio.get_event_loop()
+        await asyncio.wait_for(loop.sock_connect(sock, (job['dip'], job['dp'])),
+                               conn_timeout)
+
+        sp = sock.getsockname()[1]
+
+        sock.shutdown(socket.SHUT_RDWR)
+
+        return {'sp': sp, 'spdr_state': CONN_OK}
+    except asyncio.TimeoutError:
+        return {'sp': sock.getsockname()[1], 'spdr_state': CONN_TIMEOUT}
+    except TypeError: # Caused by not having a v4/v6 address when trying to bind
+        return {'sp': 0, 'spdr_state': CONN_FAILED}
+    except OSError:
+        return {'sp': 0, 'spdr_state': CONN_FAILED}
+    finally:
+        if sock is not None:
+            sock.close()
+
+class TCPConnector:
+    """
+    Performs TCP connections for many threads at a time. The connections are
+    made with non-blocking sockets, all driven by a single epoll loop in the
+    connector's own thread, rather than each holding a worker thread blocked
+    in :func:`socket.connect`.
+
+    Connections are requested with :meth:`submit`, which returns at once, so
+    that a caller can have many connections in progress, or with
+    :meth:`connect`, which waits for the result. The results are the same
+    records as returned by :func:`connect_tcp`.
+    """
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        (self._wake_read, self._wake_write) = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        self._epoll.register(self._wake_read, select.EPOLLIN)
+
+        self._lock = threading.Lock()
+        self._requests = []
+        self._woken = False
+
+        self._pending = {}
+        self._deadlines = []
+        self._pid = os.getpid()
+
+        self.running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name="tcp_connector",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, source, job, conn_timeout, sockopts=None):
+        """
+        Start a TCP connection.
+
+        :param source: The IPv4 and IPv6 source addresses
+        :type source: tuple
+        :param job: The job, giving the destination address and port
+        :type job: dict
+        :param conn_timeout: The connection timeout, in seconds
+        :type conn_timeout: int
+        :param sockopts: Socket options to set before connecting, as
+                         arguments to :meth:`socket.socket.setsockopt`
+        :type sockopts: list
+        :return: A future for the connection record
+        :rtype: concurrent.futures.Future
+        """
+
+        if sockopts is None:
+            sockopts = []
+
+        if not isinstance(conn_timeout, int):
+            raise RuntimeError("Plugin did not set TCP connect conn_timeout.")
+
+        future = Future()
+        if not self.running:
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return future
+
+        sock = None
+        try:
+            if ":" in job['dip']:
+                sock = socket.socket(socket.AF_INET6)
+                sock.bind((source[1], 0))
+            else:
+                sock = socket.socket(socket.AF_INET)
+                sock.bind((source[0], 0))
+
+            for o in sockopts:
+                sock.setsockopt(*o)
+
+            sock.setblocking(False)
+            err = sock.connect_ex((job['dip'], job['dp']))
+        except (TypeError, OSError): # TypeError when there is no v4/v6 address
+            if sock is not None:
+                sock.close()
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return future
+
+        if err != errno.EINPROGRESS:
+            self._complete(sock, future, err)
+            return future
+
+        with self._lock:
+            self._requests.append((sock, future,
+                                   time.monotonic() + conn_timeout))
+            wake = not self._woken
+            self._woken = True
+        if wake:
+            os.write(self._wake_write, b"\0")
+        return future
+
+    def connect(self, source, job, conn_timeout, sockopts=None):
+        """
+        Perform a TCP connection, as :func:`connect_tcp` does, waiting for
+        the result. The arguments are the same as for :meth:`submit`.
+
+        :rtype: dict
+        """
+
+        return self.submit(source, job, conn_timeout, sockopts).result()
+
+    def close(self):
+        """
+        Stop the connector. Any connections still in progress fail.
+        """
+
+        self.running = False
+        os.write(self._wake_write, b"\0")
+        self._thread.join()
+
+    @staticmethod
+    def _complete(sock, future, err):
+        try:
+            if err == 0:
+                sp = sock.getsockname()[1]
+                sock.shutdown(socket.SHUT_RDWR)
+                future.set_result({'sp': sp, 'spdr_state': CONN_OK})
+            else:
+                future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+        except OSError:
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+        finally:
+            sock.close()
+
+    def _add_requests(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+            self._woken = False
+        for (sock, future, deadline) in requests:
+            fd = sock.fileno()
+            self._pending[fd] = (sock, future)
+            heapq.heappush(self._deadlines, (deadline, fd, id(sock)))
+            self._epoll.register(fd, select.EPOLLOUT)
+
+    def _expire(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            (_, fd, sock_id) = heapq.heappop(self._deadlines)
+            pending = self._pending.get(fd)
+            # the socket may have completed, and its descriptor been reused
+            if pending is None or id(pending[0]) != sock_id:
+                continue
+            (sock, future) = self._pending.pop(fd)
+            self._epoll.unregister(fd)
+            try:
+                sp = sock.getsockname()[1]
+            except OSError:
+                sp = 0
+            sock.close()
+            future.set_result({'sp': sp, 'spdr_state': CONN_TIMEOUT})
+
+    def _run(self):
+        while self.running:
+            if self._deadlines:
+                timeout = max(self._deadlines[0][0] - time.monotonic(), 0)
+            else:
+                timeout = -1
+            for (fd, _) in self._epoll.poll(timeout):
+                if fd == self._wake_read:
+                    self._add_requests()
+                    continue
+                pending = self._pending.pop(fd, None)
+                if pending is None:
+                    continue
+                (sock, future) = pending
+                self._epoll.unregister(fd)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                self._complete(sock, future, err)
+            self._expire(time.monotonic())
+
+        for (sock, future) in self._pending.values():
+            sock.close()
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+        self._pending = {}
+        self._deadlines = []
+
+_connector = None
+_connector_lock = threading.Lock()
+
+def tcp_connector():
+    """
+    Get the :class:`TCPConnector` shared by all the workers in this process,
+    starting it if it is not yet running.
+    """
+
+    global _connector # pylint: disable=global-statement
+    with _connector_lock:
+        if _connector is None or _connector._pid != os.getpid(): # pylint: disable=protected-access
+            _connector = TCPConnector()
+        return _connector
+
+#: The options of the SYNs sent by :class:`SYNProber`, by default: a Maximum
+#: Segment Size option for a 1500 byte MTU, as most stacks send
+SYN_OPTIONS = b"\x02\x04\x05\xb4"
+
+#: The size of the receive buffers of the raw sockets of :class:`SYNProber`,
+#: in bytes
+SYN_RECV_BUFFER = 1 << 22
+
+#: The file giving the range of ports the kernel chooses source ports from
+LOCAL_PORT_RANGE = "/proc/sys/net/ipv4/ip_local_port_range"
+
+_TCP_HEADER = struct.Struct("!HHIIBB")
+_PORTS = struct.Struct("!HH")
+
+# socket option to attach a classic BPF program to a socket (linux/filter.h)
+_SO_ATTACH_FILTER = 26
+_BPF_INSN = struct.Struct("HBBI")
+_BPF_PROG = struct.Struct("HP")
+
+def _probe_ports():
+    """
+    Choose the range of source ports for probes: the larger of the ranges of
+    unprivileged ports below and above the range the kernel chooses source
+    ports from, so that a probe never has the source port of a connection
+    made by the kernel, which the RST answering its SYN/ACK could reset.
+
+    :return: The lowest and highest ports of the range
+    :rtype: tuple
+    """
+
+    try:
+        with open(LOCAL_PORT_RANGE) as f:
+            (low, high) = (int(port) for port in f.read().split())
+    except (OSError, ValueError):
+        (low, high) = (32768, 60999)
+    return max(((1024, low - 1), (high + 1, 65535)),
+               key=lambda ports: ports[1] - ports[0])
+
+def _attach_port_filter(sock, family, ports):
+    """
+    Attach a socket filter to a raw TCP socket, so that the only segments
+    copied to it are those with the SYN or RST flag set sent to a port in
+    ``ports``, rather than every TCP segment the host receives.
+    """
+
+    if family == socket.AF_INET:
+        # the IPv4 header is included; load its length into X
+        program = [(0xb1, 0, 0, 0),       # ldxb 4*([0]&0xf)
+                   (0x48, 0, 0, 2),       # ldh [x+2]
+                   (0x35, 0, 4, ports[0]),  # jge #low, next, reject
+                   (0x25, 3, 0, ports[1]),  # jgt #high, reject, next
+                   (0x50, 0, 0, 13),      # ldb [x+13]
+                   (0x45, 0, 1, 0x06),    # jset #SYN|RST, accept, reject
+                   (0x06, 0, 0, 0xffff),  # accept: ret #65535
+                   (0x06, 0, 0, 0)]       # reject: ret #0
+    else:
+        program = [(0x28, 0, 0, 2),       # ldh [2]
+                   (0x35, 0, 4, ports[0]),  # jge #low, next, reject
+                   (0x25, 3, 0, ports[1]),  # jgt #high, reject, next
+                   (0x30, 0, 0, 13),      # ldb [13]
+                   (0x45, 0, 1, 0x06),    # jset #SYN|RST, accept, reject
+                   (0x06, 0, 0, 0xffff),  # accept: ret #65535
+                   (0x06, 0, 0, 0)]       # reject: ret #0
+    insns = ctypes.create_string_buffer(
+        b"".join(_BPF_INSN.pack(*insn) for insn in program))
+    sock.setsockopt(socket.SOL_SOCKET, _SO_ATTACH_FILTER,
+                    _BPF_PROG.pack(len(program), ctypes.addressof(insns)))
+
+class SYNProber:
+    """
+    Performs TCP handshakes without keeping any connection state in the
+    kernel. A SYN is forged for each probe and sent through a raw socket, the
+    replies to all of the outstanding probes are received through raw sockets
+    on a single epoll loop in the prober's own thread, and a SYN/ACK is
+    answered with a RST.
+
+    The identity of each probe is encoded in the sequence number of its SYN,
+    as a keyed hash of its addresses and ports, so that only a reply
+    acknowledging that sequence number is taken as the reply to the probe.
+
+    As there is no socket for the source port of a probe, the kernel will
+    also answer a SYN/ACK with a RST, unless a firewall stops it. The probes
+    are not retransmitted, so a SYN or SYN/ACK that is lost means that the
+    probe times out.
+
+    The source ports of probes are chosen outside the range the kernel
+    chooses source ports from, given in :data:`LOCAL_PORT_RANGE`, so that no
+    RST is sent for a connection made by the kernel. A raw TCP socket would receive
+    a copy of every TCP segment the host receives, so a socket filter is
+    attached to each, passing on only SYN/ACKs and RSTs sent to those ports.
+    """
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        (self._wake_read, self._wake_write) = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        self._epoll.register(self._wake_read, select.EPOLLIN)
+
+        self._ports = _probe_ports()
+        self._sockets = {}
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                sock = socket.socket(family, socket.SOCK_RAW,
+                                     socket.IPPROTO_TCP)
+            except OSError:
+                # no raw sockets for this family, so probes will time out
+                continue
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            SYN_RECV_BUFFER)
+            _attach_port_filter(sock, family, self._ports)
+            sock.setblocking(False)
+            self._sockets[sock.fileno()] = (family, sock)
+            self._epoll.register(sock.fileno(), select.EPOLLIN)
+
+        self._lock = threading.Lock()
+        self._requests = []
+        self._woken = False
+
+        self._secret = random.getrandbits(32)
+        self._templates = {}
+        self._pending = {}
+        self._deadlines = []
+        self._pid = os.getpid()
+
+        self.running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name="syn_prober",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, source, job, conn_timeout, flags=TCP_SYN, tos=0,
+               evil=False, options=SYN_OPTIONS):
+        """
+        Start a probe.
+
+        :param source: The IPv4 and IPv6 source addresses
+        :type source: tuple
+        :param job: The job, giving the destination address and port
+        :type job: dict
+        :param conn_timeout: The time to wait for a reply, in seconds
+        :type conn_timeout: int
+        :param flags: The flags of the SYN
+        :type flags: int
+        :param tos: The type of service byte for IPv4, or traffic class for
+                    IPv6, of the SYN
+        :type tos: int
+        :param evil: Whether to set the evil bit [RFC3514] on the SYN
+        :type evil: bool
+        :param options: The encoded TCP options of the SYN
+        :type options: bytes
+        :return: A future for the connection record, in which the state is
+                 ``CONN_OK`` if a SYN/ACK was received, ``CONN_FAILED`` if a
+                 RST was received and ``CONN_TIMEOUT`` if neither was
+        :rtype: concurrent.futures.Future
+        """
+
+        if not isinstance(conn_timeout, int):
+            raise RuntimeError("Plugin did not set TCP connect conn_timeout.")
+
+        future = Future()
+        ipv6 = ":" in job['dip']
+        src = source[1 if ipv6 else 0]
+        if not self.running or src is None:
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+            return future
+
+        with self._lock:
+            self._requests.append((ipv6, src, job['dip'], job['dp'],
+                                   (flags, tos, evil, options), future,
+                                   time.monotonic() + conn_timeout))
+            wake = not self._woken
+            self._woken = True
+        if wake:
+            os.write(self._wake_write, b"\0")
+        return future
+
+    def probe(self, source, job, conn_timeout, **kwargs):
+        """
+        Perform a probe, waiting for the result. The arguments are the same
+        as for :meth:`submit`.
+
+        :rtype: dict
+        """
+
+        return self.submit(source, job, conn_timeout, **kwargs).result()
+
+    def close(self):
+        """
+        Stop the prober. Any probes still in progress fail.
+        """
+
+        self.running = False
+        os.write(self._wake_write, b"\0")
+        self._thread.join()
+        for (_, sock) in self._sockets.values():
+            sock.close()
+
+    def _template(self, ipv6, settings):
+        key = (ipv6,) + settings
+        template = self._templates.get(key)
+        if template is None:
+            (flags, tos, evil, options) = settings
+            template = PacketTemplate(ipv6, IPPROTO_TCP, evil=evil,
+                                      tcp_flags=flags, tos=tos,
+                                      tcp_options=options)
+            rst = PacketTemplate(ipv6, IPPROTO_TCP, evil=evil,
+                                 tcp_flags=TCP_RST, tos=tos)
+            template = self._templates[key] = (template, rst)
+        return template
+
+    def _add_requests(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+            self._woken = False
+
+        for (ipv6, src, dst, dport, settings, future, deadline) in requests:
+            try:
+                daddr = socket.inet_pton(
+                    socket.AF_INET6 if ipv6 else socket.AF_INET, dst)
+                # choose a source port not in use by another probe to the
+                # same destination
+                while True:
+                    sport = random.randint(*self._ports)
+                    key = (daddr, dport, sport)
+                    if key not in self._pending:
+                        break
+                seq = zlib.crc32(daddr + _PORTS.pack(sport, dport),
+                                 self._secret)
+                (template, rst) = self._template(ipv6, settings)
+                injector().send(dst, template.build(src, dst, sport, dport,
+                                                    seq=seq))
+            except OSError:
+                future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+                continue
+            self._pending[key] = (future, seq, src, dst, rst)
+            heapq.heappush(self._deadlines, (deadline, key, id(future)))
+
+    def _receive(self, family, sock):
+        while True:
+            try:
+                (data, address) = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            if family == socket.AF_INET:
+                # IPv4 raw sockets receive the IP header too
+                offset = (data[0] & 0x0f) * 4
+                saddr = data[12:16]
+            else:
+                offset = 0
+                saddr = socket.inet_pton(socket.AF_INET6,
+                                         address[0].split('%')[0])
+            if len(data) < offset + _TCP_HEADER.size:
+                continue
+            (sport, dport, _, ack, _, flags) = _TCP_HEADER.unpack_from(data,
+                                                                       offset)
+            key = (saddr, sport, dport)
+            pending = self._pending.get(key)
+            if pending is None:
+                continue
+            (future, seq, src, dst, rst) = pending
+            if ack != (seq + 1) & 0xffffffff:
+                continue
+            if flags & TCP_SA == TCP_SA:
+                del self._pending[key]
+                try:
+                    injector().send(dst, rst.build(src, dst, dport, sport,
+                                                   seq=ack))
+                except OSError:
+                    pass
+                future.set_result({'sp': dport, 'spdr_state': CONN_OK})
+            elif flags & TCP_RST:
+                del self._pending[key]
+                future.set_result({'sp': dport, 'spdr_state': CONN_FAILED})
+
+    def _expire(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            (_, key, future_id) = heapq.heappop(self._deadlines)
+            pending = self._pending.get(key)
+            # the probe may have completed, and its ports been reused
+            if pending is None or id(pending[0]) != future_id:
+                continue
+            del self._pending[key]
+            pending[0].set_result({'sp': key[2], 'spdr_state': CONN_TIMEOUT})
+
+    def _run(self):
+        while self.running:
+            if self._deadlines:
+                timeout = max(self._deadlines[0][0] - time.monotonic(), 0)
+            else:
+                timeout = -1
+            for (fd, _) in self._epoll.poll(timeout):
+                if fd == self._wake_read:
+                    self._add_requests()
+                else:
+                    self._receive(*self._sockets[fd])
+            self._expire(time.monotonic())
+
+        for (future, _, _, _, _) in self._pending.values():
+            future.set_result({'sp': 0, 'spdr_state': CONN_FAILED})
+        self._pending = {}
+        self._deadlines = []
+
+_prober = None
+_prober_lock = threading.Lock()
+
+def syn_prober():
+    """
+    Get the :class:`SYNProber` shared by all the workers in this process,
+    starting it if it is not yet running.
+    """
+
+    global _prober # pylint: disable=global-statement
+    with _prober_lock:
+        if _prober is None or _prober._pid != os.getpid(): # pylint: disable=protected-access
+            _prober = SYNProber()
+        return _prober
+
+def connect_tcp_syn(source, job, conn_timeout, **kwargs):
+    """
+    This helper function will perform a stateless TCP handshake, using the
+    prober shared by all the workers in this process. The keyword arguments
+    set the header fields of the SYN, as for :meth:`SYNProber.submit`.
+    """
+
+    return syn_prober().probe(source, job, conn_timeout, **kwargs)
+
+async def connect_tcp_syn_async(source, job, conn_timeout, **kwargs):
+    """
+    This helper coroutine will perform a stateless TCP handshake, as
+    :func:`connect_tcp_syn` does, without blocking the event loop it runs in.
+    """
+
+    return await asyncio.wrap_future(
+        syn_prober().submit(source, job, conn_timeout, **kwargs))
@@ -0,0 +1,269 @@
+"""
+.. module:: pathspider.inject
+   :synopsis: Fast construction and injection of forged packets
+
+This module contains the packet injector used by
+:class:`pathspider.forge.ForgeSpider` to send forged packets, and the packet
+templates that plugins can use to forge them without Scapy.
+
+The injector keeps a raw socket open for each of IPv4 and IPv6, with the IP
+header included in the packets given, rather than opening and closing a
+socket for every packet as Scapy's :func:`send` does.
+
+A template holds the headers of a kind of packet, built once. For each packet
+sent, only the addresses, ports, lengths and checksums are patched into a copy
+of the template and the payload is appended, which is much cheaper than
+building the packet's layers with Scapy. The packets built are the same,
+byte for byte, as Scapy builds with its default field values.
+
+"""
+
+import array
+import functools
+import os
+import socket
+import struct
+import sys
+import threading
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+#: The flags of a TCP SYN
+TCP_SYN = 0x02
+
+#: The flags of a TCP RST
+TCP_RST = 0x04
+
+#: The evil bit [RFC3514], in the flags and fragment offset field of an IPv4
+#: header
+IP_EVIL = 0x8000
+
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")
+_IPV6 = struct.Struct("!IHBB16s16s")
+_UDP = struct.Struct("!HHHH")
+_TCP = struct.Struct("!HHIIBBHHH")
+_PORTS = struct.Struct("!HH")
+_CHECKSUM = struct.Struct("!H")
+
+
+@functools.lru_cache(maxsize=65536)
+def _address(family, address):
+    return socket.inet_pton(family, address)
+
+
+def _checksum(data):
+    if len(data) % 2 == 1:
+        data += b"\0"
+    # the one's complement sum is the same whatever the byte order of the
+    # words it is taken over, so take it in the native byte order
+    total = sum(array.array("H", data))
+    total = (total & 0xffff) + (total >> 16)
+    total = (total & 0xffff) + (total >> 16)
+    total = ~total & 0xffff
+    if sys.byteorder == "little":
+        total = ((total & 0xff) << 8) | (total >> 8)
+    return total
+
+
+class PacketTemplate:
+    """
+    The headers of a kind of IPv4 or IPv6 packet, carrying UDP or a TCP
+    segment, built once to be patched for each packet.
+
+    :param ipv6: Whether to build IPv6 packets
+    :type ipv6: bool
+    :param proto: The transport protocol, either :data:`IPPROTO_UDP` or
+                  :data:`IPPROTO_TCP`
+    :type proto: int
+    :param evil: Whether to set the evil bit [RFC3514]. IPv6 has no evil
+                 bit, so this has no effect on IPv6 packets.
+    :type evil: bool
+    :param checksum: Whether to calculate the UDP checksum, or leave it zero
+    :type checksum: bool
+    :param tcp_flags: The flags of TCP segments
+    :type tcp_flags: int
+    :param tos: The type of service byte for IPv4, or traffic class for IPv6,
+                holding the DSCP and ECN fields
+    :type tos: int
+    :param tcp_options: The encoded options of TCP segments, which are padded
+                        with end of option list bytes to a multiple of four
+                        bytes
+    :type tcp_options: bytes
+    """
+
+    def __init__(self, ipv6, proto, evil=False, checksum=True,
+                 tcp_flags=TCP_SYN, tos=0, tcp_options=b""):
+        if proto not in (IPPROTO_UDP, IPPROTO_TCP):
+            raise ValueError("Unsupported transport protocol: " + repr(proto))
+        self.ipv6 = ipv6
+        self.proto = proto
+        self.family = socket.AF_INET6 if ipv6 else socket.AF_INET
+        self._checksum = checksum
+
+        if proto == IPPROTO_UDP:
+            l4 = _UDP.pack(0, 0, 0, 0)
+        else:
+            tcp_options += bytes(-len(tcp_options) % 4)
+            l4 = _TCP.pack(0, 0, 0, 0, (5 + len(tcp_options) // 4) << 4,
+                           tcp_flags, 8192, 0, 0) + tcp_options
+
+        if ipv6:
+            ip = _IPV6.pack((6 << 28) | (tos << 20), 0, proto, 64, bytes(16),
+                            bytes(16))
+        else:
+            ip = _IPV4.pack(0x45, tos, 0, 1, IP_EVIL if evil else 0, 64,
+                            proto, 0, bytes(4), bytes(4))
+        self._ip_len = len(ip)
+        self._l4_len = len(l4)
+        self._header = bytes(ip + l4)
+
+    def build(self, src, dst, sport, dport, payload=b"", seq=0):
+        """
+        Build a packet from the template.
+
+        :param src: The source address
+        :type src: str
+        :param dst: The destination address
+        :type dst: str
+        :param sport: The source port
+        :type sport: int
+        :param dport: The destination port
+        :type dport: int
+        :param payload: The transport payload
+        :type payload: bytes
+        :param seq: The TCP sequence number
+        :type seq: int
+        :rtype: bytearray
+        """
+
+        family = self.family
+        saddr = _address(family, src)
+        daddr = _address(family, dst)
+        ip_len = self._ip_len
+        l4_len = self._l4_len + len(payload)
+
+        packet = bytearray(self._header)
+        packet += payload
+        if self.ipv6:
+            struct.pack_into("!H", packet, 4, l4_len)
+            packet[8:24] = saddr
+            packet[24:40] = daddr
+        else:
+            struct.pack_into("!H", packet, 2, ip_len + l4_len)
+            packet[12:16] = saddr
+            packet[16:20] = daddr
+            _CHECKSUM.pack_into(packet, 10, _checksum(packet[:ip_len]))
+
+        _PORTS.pack_into(packet, ip_len, sport, dport)
+        if self.proto == IPPROTO_UDP:
+            struct.pack_into("!H", packet, ip_len + 4, l4_len)
+            if not self._checksum:
+                return packet
+            offset = ip_len + 6
+        else:
+            struct.pack_into("!I", packet, ip_len + 4, seq)
+            offset = ip_len + 16
+
+        if self.ipv6:
+            pseudo = saddr + daddr + struct.pack("!I3xB", l4_len, self.proto)
+        else:
+            pseudo = saddr + daddr + struct.pack("!xBH", self.proto, l4_len)
+        checksum = _checksum(pseudo + packet[ip_len:])
+        if checksum == 0 and self.proto == IPPROTO_UDP:
+            # a zero UDP checksum means that there is none
+            checksum = 0xffff
+        _CHECKSUM.pack_into(packet, offset, checksum)
+        return packet
+
+
+def source_port(packet):
+    """
+    Get the source port of an IPv4 or IPv6 packet carrying UDP or TCP.
+
+    :param packet: The packet
+    :type packet: bytes
+    :rtype: int
+    """
+
+    if packet[0] >> 4 == 6:
+        offset = 40
+    else:
+        offset = (packet[0] & 0x0f) * 4
+    return _PORTS.unpack_from(packet, offset)[0]
+
+
+class Injector:
+    """
+    Sends packets, including their IP headers, through raw sockets kept open
+    for each address family. The sockets are opened when first needed, and
+    can be shared by many threads.
+    """
+
+    def __init__(self):
+        self._sockets = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _socket(self, family):
+        sock = self._sockets.get(family)
+        if sock is None:
+            with self._lock:
+                sock = self._sockets.get(family)
+                if sock is None:
+                    # IPPROTO_RAW sockets take packets with their IP header
+                    sock = socket.socket(family, socket.SOCK_RAW,
+                                         socket.IPPROTO_RAW)
+                    self._sockets[family] = sock
+        return sock
+
+    def send(self, dst, packet):
+        """
+        Send a packet.
+
+        :param dst: The destination address of the packet
+        :type dst: str
+        :param packet: The packet, starting with its IP header
+        :type packet: bytes
+        """
+
+        if ':' in dst:
+            self._socket(socket.AF_INET6).sendto(packet, (dst, 0))
+        else:
+            self._socket(socket.AF_INET).sendto(packet, (dst, 0))
+
+    def send_batch(self, packets):
+        """
+        Send several packets.
+
+        :param packets: The destination address and packet of each packet
+        :type packets: iterable of tuple
+        """
+
+        for (dst, packet) in packets:
+            self.send(dst, packet)
+
+    def close(self):
+        """
+        Close the raw sockets.
+        """
+
+        with self._lock:
+            for sock in self._sockets.values():
+                sock.close()
+            self._sockets = {}
+
+
+_injector = None
+_injector_lock = threading.Lock()
+
+def injector():
+    """
+    Get the :class:`Injector` shared by all the workers in this process.
+    """
+
+    global _injector # pylint: disable=global-statement
+    with _injector_lock:
+        if _injector is None or _injector._pid != os.getpid(): # pylint: disable=protected-access
+            _injector = Injector()
+        return _injector
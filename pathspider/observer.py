@@ -1,70 +1,169 @@
 import collections
 import logging
-import base64
 import queue
-import math
+import threading
+import time
 
 from pathspider.base import SHUTDOWN_SENTINEL
+from pathspider.chains.base import Chain
+from pathspider.flowrecord import FlowBatch
+from pathspider.flowrecord import record_type
+from pathspider.timerwheel import TimerWheel
+
+
+#: IP protocols whose flow keys include source and destination ports
+PROTOS_WITH_PORTS = frozenset((6, 17, 132, 136))
+
+#: Zero ports used to pad the flow key of protocols without ports
+NO_PORTS = bytes(4)
+
+#: Table entry for flows that a chain asked the observer to ignore
+_IGNORED = object()
+
+#: Fields the Observer itself adds to every flow record
+OBSERVER_FIELDS = (('pkt_first', None), ('pkt_last', None))
+
+
+def _flow_key(src, dst, proto, ports, quotation):
+    """
+    Build a canonical, direction-independent flow key.
+
+    The two endpoints (address followed by port) are ordered so that both
+    directions of a flow produce the same fixed-width key. The returned flag
+    is ``True`` when the endpoints had to be swapped to obtain this ordering,
+    i.e. when the packet travelled from the "higher" to the "lower" endpoint.
+    """
+
+    a = src + ports[0:2]
+    b = dst + ports[2:4]
+    swapped = a > b
+    if swapped:
+        key = b + a + proto
+    else:
+        key = a + b + proto
+
+    # An ICMP quotation carries the header of a packet that travelled in the
+    # opposite direction to the ICMP message itself
+    return (key, swapped != quotation)
 
 
 def _flow4_ids(ip):
+    """
+    Get the canonical flow key for an IPv4 packet, and a flag indicating the
+    orientation of the packet relative to that key.
+    """
+
     # FIXME keep map of fragment IDs to keys (#144)
 
     icmp_with_payload = {3, 4, 5, 11, 12}
-    quotation_fid = False
+    quotation = False
     if ip.proto == 1 and ip.icmp.type in icmp_with_payload:
         if ip.icmp.payload is not None and len(ip.icmp.payload.data) >= 20:
             ip = ip.icmp.payload
-            quotation_fid = True
+            quotation = True
 
-    protos_with_ports = {6, 17, 132, 136}
-    if ip.proto in protos_with_ports:
+    if ip.proto in PROTOS_WITH_PORTS:
         # key includes ports
-        fid = ip.src_prefix.addr + ip.dst_prefix.addr + ip.data[
-            9:10] + ip.payload[0:4]
-        rid = ip.dst_prefix.addr + ip.src_prefix.addr + ip.data[
-            9:10] + ip.payload[2:4] + ip.payload[0:2]
+        ports = ip.payload[0:4]
+        if len(ports) < 4:
+            raise ValueError("Transport header too short for flow key")
     else:
         # no ports, just 3-tuple
-        fid = ip.src_prefix.addr + ip.dst_prefix.addr + ip.data[9:10]
-        rid = ip.dst_prefix.addr + ip.src_prefix.addr + ip.data[9:10]
+        ports = NO_PORTS
 
-    if quotation_fid:
-        # If the fid is based on an ICMP quotation, need to be reversed
-        return (base64.b64encode(rid), base64.b64encode(fid))
-    else:
-        return (base64.b64encode(fid), base64.b64encode(rid))
+    return _flow_key(ip.src_prefix.addr, ip.dst_prefix.addr, ip.data[9:10],
+                     ports, quotation)
 
 
 def _flow6_ids(ip6):
+    """
+    Get the canonical flow key for an IPv6 packet, and a flag indicating the
+    orientation of the packet relative to that key.
+    """
+
     icmp_with_payload = {1, 2, 3, 4}
-    quotation_fid = False
+    quotation = False
 
     if ip6.proto == 58 and ip6.icmp6.type in icmp_with_payload:
         if ip6.icmp6.payload is not None and len(ip6.icmp6.payload.data) >= 40:
             ip6 = ip6.icmp6.payload
-            quotation_fid = True
+            quotation = True
 
-    protos_with_ports = {6, 17, 132, 136}
-    if ip6.proto in protos_with_ports:
+    if ip6.proto in PROTOS_WITH_PORTS:
         # key includes ports
-        fid = ip6.src_prefix.addr + ip6.dst_prefix.addr + ip6.data[
-            6:7] + ip6.payload[0:4]
-        rid = ip6.dst_prefix.addr + ip6.src_prefix.addr + ip6.data[
-            6:7] + ip6.payload[2:4] + ip6.payload[0:2]
+        ports = ip6.payload[0:4]
+        if len(ports) < 4:
+            raise ValueError("Transport header too short for flow key")
     else:
         # no ports, just 3-tuple
-        fid = ip6.src_prefix.addr + ip6.dst_prefix.addr + ip6.data[6:7]
-        rid = ip6.dst_prefix.addr + ip6.src_prefix.addr + ip6.data[6:7]
+        ports = NO_PORTS
+
+    return _flow_key(ip6.src_prefix.addr, ip6.dst_prefix.addr, ip6.data[6:7],
+                     ports, quotation)
+
+
+def _connection_key(fid, swapped):
+    """
+    Get the key identifying the connection a flow belongs to, as announced to
+    :class:`pathspider.registry.ExpectedAddresses` when it finishes: the
+    address of the responder followed by the port of the initiator, which is
+    the endpoint that sent the first packet of the flow.
+    """
+
+    alen = (len(fid) - 5) // 2
+    if swapped:
+        return fid[0:alen] + fid[2 * alen + 2:2 * alen + 4]
+    return fid[alen + 2:2 * alen + 2] + fid[alen:alen + 2]
 
-    if quotation_fid:
-        # If the fid is based on an ICMP quotation, need to be reversed
-        return (base64.b64encode(rid), base64.b64encode(fid))
+
+def _fuse_chains(net_fns, transport_fns, icmp=False):
+    """
+    Fuse the chain functions for one combination of network and transport
+    header into a single callable.
+
+    The callable takes the flow record, the network header, the transport
+    header (or the ICMP quotation if ``icmp`` is set) and the direction flag.
+    It returns ``False`` as soon as one chain function asks for the flow to be
+    completed, without calling the remaining chain functions.
+    """
+
+    net_fns = tuple(net_fns)
+    transport_fns = tuple(transport_fns)
+
+    if icmp:
+        def fused(rec, ip, q, rev):
+            for fn in net_fns:
+                if not fn(rec, ip, rev=rev):
+                    return False
+            for fn in transport_fns:
+                if not fn(rec, ip, q, rev=rev):
+                    return False
+            return True
     else:
-        return (base64.b64encode(fid), base64.b64encode(rid))
+        def fused(rec, ip, l4, rev):
+            for fn in net_fns:
+                if not fn(rec, ip, rev=rev):
+                    return False
+            for fn in transport_fns:
+                if not fn(rec, l4, rev=rev):
+                    return False
+            return True
 
+    return fused
 
-PacketClockTimer = collections.namedtuple("PacketClockTimer", ("time", "fn"))
+
+class _Flow:
+    """
+    Entry in the Observer's flow table, holding a flow record together with
+    the state the Observer needs to track it.
+    """
+
+    __slots__ = ('rec', 'swapped', 'active')
+
+    def __init__(self, rec, swapped):
+        self.rec = rec
+        self.swapped = swapped
+        self.active = True
 
 
 class Observer:
@@ -75,11 +174,27 @@ class Observer:
     data to be associated with each flow.
     """
 
-    def __init__(self, lturi, chains=None, idle_timeout=30, expiry_timeout=5):
+    def __init__(self, lturi, chains=None, idle_timeout=30, expiry_timeout=5,
+                 timer_resolution=0.1, bpf_filter=None, expected=None):
         """
         Create an Observer.
 
+        :param lturi: libtrace URI of the packet source, or a list of URIs
+                      (such as consecutive capture files) to read in turn as
+                      a single packet source
         :param chains: Array of Observer chain classes
+        :param idle_timeout: Seconds without packets after which a flow is
+                             considered complete
+        :param expiry_timeout: Seconds a completed flow is held back for late
+                               packets before it is emitted
+        :param timer_resolution: Resolution of the idle and expiry timers, in
+                                 seconds
+        :param bpf_filter: BPF filter expression to apply to the packet source
+        :param expected: If given, new flows are only tracked if a connection
+                         to one of their addresses was announced in this
+                         :class:`pathspider.registry.ExpectedAddresses`, and
+                         flows are completed early once their connection is
+                         announced as finished
         :see also: :ref:`Observer Documentation <observer>`
         """
 
@@ -90,40 +205,74 @@ class Observer:
         self._irq = None
         self._irq_fired = False
 
+        # Statistics and logging, before the first trace is opened, as the
+        # drops of each trace are counted when the next is opened
+        self._logger = logging.getLogger("observer")
+        self._ct_pkt = 0
+        self._ct_drops = 0
+        self._ct_nonip = 0
+        self._ct_shortkey = 0
+        self._ct_ignored = 0
+        self._ct_unexpected = 0
+        self._ct_finished = 0
+        self._ct_flow = 0
+
         # Libtrace initialization
-        self._trace = libtrace.trace(lturi)  # pylint: disable=no-member
-        self._trace.start()
+        if isinstance(lturi, str):
+            lturi = [lturi]
+        self._lturis = collections.deque(lturi)
+        self._filter = None
+        if bpf_filter is not None:
+            self._filter = libtrace.filter(bpf_filter)  # pylint: disable=no-member
+        self._trace = None
+        self._open_next_trace()
         self._pkt = libtrace.packet()  # pylint: disable=no-member
 
         # Chains of functions to evaluate
         chains = chains if chains is not None else []
         self._chains = [chain() for chain in chains]
+        self._compile_chains()
 
-        # Packet timer and bintables
-        self._ptq = 0  # current packet timer, quantized
-        self._idle_bins = {}  # map bin number to set of fids
-        self._expiry_bins = {}  # map bin number to set of fids
+        # Packet clock and timer wheel, holding the next idle or expiry
+        # deadline for each flow
+        self._pt = 0  # current packet time
+        self._timers = TimerWheel(timer_resolution)
         self._idle_timeout = idle_timeout
         self._expiry_timeout = expiry_timeout
-        self._bin_quantum = 1
 
-        #self._tq = []                  # packet timer queue (heap)
+        # Flow table, mapping canonical flow keys to flow table entries
+        self._flows = {}
 
-        # Flow tables
-        self._active = {}
-        self._expiring = {}
-        self._ignored = set()
+        # Registry of expected flows, if any, and the map of connection keys
+        # to flow keys for completing flows when their connection finishes
+        self._expected = expected
+        self._connections = {}
 
-        # Emitter queue
+        # Emitter queue, and the partial batch of emitted flows with the
+        # packet time and the wall-clock time at which it was started
         self._emitted = collections.deque()
+        self._batch = []
+        self._batch_start = (None, None)
+        self._batch_lock = threading.Lock()
 
-        # Statistics and logging
-        self._logger = logging.getLogger("observer")
-        self._ct_pkt = 0
-        self._ct_nonip = 0
-        self._ct_shortkey = 0
-        self._ct_ignored = 0
-        self._ct_flow = 0
+    def _open_next_trace(self):
+        """
+        Start reading from the next packet source, if there is one left.
+        """
+
+        import plt as libtrace
+
+        if self._trace is not None:
+            self._ct_drops += self._trace.pkt_drops()
+            self._trace = None
+        if len(self._lturis) == 0:
+            return False
+
+        self._trace = libtrace.trace(self._lturis.popleft())  # pylint: disable=no-member
+        if self._filter is not None:
+            self._trace.conf_filter(self._filter)
+        self._trace.start()
+        return True
 
     def _interrupted(self):
         if not self._irq_fired and self._irq is not None:
@@ -140,17 +289,44 @@ class Observer:
             c.__getattribute__(name) for c in self._chains if hasattr(c, name)
         ]
 
-    def _next_packet(self):
-        # Import only when needed
-        import plt as libtrace
+    def _compile_chains(self):
+        """
+        Build the chain dispatch tables once, so that no chain lookups are
+        needed per packet. One fused callable is built for each combination
+        of network layer and transport header that the Observer dispatches.
+        The flow record type is built from the fields declared by the chains,
+        and only chains that override ``new_flow`` are called for new flows.
+        """
+
+        fields = list(OBSERVER_FIELDS)
+        for chain in self._chains:
+            fields.extend(getattr(chain, "fields", ()))
+        self._record_type = record_type(fields)
+
+        self._new_flow_fns = tuple(
+            c.new_flow for c in self._chains
+            if hasattr(c, "new_flow") and
+            getattr(type(c), "new_flow", None) is not Chain.new_flow)
+        self._dispatch = {}
+        for (net, icmp) in (("ip4", "icmp4"), ("ip6", "icmp6")):
+            net_fns = self._get_chains(net)
+            self._dispatch[(net, None)] = _fuse_chains(net_fns, [])
+            self._dispatch[(net, icmp)] = _fuse_chains(
+                net_fns, self._get_chains(icmp), icmp=True)
+            for transport in ("tcp", "udp"):
+                self._dispatch[(net, transport)] = _fuse_chains(
+                    net_fns, self._get_chains(transport))
 
+    def _next_packet(self):
         # see if someone told us to stop
         if self._interrupted():
             return False
 
-        # see if we're done iterating
-        if not self._trace.read_packet(self._pkt):
-            return False
+        # see if we're done iterating, moving on to the next packet source
+        # when the current one is exhausted
+        while self._trace is None or not self._trace.read_packet(self._pkt):
+            if not self._open_next_trace():
+                return False
 
         # count the packet
         self._ct_pkt += 1
@@ -167,33 +343,24 @@ class Observer:
         if not rec:
             return True
 
-        keep_flow = True
-
-        # run IP header chains
-        if self._pkt.ip:
-            for fn in self._get_chains("ip4"):
-                keep_flow = keep_flow and fn(rec, self._pkt.ip, rev=rev)
-            if self._pkt.icmp:
-                for fn in self._get_chains("icmp4"):
-                    q = self._pkt.icmp.payload # pylint: disable=no-member
-                    keep_flow = keep_flow and fn(rec, self._pkt.ip, q, rev=rev)
-
-        elif self._pkt.ip6:
-            for fn in self._get_chains("ip6"):
-                keep_flow = keep_flow and fn(rec, self._pkt.ip6, rev=rev)
-            if self._pkt.icmp6:
-                for fn in self._get_chains("icmp6"):
-                    q = self._pkt.icmp6.payload # pylint: disable=no-member
-                    keep_flow = keep_flow and fn(
-                        rec, self._pkt.ip6, q, rev=rev)
-
-        # run transport header chains
-        if self._pkt.tcp:
-            for fn in self._get_chains("tcp"):
-                keep_flow = keep_flow and fn(rec, self._pkt.tcp, rev=rev)
-        elif self._pkt.udp:
-            for fn in self._get_chains("udp"):
-                keep_flow = keep_flow and fn(rec, self._pkt.udp, rev=rev)
+        # pick the fused chain callable for this combination of headers;
+        # ICMP messages never also carry a top-level TCP or UDP header
+        pkt = self._pkt
+        if pkt.ip:
+            (net, ip, icmp_name, icmp) = ("ip4", pkt.ip, "icmp4", pkt.icmp)
+        else:
+            (net, ip, icmp_name, icmp) = ("ip6", pkt.ip6, "icmp6", pkt.icmp6)
+
+        if icmp:
+            (transport, l4) = (icmp_name, icmp.payload) # pylint: disable=no-member
+        elif pkt.tcp:
+            (transport, l4) = ("tcp", pkt.tcp)
+        elif pkt.udp:
+            (transport, l4) = ("udp", pkt.udp)
+        else:
+            (transport, l4) = (None, None)
+
+        keep_flow = self._dispatch[(net, transport)](rec, ip, l4, rev)
 
         # complete the flow if any chain function asked us to
         if not keep_flow:
@@ -202,23 +369,18 @@ class Observer:
         # we processed a packet, keep going
         return True
 
-    # def _set_timer(self, delay, fid):
-    #     # add to queue
-    #     heapq.heappush(self._tq, PacketClockTimer(self._pt + delay,
-    #                    self._finish_expiry_tfn(fid)))
-
     def _get_flow(self):
         """
         Get a flow record for the given packet.
         Create a new basic flow record
         """
-        # get possible a flow IDs for the packet
+        # get the canonical flow key for the packet
         try:
             if self._pkt.ip:
-                (ffid, rfid) = _flow4_ids(self._pkt.ip)
+                (fid, swapped) = _flow4_ids(self._pkt.ip)
                 ip = self._pkt.ip
             elif self._pkt.ip6:
-                (ffid, rfid) = _flow6_ids(self._pkt.ip6)
+                (fid, swapped) = _flow6_ids(self._pkt.ip6)
                 ip = self._pkt.ip6
             else:
                 # we don't care about non-IP packets
@@ -228,89 +390,93 @@ class Observer:
             self._ct_shortkey += 1
             return (None, None, False)
 
-        # now look for forward and reverse in ignored, active,
-        # and expiring tables.
-        if ffid in self._ignored:
-            return (None, None, False)
-        elif rfid in self._ignored:
+        # now look for the flow, whichever direction it is in
+        flow = self._flows.get(fid)
+        if flow is _IGNORED:
             return (None, None, False)
-        elif ffid in self._active:
-            (fid, rec, active) = (ffid, self._active[ffid], True)
-            #self._logger.debug("found forward flow for "+str(ffid))
-        elif ffid in self._expiring:
-            (fid, rec, active) = (ffid, self._expiring[ffid], False)
-            #self._logger.debug("found expiring forward flow for "+str(ffid))
-        elif rfid in self._active:
-            (fid, rec, active) = (rfid, self._active[rfid], True)
-            #self._logger.debug("found reverse flow for "+str(rfid))
-        elif rfid in self._expiring:
-            (fid, rec, active) = (rfid, self._expiring[rfid], False)
-            #self._logger.debug("found expiring reverse flow for "+str(rfid))
-        else:
-            # nowhere to be found. new flow.
-            rec = {'pkt_first': ip.seconds, '_idle_bin': 0}
-            for fn in self._get_chains("new_flow"):
+        elif flow is None:
+            # nowhere to be found. new flow, unless no measurement expects
+            # it; the addresses are at fixed positions in the flow key
+            if self._expected is not None:
+                alen = (len(fid) - 5) // 2
+                if not self._expected.admits(fid[0:alen],
+                                             fid[alen + 2:2 * alen + 2]):
+                    self._ct_unexpected += 1
+                    return (None, None, False)
+
+            rec = self._record_type()
+            rec.pkt_first = ip.seconds
+            for fn in self._new_flow_fns:
                 if not fn(rec, ip):
-                    # self._logger.debug("ignoring "+str(ffid))
-                    self._ignored.add(ffid)
+                    # self._logger.debug("ignoring "+str(fid))
+                    self._flows[fid] = _IGNORED
                     self._ct_ignored += 1
                     return (None, None, False)
 
-            # wasn't vetoed. add to active table.
-            fid = ffid
-            self._active[ffid] = rec
-            active = True
-            # self._logger.debug("new flow for "+str(ffid))
+            # wasn't vetoed. add to flow table, with its idle timer; the
+            # timer is not pushed back on each packet, but re-armed from
+            # the last packet's time when it fires
+            flow = _Flow(rec, swapped)
+            self._flows[fid] = flow
+            self._timers.schedule(fid, ip.seconds + self._idle_timeout)
+            if self._expected is not None:
+                self._connections[_connection_key(fid, swapped)] = fid
+            # self._logger.debug("new flow for "+str(fid))
             self._ct_flow += 1
 
-        # update time and idle bin and return record
-        rec['pkt_last'] = ip.seconds
+        # update time and return record
+        rec = flow.rec
+        rec.pkt_last = ip.seconds
 
-        # update idle bin if we're not expiring
-        if active:
-            new_idle_bin = math.ceil((rec['pkt_last'] + self._idle_timeout) /
-                                     self._bin_quantum) * self._bin_quantum
+        return (fid, rec, swapped != flow.swapped)
 
-            if new_idle_bin > rec["_idle_bin"]:
-
-                if rec['_idle_bin'] in self._idle_bins:
-                    self._idle_bins[rec['_idle_bin']] -= set((fid, ))
-                if new_idle_bin in self._idle_bins:
-                    self._idle_bins[new_idle_bin] |= set((fid, ))
-                else:
-                    self._idle_bins[new_idle_bin] = set((fid, ))
-
-                rec['_idle_bin'] = new_idle_bin
-
-        return (fid, rec, bool(fid == rfid))
-
-    def _flow_complete(self, fid):
+    def _flow_complete(self, fid, pt=None):
         """
         Mark a given flow ID as complete
+
+        :param pt: The time at which the flow completed, defaulting to the
+                   current packet time
         """
-        # skip all of this unless the flow is still in the active table
-        if fid not in self._active:
+        # skip all of this unless the flow is still active
+        flow = self._flows.get(fid)
+        if flow is None or flow is _IGNORED or not flow.active:
             return
 
-        # remove flow ID from idle bin
-        rec = self._active[fid]
-        self._idle_bins[rec['_idle_bin']] -= set((fid, ))
-
-        del rec['_idle_bin']
+        # mark the flow as expiring and replace its idle timer with the
+        # expiry timer
+        flow.active = False
+        if pt is None:
+            pt = self._pt
+        self._timers.schedule(fid, pt + self._expiry_timeout)
+        #self._logger.debug("Completing flow "+str(fid)+" at "+str(self._pt)+" to expire in "+str(self._expiry_timeout)+"s")
 
-        # move record to expiring table
-        self._expiring[fid] = rec
-        del self._active[fid]
+    def _flow_finished(self, connection, grace):
+        """
+        Complete the flow of a connection that was announced as finished,
+        once the grace period has passed, unless it is already complete.
 
-        # assign expiry bin
-        expiry_bin = math.ceil((self._ptq + self._expiry_timeout) /
-                               self._bin_quantum) * self._bin_quantum
-        #self._logger.debug("Completing flow "+str(fid)+" at "+str(self._ptq)+" to expire "+str(expiry_bin)+" (in "+str(expiry_bin-self._ptq)+"s)")
+        :param connection: The key identifying the connection
+        :param grace: Seconds to wait for late packets before the flow is
+                      emitted
+        """
 
-        if expiry_bin in self._expiry_bins:
-            self._expiry_bins[expiry_bin] |= set((fid, ))
-        else:
-            self._expiry_bins[expiry_bin] = set((fid, ))
+        fid = self._connections.get(connection)
+        if fid is None:
+            # not seen, or already emitted; any flow will go idle instead
+            return
+        flow = self._flows[fid]
+        if flow.active:
+            flow.active = False
+            self._timers.schedule(fid, self._pt + grace)
+            self._ct_finished += 1
+
+    def _pop_flow(self, fid):
+        flow = self._flows.pop(fid)
+        if self._expected is not None:
+            connection = _connection_key(fid, flow.swapped)
+            if self._connections.get(connection) == fid:
+                del self._connections[connection]
+        return flow
 
     def _emit_flow(self, rec):
         self._emitted.append(rec)
@@ -320,106 +486,157 @@ class Observer:
             if not self._next_packet():
                 return None
 
-        return self._emitted.popleft()
+        return self._emitted.popleft().to_dict()
 
     def _tick(self, pt):
-        # quantize and skip if we're not advancing
-        next_ptq = math.ceil(pt / self._bin_quantum) * self._bin_quantum
-        if next_ptq <= self._ptq:
-            return
-        elif self._ptq == 0:
-            # handle zero case
-            self._ptq = next_ptq
+        # skip if we're not advancing
+        if pt <= self._pt:
             return
+        self._pt = pt
+
+        # complete the flows of connections that have finished
+        if self._expected is not None:
+            for (connection, grace) in self._expected.finished():
+                self._flow_finished(connection, grace)
 
-        # advance quantum
-        for bint in range(self._ptq + self._bin_quantum,
-                          next_ptq + self._bin_quantum, self._bin_quantum):
-            self._logger.debug("tick: " + str(bint))
-
-            # process idle
-            if bint in self._idle_bins:
-                if len(self._idle_bins[bint]) > 0:
-                    for fid in self._idle_bins[bint].copy():
-                        self._flow_complete(fid)
-                del self._idle_bins[bint]
-
-            # process expiry
-            if bint in self._expiry_bins:
-                if len(self._expiry_bins[bint]) > 0:
-                    for fid in self._expiry_bins[bint].copy():
-                        self._emit_flow(self._expiring[fid])
-                        del self._expiring[fid]
-                del self._expiry_bins[bint]
-
-        self._ptq = next_ptq
-
-    # def _tick(self, pt):
-    #     # Advance packet clock
-    #     self._pt = pt
-
-    #     # fire all timers whose time has come
-    #     while len(self._tq) > 0 and pt > min(self._tq, key=lambda x: x.time).time:
-    #         try:
-    #             heapq.heappop(self._tq).fn()
-    #         except:
-    #             type, value, tb = sys.exc_info()
-    #             traceback.print_exc()
-    #             pdb.post_mortem(tb)
-
-    # def _finish_expiry_tfn(self, fid):
-    #     """
-    #     On expiry timer, emit the flow
-    #     and delete it from the expiring queue
-    #     """
-    #     def tfn():
-    #         if fid in self._expiring:
-    #             self._emit_flow(self._expiring[fid])
-    #             del self._expiring[fid]
-    #             # self._logger.debug("emitted "+str(fid)+" on expiry")
-    #     return tfn
-
-    # def purge_idle(self, timeout=30):
-    #     # TODO test this, it's probably pretty slow.
-    #     for fid in self._active:
-    #         if self._pt - self._active['fid']['last'] > timeout:
-    #             self._flow_complete(fid)
+        # complete idle flows, and emit flows whose expiry time has come
+        if pt <= self._timers.until:
+            return
+        for fid in self._timers.advance(pt):
+            flow = self._flows[fid]
+            if flow.active:
+                idle = flow.rec.pkt_last + self._idle_timeout
+                if not self._timers.is_due(idle):
+                    # packets arrived since the timer was armed
+                    self._timers.schedule(fid, idle)
+                    continue
+                # time the expiry from the idle deadline rather than from
+                # the packet that happened to move the clock past it, so the
+                # outcome for a flow only depends on its own packets
+                self._flow_complete(fid, idle)
+                if not self._timers.is_due(idle + self._expiry_timeout):
+                    continue
+                self._timers.cancel(fid)
+            self._emit_flow(self._pop_flow(fid).rec)
 
     def flush(self):
-        for fid in self._expiring:
-            self._emit_flow(self._expiring[fid])
-            # self._logger.debug("emitted "+str(fid)+" expiring during flush")
-        self._expiring.clear()
+        # emit expiring flows first, then those still active
+        for active in (False, True):
+            for flow in self._flows.values():
+                if flow is not _IGNORED and flow.active is active:
+                    self._emit_flow(flow.rec)
+                    # self._logger.debug("emitted flow during flush")
+
+        self._flows.clear()
+        self._connections.clear()
+        self._timers.clear()
+
+    def _enqueue_batches(self, flowqueue, batch_size, batch_interval):
+        # the partial batch is shared with a thread flushing it while no
+        # packets are being read
+        done = threading.Event()
+        flusher = threading.Thread(target=self._flush_idle_batch,
+                                   args=(flowqueue, batch_interval, done),
+                                   name="observer_batches",
+                                   daemon=True)
+        flusher.start()
 
-        for fid in self._active:
-            self._emit_flow(self._active[fid])
-            # self._logger.debug("emitted "+str(fid)+" active during flush")
-        self._active.clear()
+        try:
+            while True:
+                with self._batch_lock:
+                    while self._emitted:
+                        if not self._batch:
+                            self._batch_start = (self._pt, time.monotonic())
+                        self._batch.append(self._emitted.popleft())
+                        if len(self._batch) >= batch_size:
+                            self._put_batch(flowqueue)
+
+                    # don't hold on to a partial batch for too long
+                    if (self._batch and
+                            self._pt - self._batch_start[0] >= batch_interval):
+                        self._put_batch(flowqueue)
+
+                if not self._next_packet():
+                    break
+        finally:
+            done.set()
+            flusher.join()
+
+        self.flush()
+        batch = self._batch
+        batch.extend(self._emitted)
+        self._emitted.clear()
+        self._batch = []
+        for i in range(0, len(batch), batch_size):
+            flowqueue.put(FlowBatch.pack(batch[i:i + batch_size]))
+
+    def _put_batch(self, flowqueue):
+        flowqueue.put(FlowBatch.pack(self._batch))
+        self._batch = []
+
+    def _flush_idle_batch(self, flowqueue, batch_interval, done):
+        """
+        Place the partial batch on the queue once it has been held for
+        ``batch_interval`` seconds of wall-clock time, as while the packet
+        source is idle the packet time does not advance.
+        """
+
+        while not done.wait(batch_interval / 2):
+            with self._batch_lock:
+                if (self._batch and
+                        time.monotonic() - self._batch_start[1] >= batch_interval):
+                    self._put_batch(flowqueue)
 
-        self._ignored.clear()
+    def run_flow_enqueuer(self, flowqueue, irqueue=None, batch_size=1,
+                          batch_interval=0.5):
+        """
+        Read packets until the packet source is exhausted or a message is
+        received on ``irqueue``, placing flows on ``flowqueue`` as they are
+        emitted and then all remaining flows, followed by
+        :data:`pathspider.base.SHUTDOWN_SENTINEL`.
+
+        :param flowqueue: The queue to place flows on
+        :param irqueue: A queue on which any message interrupts the Observer
+        :param batch_size: If greater than 1, flows are placed on the queue as
+                           :class:`pathspider.flowrecord.FlowBatch` objects
+                           holding up to this many flows, instead of as
+                           individual dicts
+        :param batch_interval: The longest time, in seconds of packet time or
+                               of wall-clock time, that a flow is held back to
+                               fill a batch
+        """
 
-    def run_flow_enqueuer(self, flowqueue, irqueue=None):
         if irqueue:
             self._irq = irqueue
             self._irq_fired = None
 
-        # Run main loop until last packet seen
-        # then flush active flows and run again
-        for _ in range(2):
-            while True:
-                f = self._next_flow()
-                if f:
-                    flowqueue.put(f)
-                else:
-                    self.flush()
-                    break
+        if self._expected is not None:
+            self._expected.start()
+
+        if batch_size > 1:
+            self._enqueue_batches(flowqueue, batch_size, batch_interval)
+        else:
+            # Run main loop until last packet seen
+            # then flush active flows and run again
+            for _ in range(2):
+                while True:
+                    f = self._next_flow()
+                    if f:
+                        flowqueue.put(f)
+                    else:
+                        self.flush()
+                        break
 
         # log observer info on shutdown
+        if self._trace is not None:
+            self._ct_drops += self._trace.pkt_drops()
         self._logger.info(("processed %u packets "
                            "(%u dropped, %u short, %u non-ip) "
-                           "into %u flows (%u ignored)"), self._ct_pkt,
-                          self._trace.pkt_drops(), self._ct_shortkey,
-                          self._ct_nonip, self._ct_flow, self._ct_ignored)
+                           "into %u flows (%u ignored, %u finished early, "
+                           "%u unexpected packets)"),
+                          self._ct_pkt, self._ct_drops, self._ct_shortkey,
+                          self._ct_nonip, self._ct_flow, self._ct_ignored,
+                          self._ct_finished, self._ct_unexpected)
 
         flowqueue.put(SHUTDOWN_SENTINEL)
 
@@ -431,7 +648,8 @@ class DummyObserver:  # pylint: disable=R0903
     for PATHspider's test suite.
     """
 
-    def run_flow_enqueuer(self, flowqueue, irqueue=None):  # pylint: disable=R0201
+    def run_flow_enqueuer(self, flowqueue, irqueue=None, batch_size=1, # pylint: disable=R0201,unused-argument
+                          batch_interval=0.5):
         """
         When running the flow enqueuer, no network operation is performed and
         the thread will block until given a shutdown signal. When the shutdown
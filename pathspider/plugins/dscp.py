@@ -16,7 +16,7 @@ class DSCP(SynchronizedSpider, PluggableSpider):
     description = "Differentiated Services Codepoints"
     version = pathspider.base.__version__
     chains = [BasicChain, DSCPChain, TCPChain, DNSChain]
-    connect_supported = ["http", "tcp", "dnstcp", "dnsudp"]
+    connect_supported = ["http", "tcp", "dnstcp", "dnsudp", "tcpsyn"]
 
     def config_no_dscp(self):  # pylint: disable=no-self-use
         """
@@ -42,6 +42,16 @@ class DSCP(SynchronizedSpider, PluggableSpider):
 
     configurations = [config_no_dscp, config_dscp]
 
+    def syn_probe(self, config):
+        """
+        Marks the SYN of the second configuration with the codepoint, for
+        stateless probes, in place of the iptables rule.
+        """
+
+        if config == 1:
+            return {'tos': self.args.codepoint << 2}
+        return {}
+
     def combine_flows(self, flows):
         # discard non-observed flows
         for f in flows:
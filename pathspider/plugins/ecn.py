@@ -7,7 +7,9 @@ from pathspider.base import CONN_OK
 from pathspider.sync import SynchronizedSpider
 from pathspider.chains.basic import BasicChain
 from pathspider.chains.tcp import TCPChain
+from pathspider.chains.tcp import TCP_SA
 from pathspider.chains.tcp import TCP_SAE
+from pathspider.chains.tcp import TCP_SEC
 from pathspider.chains.tcp import TCP_SAEC
 from pathspider.chains.ecn import ECNChain
 
@@ -18,7 +20,7 @@ class ECN(SynchronizedSpider, PluggableSpider):
     description = "Explicit Congestion Notification"
     version = pathspider.base.__version__
     chains = [BasicChain, TCPChain, ECNChain]
-    connect_supported = ["http", "https", "tcp", "dnstcp"]
+    connect_supported = ["http", "https", "tcp", "dnstcp", "tcpsyn"]
 
     def config_no_ecn(self): # pylint: disable=no-self-use
         """
@@ -46,6 +48,16 @@ class ECN(SynchronizedSpider, PluggableSpider):
 
     configurations = [config_no_ecn, config_ecn]
 
+    def syn_probe(self, config):
+        """
+        Requests ECN negotiation in the SYN of the second configuration, for
+        stateless probes, in place of the sysctl.
+        """
+
+        if config == 1:
+            return {'flags': TCP_SEC}
+        return {}
+
     def combine_flows(self, flows):
         conditions = []
 
@@ -58,7 +70,15 @@ class ECN(SynchronizedSpider, PluggableSpider):
                 conditions.append('pathspider.not_observed')
                 break
 
-        if flows[1]['observed'] and flows[1]['tcp_connected']:
+        connected = flows[1]['observed'] and flows[1]['tcp_connected']
+        if getattr(self.args, 'connect', None) == "tcpsyn":
+            # stateless probes never complete the handshake, so a SYN/ACK
+            # is as far as they get
+            connected = (flows[1]['observed'] and
+                         flows[1]['tcp_synflags_rev'] is not None and
+                         flows[1]['tcp_synflags_rev'] & TCP_SA == TCP_SA)
+
+        if connected:
             if flows[1]['tcp_synflags_rev'] & TCP_SAEC == TCP_SAE:
                 conditions.append('ecn.negotiation.succeeded')
             elif flows[1]['tcp_synflags_rev'] & TCP_SAEC == TCP_SAEC:
@@ -1,3 +1,5 @@
+import random
+
 from scapy.all import IP  # pylint: disable=no-name-in-module
 from scapy.all import IPv6  # pylint: disable=no-name-in-module
 from scapy.all import UDP  # pylint: disable=no-name-in-module
@@ -15,6 +17,18 @@ from pathspider.chains.tcp import TCPChain
 from pathspider.chains.evil import EvilChain
 from pathspider.chains.base import Chain
 from pathspider.chains.tcp import TCP_SYN, TCP_SA
+from pathspider.helpers.dns import pack_query
+from pathspider.helpers.tcp import connect_tcp_syn
+from pathspider.helpers.tcp import connect_tcp_syn_async
+from pathspider.inject import IPPROTO_TCP
+from pathspider.inject import IPPROTO_UDP
+from pathspider.inject import PacketTemplate
+
+# the packets for each connection type, address family and sequence number
+_TEMPLATES = {(connect, ipv6, seq): PacketTemplate(ipv6, proto, evil=seq == 1)
+              for (connect, proto) in (('tcpsyn', IPPROTO_TCP),
+                                       ('dnsudp', IPPROTO_UDP))
+              for ipv6 in (False, True) for seq in (0, 1)}
 
 class EvilBit(ForgeSpider, PluggableSpider):
 
@@ -25,6 +39,26 @@ class EvilBit(ForgeSpider, PluggableSpider):
     connect_supported = ["tcpsyn", "dnsudp"]
     packets = 2
 
+    def connect(self, job, seq):
+        """
+        Probes with a SYN for ``tcpsyn``, answering a SYN/ACK with a RST, or
+        sends a forged packet otherwise.
+        """
+
+        if self.args.connect == 'tcpsyn':
+            return connect_tcp_syn(self.source, job, self.args.timeout,
+                                   evil=seq == 1)
+        return super().connect(job, seq)
+
+    async def connect_async(self, job, seq):
+        if self.args.connect == 'tcpsyn':
+            return await connect_tcp_syn_async(self.source, job,
+                                               self.args.timeout,
+                                               evil=seq == 1)
+        return self.connect(job, seq)
+
+    async_connections = [connect_async] * packets
+
     def forge(self, job, seq):
         sport = 0
         while sport < 1024:
@@ -41,7 +75,16 @@ class EvilBit(ForgeSpider, PluggableSpider):
         if seq == 1:
             ip.flags = 'evil'
         return ip/l4
-    
+
+    def forge_bytes(self, job, seq):
+        ipv6 = ':' in job['dip']
+        if self.args.connect == 'dnsudp':
+            payload = pack_query(job['domain'])
+        else:
+            payload = b""
+        return _TEMPLATES[(self.args.connect, ipv6, seq)].build(
+            self.source[1 if ipv6 else 0], job['dip'],
+            random.randint(1024, 65535), job['dp'], payload)
 
     def combine_flows(self, flows):
         for flow in flows:
@@ -7,6 +7,9 @@ from pathspider.base import CONN_OK
 from pathspider.desync import DesynchronizedSpider
 from pathspider.helpers.http import connect_http
 from pathspider.helpers.http import connect_https
+from pathspider.helpers.http import connect_http_async
+from pathspider.helpers.http import connect_https_async
+from pathspider.helpers.http import http_share
 from pathspider.chains.basic import BasicChain
 from pathspider.chains.tcp import TCPChain
 
@@ -22,7 +25,19 @@ class H2(DesynchronizedSpider, PluggableSpider):
         if self.args.connect == "http":
             return connect_http(self.source, job, self.args.timeout)
         if self.args.connect == "https":
-            return connect_http(self.source, job, self.args.timeout)
+            share = http_share() if self.args.share_tls_sessions else None
+            return connect_https(self.source, job, self.args.timeout,
+                                 share=share)
+        else:
+            raise RuntimeError("Unknown connection mode specified")
+
+    async def conn_no_h2_async(self, job, config):  # pylint: disable=unused-argument
+        if self.args.connect == "http":
+            return await connect_http_async(self.source, job, self.args.timeout)
+        if self.args.connect == "https":
+            share = http_share() if self.args.share_tls_sessions else None
+            return await connect_https_async(self.source, job, self.args.timeout,
+                                             share=share)
         else:
             raise RuntimeError("Unknown connection mode specified")
 
@@ -32,11 +47,29 @@ class H2(DesynchronizedSpider, PluggableSpider):
         if self.args.connect == "http":
             return connect_http(self.source, job, self.args.timeout, curlopts, curlinfos)
         if self.args.connect == "https":
-            return connect_https(self.source, job, self.args.timeout, curlopts, curlinfos)
+            share = http_share() if self.args.share_tls_sessions else None
+            return connect_https(self.source, job, self.args.timeout, curlopts, curlinfos,
+                                 share=share)
+        else:
+            raise RuntimeError("Unknown connection mode specified")
+
+    async def conn_h2_async(self, job, config): # pylint: disable=unused-argument
+        curlopts = {pycurl.HTTP_VERSION: pycurl.CURL_HTTP_VERSION_2_0}
+        curlinfos = {pycurl.INFO_HTTP_VERSION}
+        if self.args.connect == "http":
+            return await connect_http_async(self.source, job, self.args.timeout,
+                                            curlopts, curlinfos)
+        if self.args.connect == "https":
+            share = http_share() if self.args.share_tls_sessions else None
+            return await connect_https_async(self.source, job, self.args.timeout,
+                                             curlopts, curlinfos, share=share)
         else:
             raise RuntimeError("Unknown connection mode specified")
 
     connections = [conn_no_h2, conn_h2]
+    # both connections are made with cURL, through the same engine, so that
+    # they differ only in the HTTP version requested
+    async_connections = [conn_no_h2_async, conn_h2_async]
 
     def combine_flows(self, flows):
         conditions = []
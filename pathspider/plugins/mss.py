@@ -7,6 +7,7 @@ from pathspider.helpers.tcp import connect_tcp
 from pathspider.chains.basic import BasicChain
 from pathspider.chains.mss import MSSChain
 from pathspider.chains.tcp import TCPChain
+from pathspider.chains.tcp import TCP_SA
 
 class MSS(SingleSpider, PluggableSpider):
 
@@ -14,7 +15,7 @@ class MSS(SingleSpider, PluggableSpider):
     description = "TCP Maximum Segment Size"
     version = pathspider.base.__version__
     chains = [BasicChain, TCPChain, MSSChain]
-    connect_supported = ["tcp", "http", "https", "dnstcp"]
+    connect_supported = ["tcp", "http", "https", "dnstcp", "tcpsyn"]
 
     def combine_flows(self, flows):
         conditions = []
@@ -22,9 +23,16 @@ class MSS(SingleSpider, PluggableSpider):
         if not flows[0]['observed']:
             return ['pathspider.not_observed']
 
-        conditions.append(self.combine_connectivity(flows[0]['tcp_connected']))
+        connected = flows[0]['tcp_connected']
+        if getattr(self.args, 'connect', None) == "tcpsyn":
+            # stateless probes never complete the handshake, so a SYN/ACK
+            # is as far as they get
+            connected = (flows[0]['tcp_synflags_rev'] is not None and
+                         flows[0]['tcp_synflags_rev'] & TCP_SA == TCP_SA)
 
-        if flows[0]['tcp_connected']:
+        conditions.append(self.combine_connectivity(connected))
+
+        if connected:
             conditions.append('mss.option.local.value:' + str(flows[0]['mss_value_fwd']))
             if flows[0]['mss_len_rev'] is not None:
                 conditions.append('mss.option.remote.value:' + str(flows[0]['mss_value_rev']))
@@ -11,9 +11,11 @@ from pathspider.base import CONN_FAILED
 from pathspider.base import CONN_TIMEOUT
 from pathspider.desync import DesynchronizedSpider
 from pathspider.helpers.dns import connect_dns_tcp
+from pathspider.helpers.dns import connect_dns_tcp_async
 from pathspider.helpers.dns import PSDNSRecord
 from pathspider.helpers.http import connect_http
 from pathspider.helpers.http import connect_https
+from pathspider.helpers.http import connect_http_async
 from pathspider.chains.basic import BasicChain
 from pathspider.chains.tcp import TCPChain
 from pathspider.chains.tfo import TFOChain
@@ -40,6 +42,14 @@ class TFO(DesynchronizedSpider, PluggableSpider):
         else:
             raise RuntimeError("Unknown connection mode specified")
 
+    async def conn_no_tfo_async(self, job, config):  # pylint: disable=unused-argument
+        if self.args.connect == "http":
+            return await connect_http_async(self.source, job, self.args.timeout)
+        elif self.args.connect == "dnstcp":
+            return await connect_dns_tcp_async(self.source, job, self.args.timeout)
+        else:
+            raise RuntimeError("Unknown connection mode specified")
+
     def conn_tfo(self, job, config): # pylint: disable=unused-argument
         if self.args.connect == "http":
             curlopts = {CURLOPT_TCP_FASTOPEN: 1}
@@ -79,6 +89,10 @@ class TFO(DesynchronizedSpider, PluggableSpider):
             raise RuntimeError("Unknown connection mode specified")
 
     connections = [conn_no_tfo, conn_tfo, conn_tfo]
+    # the fast open connections are made with blocking sends, so are run in
+    # the event loop's executor. The baseline is made with the same kernel
+    # TCP stack, and for http, with cURL, as the fast open connections are.
+    async_connections = [conn_no_tfo_async, conn_tfo, conn_tfo]
 
     def combine_flows(self, flows):
         conditions = []
@@ -1,4 +1,6 @@
 
+import random
+
 from scapy.all import IP         # pylint: disable=E0611
 from scapy.all import IPv6       # pylint: disable=E0611
 from scapy.all import UDP        # pylint: disable=E0611
@@ -11,6 +13,14 @@ from pathspider.base import PluggableSpider
 from pathspider.forge import ForgeSpider
 from pathspider.chains.basic import BasicChain
 from pathspider.chains.dns import DNSChain
+from pathspider.helpers.dns import pack_query
+from pathspider.inject import IPPROTO_UDP
+from pathspider.inject import PacketTemplate
+
+# the packets for each address family and configuration
+_TEMPLATES = {(ipv6, config): PacketTemplate(ipv6, IPPROTO_UDP,
+                                             checksum=config == 0)
+              for ipv6 in (False, True) for config in (0, 1)}
 
 class UDPZero(ForgeSpider, PluggableSpider):
 
@@ -34,6 +44,12 @@ class UDPZero(ForgeSpider, PluggableSpider):
             udp.chksum = 0 # If not initialised, Scapy will calculate
         return ip/udp
 
+    def forge_bytes(self, job, config):
+        ipv6 = ':' in job['dip']
+        return _TEMPLATES[(ipv6, config)].build(
+            self.source[1 if ipv6 else 0], job['dip'],
+            random.randint(1024, 65535), job['dp'], pack_query(job['domain']))
+
     def combine_flows(self, flows):
         for flow in flows:
             if not flow['observed']:
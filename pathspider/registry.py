@@ -0,0 +1,387 @@
+"""
+.. module:: pathspider.registry
+   :synopsis: A registry of the flows that the workers expect to be observed
+
+This module contains the registry of expected flows, which the workers publish
+into as they perform connections. It lets the merger, and the Observers,
+discard flows that cannot belong to any measurement as early as possible.
+
+Workers announce the destination address of each connection before it is
+made, and its flow key once the source port is known. The announcement of an
+address is written to a pipe to each Observer process before the connection
+starts, so an Observer will always know about it by the time it sees the
+first packet of the connection.
+
+Once a connection has ended, workers also announce its destination address
+and source port on the same pipes, along with a grace period. An Observer
+tracking the flow of that connection then completes it once the grace period
+has passed, instead of waiting for the flow to go idle, so the flow reaches
+the merger shortly after the connection's result.
+
+Announcements are written to the pipes by a single writer thread, which
+writes all of the announcements queued since its last write as one message
+on each pipe. Addresses must have been written before their connections
+start, so a worker announcing an address waits until the message holding it
+has been written, or, to announce many addresses at once or to wait from an
+event loop, announces them without waiting and then waits on the future from
+:meth:`ExpectedFlows.written`. Announcements of finished connections are not
+waited for. The pipe to an Observer that has exited is dropped.
+
+"""
+
+import collections
+import ipaddress
+import logging
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+#: Format of the part of a finished connection announcement following the
+#: packed address: the source port and the grace period in seconds
+_FINISHED_FORMAT = struct.Struct("!Hd")
+
+
+class ExpectedFlows:
+    """
+    The registry of expected flows, as kept by the spider process.
+
+    :param ttl: The time, in seconds, for which an Observer will admit new
+                flows for an address after a connection to it was announced
+    :type ttl: float
+    :param grace: The default time, in seconds, for which an Observer waits
+                  for late packets after a connection has finished before it
+                  completes the flow
+    :type grace: float
+    """
+
+    def __init__(self, ttl=60, grace=2):
+        self._ttl = ttl
+        self._grace = grace
+        self._lock = threading.Lock()
+        self._keys = set()
+        self._connecting = collections.Counter()
+        self._senders = []
+        self._readers = []
+
+        self._announce_lock = threading.Lock()
+        self._queued = threading.Condition(self._announce_lock)
+        self._announcements = []
+        self._queued_count = 0
+        self._written_count = 0
+        self._waiters = []
+        self._writer = None
+        self._running = True
+
+        self.__logger = logging.getLogger('registry')
+
+    def observer_view(self):
+        """
+        Create the view of the registry for a new Observer. This must be
+        called before the Observer process is started.
+
+        :rtype: ExpectedAddresses
+        """
+
+        import multiprocessing as mp
+
+        (reader, writer) = mp.Pipe(duplex=False)
+        self._senders.append(writer)
+        self._readers.append(reader)
+        return ExpectedAddresses(reader, self._ttl)
+
+    def views_started(self):
+        """
+        Close this process's copies of the receiving ends of the pipes, once
+        the processes of all the Observers holding the views have been
+        started, so that writing to the pipe of an Observer that has exited
+        fails rather than blocking.
+        """
+
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
+
+    def close(self):
+        """
+        Stop the writer thread, once the announcements already queued have
+        been written.
+        """
+
+        with self._announce_lock:
+            self._running = False
+            self._queued.notify()
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+
+    def written(self):
+        """
+        Get a future which is done once all of the announcements made so far
+        have been written to the Observers.
+
+        :rtype: concurrent.futures.Future
+        """
+
+        future = Future()
+        with self._announce_lock:
+            if self._written_count < self._queued_count:
+                self._waiters.append((self._queued_count, future))
+                return future
+        future.set_result(None)
+        return future
+
+    def _announce(self, message):
+        with self._announce_lock:
+            if not self._running:
+                return
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write,
+                                                name="expected_flows",
+                                                daemon=True)
+                self._writer.start()
+            self._announcements.append(message)
+            self._queued_count += 1
+            self._queued.notify()
+
+    def _write(self):
+        while True:
+            with self._announce_lock:
+                while self._running and not self._announcements:
+                    self._queued.wait()
+                if not self._announcements:
+                    return
+                announcements = self._announcements
+                self._announcements = []
+                count = self._queued_count
+
+            # each announcement is preceded by its length, as they are
+            # written together
+            message = b"".join(bytes((len(announcement),)) + announcement
+                               for announcement in announcements)
+            for sender in list(self._senders):
+                try:
+                    sender.send_bytes(message)
+                except OSError:
+                    self.__logger.warning("observer pipe closed, no longer "
+                                          "announcing expected flows to it")
+                    self._senders.remove(sender)
+                    sender.close()
+
+            with self._announce_lock:
+                self._written_count = count
+                done = [future for (waiting, future) in self._waiters
+                        if waiting <= count]
+                self._waiters = [(waiting, future)
+                                 for (waiting, future) in self._waiters
+                                 if waiting > count]
+            for future in done:
+                future.set_result(None)
+
+    def connecting(self, address, wait=True):
+        """
+        Announce that a connection to ``address`` is about to be made.
+
+        :param address: The destination address of the connection
+        :type address: str
+        :param wait: Whether to wait until the announcement has been written
+                     to the Observers. If not, the connection must not be
+                     started before the future from :meth:`written` is done.
+        :type wait: bool
+        """
+
+        try:
+            packed = ipaddress.ip_address(address).packed
+        except ValueError:
+            packed = None
+
+        with self._lock:
+            self._connecting[address] += 1
+        if packed is not None:
+            self._announce(packed)
+            if wait:
+                self.written().result()
+
+    def connected(self, address, port=None):
+        """
+        Announce that a connection to ``address``, previously announced with
+        :meth:`connecting`, has been made from source port ``port``.
+
+        :param address: The destination address of the connection
+        :type address: str
+        :param port: The source port of the connection, or ``None`` if the
+                     connection was not made
+        :type port: int
+        """
+
+        with self._lock:
+            self._connecting[address] -= 1
+            if self._connecting[address] <= 0:
+                del self._connecting[address]
+            if port is not None:
+                self._keys.add((address, port))
+
+    def finished(self, address, port, grace=None):
+        """
+        Announce that a connection to ``address`` from source port ``port``
+        has ended, so that the Observers complete its flow after the grace
+        period instead of waiting for it to go idle.
+
+        :param address: The destination address of the connection
+        :type address: str
+        :param port: The source port of the connection
+        :type port: int
+        :param grace: The time, in seconds, to wait for late packets before
+                      the flow is completed, or ``None`` for the default
+        :type grace: float
+        """
+
+        try:
+            packed = ipaddress.ip_address(address).packed
+        except ValueError:
+            return
+
+        if grace is None:
+            grace = self._grace
+        self._announce(packed + _FINISHED_FORMAT.pack(port, grace))
+
+    def is_expected(self, key):
+        """
+        Check whether a flow with the given merger key is expected, either
+        because a connection with that key was made, or because a connection
+        to its address is being made.
+
+        :param key: The flow key, as used by the merger
+        :type key: tuple
+        :rtype: bool
+        """
+
+        return key in self._keys or key[0] in self._connecting
+
+    def discard(self, key):
+        """
+        Remove a flow key from the registry, once its flow is no longer
+        expected.
+
+        :param key: The flow key, as used by the merger
+        :type key: tuple
+        """
+
+        self._keys.discard(key)
+
+
+class ExpectedAddresses:
+    """
+    The view of the registry of expected flows used by an Observer, holding
+    the addresses to which connections were recently announced, and the
+    connections announced as finished that the Observer has not yet handled.
+
+    :param reader: The receiving end of the pipe on which addresses are
+                   announced
+    :type reader: multiprocessing.connection.Connection
+    :param ttl: The time, in seconds, for which new flows are admitted for an
+                address after it was announced
+    :type ttl: float
+    """
+
+    def __init__(self, reader, ttl):
+        self._reader = reader
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._addresses = {}  # map packed address to time of announcement
+        self._finished = collections.deque()
+        self._next_purge = 0
+        self._thread = None
+
+    def start(self):
+        """
+        Start reading announcements in the background. This must be called
+        in the Observer process.
+        """
+
+        self._thread = threading.Thread(target=self._read_announcements,
+                                        name="expected_addresses",
+                                        daemon=True)
+        self._thread.start()
+
+    def _read_announcements(self):
+        while True:
+            try:
+                if self._reader.poll(None):
+                    with self._lock:
+                        self._receive()
+            except (EOFError, OSError):
+                return
+
+    def _receive(self):
+        now = time.time()
+        while self._reader.poll():
+            message = self._reader.recv_bytes()
+            offset = 0
+            while offset < len(message):
+                length = message[offset]
+                announcement = message[offset + 1:offset + 1 + length]
+                offset += 1 + length
+                if length in (4, 16):
+                    self._addresses[announcement] = now
+                else:
+                    # a finished connection, rather than a bare address
+                    split = length - _FINISHED_FORMAT.size
+                    (_, grace) = _FINISHED_FORMAT.unpack(announcement[split:])
+                    self._finished.append((announcement[:split + 2], grace))
+
+    def admits(self, a, b):
+        """
+        Check whether a new flow between the packed addresses ``a`` and ``b``
+        should be admitted, because a connection to one of them was recently
+        announced.
+
+        :param a: The packed address of one end of the flow
+        :type a: bytes
+        :param b: The packed address of the other end of the flow
+        :type b: bytes
+        :rtype: bool
+        """
+
+        with self._lock:
+            now = time.time()
+            if now >= self._next_purge:
+                self._addresses = {
+                    address: announced
+                    for (address, announced) in self._addresses.items()
+                    if announced + self._ttl > now}
+                self._next_purge = now + self._ttl
+
+            if self._announced(a, b, now):
+                return True
+
+            # pick up any announcements not yet read in the background, as
+            # the first packet of a connection can race the reader thread
+            try:
+                self._receive()
+            except (EOFError, OSError):
+                pass
+            return self._announced(a, b, now)
+
+    def _announced(self, a, b, now):
+        for address in (a, b):
+            announced = self._addresses.get(address)
+            if announced is not None and announced + self._ttl > now:
+                return True
+        return False
+
+    def finished(self):
+        """
+        Take the connections announced as finished since the last call.
+
+        Each connection is identified by its packed destination address
+        followed by its source port as two bytes in network byte order.
+
+        :return: A list of ``(connection, grace)`` pairs
+        :rtype: list
+        """
+
+        finished = []
+        while self._finished:
+            finished.append(self._finished.popleft())
+        return finished
@@ -5,3 +5,4 @@ class SingleSpider(DesynchronizedSpider):
     # pylint: disable=W0223
 
     connections = [SynchronizedSpider.connect]
+    syn_probe = SynchronizedSpider.syn_probe
@@ -1,19 +1,37 @@
+import functools
 import logging
 import queue
 import threading
 import time
 import uuid
+from datetime import datetime
 
 from pathspider.base import Spider
+from pathspider.base import MERGE_JOB
 from pathspider.base import QUEUE_SLEEP
 from pathspider.base import SHUTDOWN_SENTINEL
 from pathspider.helpers.tcp import connect_tcp
+from pathspider.helpers.tcp import connect_tcp_syn
+from pathspider.helpers.tcp import syn_prober
+from pathspider.helpers.tcp import tcp_connector
 from pathspider.helpers.http import connect_http
 from pathspider.helpers.http import connect_https
+from pathspider.helpers.http import http_share
+from pathspider.helpers.http import submit_http
+from pathspider.helpers.http import submit_https
 from pathspider.helpers.dns import connect_dns_tcp
 from pathspider.helpers.dns import connect_dns_udp
+from pathspider.helpers.dns import dns_engine
 from pathspider.base import CONN_DISCARD
 
+#: The number of jobs run in each epoch for each worker, by default
+EPOCH_JOBS_PER_WORKER = 10
+
+#: The connection modes whose connections are performed by an engine shared
+#: by the process, and so are submitted by the configurator all at once
+#: rather than made one at a time by each worker
+SUBMITTED_CONNECTIONS = ("tcp", "tcpsyn", "http", "https", "dnsudp")
+
 class SynchronizedSpider(Spider):
     # pylint: disable=W0223
 
@@ -25,35 +43,240 @@ class SynchronizedSpider(Spider):
 
         self._config_count = len(self.configurations)
 
-        self.__semaphores = []
+        # stateless SYN probes set the header fields for each configuration
+        # themselves, so the configurations need not be applied
+        self.synchronized = getattr(self.args, 'connect', None) != "tcpsyn"
+
+        #: The number of jobs run in each epoch
+        self.epoch_size = (getattr(self.args, 'epoch_size', None) or
+                           worker_count * EPOCH_JOBS_PER_WORKER)
+        #: The time to wait for the next connection of a configuration to
+        #: complete before the connections still in progress are abandoned
+        self.straggler_timeout = 2 * (getattr(self.args, 'timeout', None) or 5)
+
+        #: Whether the connections are submitted to an engine by the
+        #: configurator, which is only done if the plugin makes its
+        #: connections with :meth:`connect`
+        self.submitted = (
+            getattr(self.args, 'connect', None) in SUBMITTED_CONNECTIONS and
+            type(self).connect is SynchronizedSpider.connect)
+
+        self.__connections = queue.Queue()
+        self.__barrier = CountedBarrier()
+
+    def _next_epoch(self):
+        """
+        Take the jobs for the next epoch from the job queue: those waiting,
+        up to the size of an epoch.
+
+        :return: The jobs, an empty list if none arrived in a short time,
+                 or ``None`` if the spider is shutting down
+        :rtype: list
+        """
 
-        # create semaphores for synchronizing configurations
-        for config in range(0, len(self.configurations)):
-            self.__semaphores.append([])
-            for i in range(0, 2):
-                self.__semaphores[config].append(SemaphoreN(worker_count))
-                self.__semaphores[config][i].empty()
+        jobs = []
+        try:
+            job = self.jobqueue.get(timeout=QUEUE_SLEEP)
+        except queue.Empty:
+            return jobs
+        while True:
+            if job == SHUTDOWN_SENTINEL:
+                self.jobqueue.task_done()
+                self.__logger.debug("scheduler got shutdown sentinel")
+                return jobs or None
+            jobs.append(job)
+            if len(jobs) >= self.epoch_size:
+                return jobs
+            try:
+                job = self.jobqueue.get_nowait()
+            except queue.Empty:
+                return jobs
+
+    def _run_epoch(self, jobs):
+        conns = [[None] * len(self.configurations) for _ in jobs]
+        active = list(range(len(jobs)))
+        abandoned = {}
+
+        # without synchronization, the connections in all configurations
+        # are performed at once
+        if self.synchronized:
+            phases = [[config] for config in range(len(self.configurations))]
+        else:
+            phases = [list(range(len(self.configurations)))]
+
+        for phase in phases:
+            if self.synchronized:
+                self.__logger.debug("setting config %d", phase[0])
+                self.configurations[phase[0]](self)
+                self.__logger.debug("config %d active", phase[0])
+
+            generation = self.__barrier.reset(len(active) * len(phase))
+            if self.submitted:
+                # the addresses of the whole phase are announced to the
+                # observers together, and waited for once
+                for i in active:
+                    for _ in phase:
+                        self._connecting(jobs[i], wait=False)
+                if self.expected is not None:
+                    self.expected.written().result()
+            for i in active:
+                for config in phase:
+                    if self.submitted:
+                        self._submit_connection(generation, jobs[i], config,
+                                                conns[i])
+                    else:
+                        self.__connections.put((generation, jobs[i], config,
+                                                conns[i]))
+
+            while self.__barrier.wait(QUEUE_SLEEP) > 0:
+                if not self.running:
+                    return
+                if self.__barrier.idle() < self.straggler_timeout:
+                    continue
+                # connections still in progress would finish in the wrong
+                # configuration, so their jobs are abandoned
+                stragglers = {i for i in active
+                              if any(conns[i][config] is None
+                                     for config in phase)}
+                self.__logger.warning("abandoning %d jobs with connections "
+                                      "still in progress", len(stragglers))
+                for i in stragglers:
+                    # connections completing late still write to conns
+                    abandoned[i] = list(conns[i])
+                active = [i for i in active if i not in stragglers]
+                break
+            self.__barrier.reset(0)
+
+        for i in active:
+            self._finish_job(jobs[i], conns[i])
+        for (i, done) in abandoned.items():
+            self._finish_job(jobs[i], done)
+
+    def _finish_job(self, job, conns):
+        if any(conn is not None and conn.get('spdr_state') == CONN_DISCARD
+               for conn in conns):
+            return
+        jobId = uuid.uuid1().hex
+        if None in conns:
+            # the job was abandoned, and is output as incomplete once its
+            # completed connections have been merged
+            job['missing_configs'] = [config
+                                      for (config, conn) in enumerate(conns)
+                                      if conn is None]
+            if len(job['missing_configs']) == len(conns):
+                self.resqueue.put((MERGE_JOB, time.monotonic(),
+                                   (jobId, job)))
+                return
+        # Save job record for combiner
+        self.jobtab[jobId] = job
+        # Pass results on for merge
+        self._finalise_conns(job, jobId, conns)
 
     def configurator(self):
         """
-        Thread which synchronizes on a set of semaphores and alternates
-        between two system states.
+        Thread which schedules the connections of the workers in epochs.
+
+        In each epoch, the jobs waiting in the job queue, up to
+        :attr:`epoch_size` of them, are taken together. For each
+        configuration in turn, the system is switched to the configuration
+        once, and the connections of all of the jobs in that configuration
+        are shared out between the workers, to be run concurrently. Once
+        every connection has completed, the next configuration is set.
+
+        For the connection modes performed by an engine shared by the
+        process, listed in :data:`SUBMITTED_CONNECTIONS`, the connections of
+        all of the jobs are instead submitted to the engine at once, see
+        :meth:`submit`, so that they are all in progress together rather
+        than one for each worker.
+
+        If no connection has completed within :attr:`straggler_timeout`,
+        the jobs whose connections are still in progress are abandoned, so
+        that their results are not recorded against the wrong
+        configuration. Abandoned jobs are output with the
+        ``pathspider.incomplete`` condition, listing the configurations they
+        have no results for in ``missing_configs``.
+
+        With the ``tcpsyn`` connection mode, the configurations are set in
+        the SYNs sent rather than applied to the system, so they are not
+        set here, and the connections in every configuration are run at
+        once.
+
+        When the job queue is empty, the configuration is not changed.
         """
 
         while self.running:
-            for config in range(0, len(self.configurations)):
-                self.__logger.debug("setting config %d", config)
-                self.configurations[config](self)
-                self.__logger.debug("config %d active", config)
-                self.__semaphores[config][0].release_n(self.worker_count)
-                self.__semaphores[(config + 1) % len(self.configurations)][
-                    1].acquire_n(self.worker_count)
-
-        # In case the master exits the run loop before all workers have,
-        # these tokens will allow all workers to run through again,
-        # until the next check at the start of the loop
-        for config in range(0, len(self.configurations)):
-            self.__semaphores[config][0].release_n(self.worker_count)
+            jobs = self._next_epoch()
+            if jobs is None:
+                break
+            if len(jobs) == 0:
+                continue
+            self.__logger.debug("starting epoch of %d jobs", len(jobs))
+            self._run_epoch(jobs)
+            if not self.running:
+                # the job queue has been drained on termination
+                break
+            for _ in jobs:
+                self.jobqueue.task_done()
+
+        # stop the workers
+        for _ in range(self.worker_count):
+            self.__connections.put(SHUTDOWN_SENTINEL)
+
+    def syn_probe(self, config): # pylint: disable=unused-argument,no-self-use
+        """
+        Gives the header fields of the SYN sent in a configuration by the
+        ``tcpsyn`` connection mode, as keyword arguments for
+        :meth:`pathspider.helpers.tcp.SYNProber.submit`. By default, the
+        same SYN is sent in every configuration.
+
+        :param config: The configuration
+        :type config: int
+        :rtype: dict
+        """
+
+        return {}
+
+    def _submit_connection(self, generation, job, config, conns):
+        start = str(datetime.utcnow())
+        future = self.submit(job, config)
+        future.add_done_callback(functools.partial(
+            self._submitted_connection, generation, job, config, conns, start))
+
+    def _submitted_connection(self, generation, job, config, conns, start,
+                              future):
+        conn = future.result()
+        self._connected(job, conn)
+        conn['spdr_start'] = start
+        conns[config] = conn
+        self.__barrier.arrive(generation)
+
+    def _share(self):
+        if getattr(self.args, 'share_tls_sessions', False):
+            return http_share()
+        return None
+
+    def submit(self, job, config): # pylint: disable=unused-argument
+        """
+        Starts the requested connection on the engine shared by the process
+        for the connection mode, without waiting for it to complete.
+
+        :return: A future for the connection record
+        :rtype: concurrent.futures.Future
+        """
+
+        if self.args.connect == "tcp":
+            return tcp_connector().submit(self.source, job, self.args.timeout)
+        if self.args.connect == "tcpsyn":
+            return syn_prober().submit(self.source, job, self.args.timeout,
+                                       **self.syn_probe(config))
+        if self.args.connect == "http":
+            return submit_http(self.source, job, self.args.timeout)
+        if self.args.connect == "https":
+            return submit_https(self.source, job, self.args.timeout,
+                                share=self._share())
+        if self.args.connect == "dnsudp":
+            return dns_engine().submit(self.source, job, self.args.timeout)
+        raise RuntimeError("Unknown connection type requested!")
 
     def connect(self, job, config): # pylint: disable=unused-argument
         """
@@ -62,10 +285,14 @@ class SynchronizedSpider(Spider):
 
         if self.args.connect == "tcp":
             rec = connect_tcp(self.source, job, self.args.timeout)
+        elif self.args.connect == "tcpsyn":
+            rec = connect_tcp_syn(self.source, job, self.args.timeout,
+                                  **self.syn_probe(config))
         elif self.args.connect == "http":
             rec = connect_http(self.source, job, self.args.timeout)
         elif self.args.connect == "https":
-            rec = connect_https(self.source, job, self.args.timeout)
+            rec = connect_https(self.source, job, self.args.timeout,
+                                share=self._share())
         elif self.args.connect == "dnstcp":
             rec = connect_dns_tcp(self.source, job, self.args.timeout)
         elif self.args.connect == "dnsudp":
@@ -85,86 +312,42 @@ class SynchronizedSpider(Spider):
 
         The workers operate as continuous loops:
 
-         * Fetch next job from the job queue
-         * For each configuration:
-            * Acquire a lock for the configuration (blocking)
-            * Perform the connection with the configuration
-            * Release the lock
-            * Pass the result to the merger
+         * Fetch the next connection scheduled by the configurator
+         * Perform the connection, in the configuration it was scheduled
+           for
+         * Report its completion to the configurator
          * Do it all again
 
-        If the job fetched is the SHUTDOWN_SENTINEL, then the worker will
-        terminate as this indicates that all the jobs have now been processed.
+        If the connection fetched is the SHUTDOWN_SENTINEL, then the worker
+        will terminate as this indicates that all the jobs have now been
+        processed.
         """
 
-        worker_active = True
-
         while self.running:
-            if worker_active:
-                try:
-                    job = self.jobqueue.get_nowait()
-                    jobId = uuid.uuid1().hex
-
-                    # Break on shutdown sentinel
-                    if job == SHUTDOWN_SENTINEL:
-                        self.jobqueue.task_done()
-                        self.__logger.debug(
-                            "shutting down worker %d on sentinel",
-                            worker_number)
-                        worker_active = False
-                        with self.active_worker_lock:
-                            self.active_worker_count -= 1
-                            self.__logger.debug("%d workers still active",
-                                                self.active_worker_count)
-                        continue
-
-                    self.__logger.debug("got a job: " + repr(job))
-                except queue.Empty:
-                    #logger.debug("no job available, sleeping")
-                    # spin the semaphores
-                    for config in range(0, len(self.configurations)):
-                        self.__semaphores[config][0].acquire()
-                        time.sleep(QUEUE_SLEEP)
-                        self.__semaphores[(config + 1) % len(
-                            self.configurations)][1].release()
-                else:
-                    conns = []
-                    should_discard = False
-
-                    for config in range(0, len(self.configurations)):
-                        # Wait for configuration
-                        self.__semaphores[config][0].acquire()
-
-                        # Connect in configuration
-                        conn = self._connect_wrapper(job, config)
-                        if 'spdr_state' in conn:
-                            if conn['spdr_state'] == CONN_DISCARD:
-                                should_discard = True
-                        conns.append(conn)
-
-                        # Wait for next configuration
-                        self.__semaphores[(config + 1) % len(
-                            self.configurations)][1].release()
-
-                    if not should_discard:
-                        # Save job record for combiner
-                        self.jobtab[jobId] = job
-
-                        # Finish connections and pass on for merging
-                        self._finalise_conns(job, jobId, conns)
-
-                    self.__logger.debug("job complete: " + repr(job))
-                    self.jobqueue.task_done()
-            else:  # not worker_active, spin the semaphores
-                for config in range(0, len(self.configurations)):
-                    self.__semaphores[config][0].acquire()
-                    time.sleep(QUEUE_SLEEP)
-                    if config == 0:
-                        with self.active_worker_lock:
-                            if self.active_worker_count <= 0:
-                                return
-                    self.__semaphores[(config + 1) % len(self.configurations)][
-                        1].release()
+            try:
+                item = self.__connections.get(timeout=QUEUE_SLEEP)
+            except queue.Empty:
+                continue
+
+            # Break on shutdown sentinel
+            if item == SHUTDOWN_SENTINEL:
+                self.__logger.debug("shutting down worker %d on sentinel",
+                                    worker_number)
+                break
+
+            (generation, job, config, conns) = item
+            # the configuration may have been abandoned while the
+            # connection was waiting
+            if not self.__barrier.current(generation):
+                continue
+
+            conns[config] = self._connect_wrapper(job, config)
+            self.__barrier.arrive(generation)
+
+        with self.active_worker_lock:
+            self.active_worker_count -= 1
+            self.__logger.debug("%d workers still active",
+                                self.active_worker_count)
 
     @classmethod
     def register_args(cls, subparsers):
@@ -179,55 +362,91 @@ class SynchronizedSpider(Spider):
         parser.add_argument("--timeout", default=5, type=int,
                             help=("The timeout to use for attempted connections in seconds "
                                   "(Default: 5)"))
+        parser.add_argument("--epoch-size", type=int, metavar="JOBS",
+                            help=("The number of jobs to run in each configuration before "
+                                  "switching to the next (Default: {} per worker)".format(
+                                      EPOCH_JOBS_PER_WORKER)))
+        if "https" in cls.connect_supported:
+            parser.add_argument("--share-tls-sessions", action='store_true',
+                                help=("Resume TLS sessions with servers seen before, instead "
+                                      "of a full handshake for every connection"))
         if hasattr(cls, "extra_args"):
             cls.extra_args(parser)
 
 
-class SemaphoreN(threading.BoundedSemaphore):
+class CountedBarrier:
     """
-    An extension to the standard library's BoundedSemaphore that provides
-    functions to handle n tokens at once.
+    A barrier at which one thread waits for a given number of arrivals from
+    other threads. Each time it is reset, the barrier starts a new
+    generation, and arrivals for earlier generations are ignored, so that a
+    thread arriving late cannot be counted towards the wrong generation.
     """
-    def __init__(self, value):
-        self._value = value
-        super().__init__(self._value)
-        self.empty()
 
-    def __str__(self):
-        return 'SemaphoreN with a maximum value of {}.'.format(self._value)
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._count = 0
+        self._last = time.monotonic()
+
+    def reset(self, count):
+        """
+        Start a new generation, waiting for ``count`` arrivals.
+
+        :returns: The new generation
+        :rtype: int
+        """
+
+        with self._cond:
+            self._generation += 1
+            self._count = count
+            self._last = time.monotonic()
+            return self._generation
+
+    def current(self, generation):
+        """
+        Check whether ``generation`` is the current generation.
 
-    def acquire_n(self, value=1, blocking=True, timeout=None):
+        :rtype: bool
         """
-        Acquire ``value`` number of tokens at once.
 
-        The parameters ``blocking`` and ``timeout`` have the same semantics as
-        :class:`BoundedSemaphore`.
+        return generation == self._generation
 
-        :returns: The same value as the last call to `BoundedSemaphore`'s
-                  :meth:`acquire` if :meth:`acquire` were called ``value``
-                  times instead of the call to this method.
+    def arrive(self, generation):
         """
-        ret = None
-        for _ in range(value):
-            ret = self.acquire(blocking=blocking, timeout=timeout)
-        return ret
+        Count an arrival, if it is for the current generation.
 
-    def release_n(self, value=1):
+        :returns: Whether the arrival was counted
+        :rtype: bool
         """
-        Release ``value`` number of tokens at once.
 
-        :returns: The same value as the last call to `BoundedSemaphore`'s
-                  :meth:`release` if :meth:`release` were called ``value``
-                  times instead of the call to this method.
+        with self._cond:
+            if generation != self._generation:
+                return False
+            self._count -= 1
+            self._last = time.monotonic()
+            self._cond.notify_all()
+            return True
+
+    def wait(self, timeout=None):
         """
-        ret = None
-        for _ in range(value):
-            ret = self.release()
-        return ret
+        Wait for all of the arrivals for the current generation, or until
+        ``timeout`` seconds have passed.
 
-    def empty(self):
+        :returns: The number of arrivals still awaited
+        :rtype: int
         """
-        Acquire all tokens of the semaphore.
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._count <= 0, timeout)
+            return self._count
+
+    def idle(self):
+        """
+        Get the time since the last arrival, or since the barrier was reset
+        if there has been none.
+
+        :returns: The time, in seconds
+        :rtype: float
         """
-        while self.acquire(blocking=False):
-            pass
+
+        return time.monotonic() - self._last
@@ -0,0 +1,29 @@
+from pathspider.bpf import shard_filter
+
+def test_shard_filter_single():
+    assert shard_filter(0, 1) is None
+
+def test_shard_filter_shards():
+    filters = [shard_filter(shard, 4) for shard in range(4)]
+    for shard, bpf in enumerate(filters):
+        assert "% 4 == {}".format(shard) in bpf
+        assert "% 4 == {}".format((shard + 1) % 4) not in bpf
+    # non-IP packets only go to the first shard
+    assert "not ip and not ip6" in filters[0]
+    for bpf in filters[1:]:
+        assert "not ip and not ip6" not in bpf
+
+def test_traffic_filter():
+    from pathspider.bpf import traffic_filter
+
+    assert traffic_filter() is None
+    assert traffic_filter(("192.0.2.1", None)) == "(host 192.0.2.1)"
+    assert traffic_filter(("192.0.2.1", "2001:db8::1"), ["tcp"]) == (
+        "(host 192.0.2.1 or host 2001:db8::1) and (tcp or icmp or icmp6)")
+
+def test_combine_filters():
+    from pathspider.bpf import combine_filters
+
+    assert combine_filters(None, None) is None
+    assert combine_filters("tcp", None) == "tcp"
+    assert combine_filters("tcp", "udp") == "(tcp) and (udp)"
@@ -0,0 +1,63 @@
+import argparse
+import socket
+import threading
+
+from pathspider.base import CONN_OK
+from pathspider.base import SHUTDOWN_SENTINEL
+from pathspider.desync import DesynchronizedSpider
+from pathspider.helpers.tcp import connect_tcp
+from pathspider.helpers.tcp import connect_tcp_async
+
+class AsyncSpider(DesynchronizedSpider):
+
+    name = "async"
+
+    def conn(self, job, config): # pylint: disable=unused-argument
+        return connect_tcp(self.source, job, 1)
+
+    async def conn_async(self, job, config): # pylint: disable=unused-argument
+        return await connect_tcp_async(self.source, job, 1)
+
+    connections = [conn, conn]
+    async_connections = [conn_async, conn]
+
+    def combine_flows(self, flows):
+        return [flow['spdr_state'] for flow in flows]
+
+def test_desync_asyncio_engine():
+    server = socket.socket(socket.AF_INET)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    port = server.getsockname()[1]
+
+    def accept():
+        while True:
+            (sock, _) = server.accept()
+            sock.close()
+    threading.Thread(target=accept, daemon=True).start()
+
+    args = argparse.Namespace(engine="asyncio", concurrency=50, timeout=1)
+    spider = AsyncSpider(2, "pcapfile:/dev/null", args)
+    spider.start()
+
+    results = []
+    def read_results():
+        while True:
+            result = spider.outqueue.get()
+            spider.outqueue.task_done()
+            if result == SHUTDOWN_SENTINEL:
+                break
+            results.append(result)
+    reader = threading.Thread(target=read_results)
+    reader.start()
+
+    for i in range(200):
+        spider.jobqueue.put({'dip': "127.0.0.1", 'dp': port, 'i': i})
+    spider.shutdown()
+    reader.join()
+    server.close()
+
+    assert len(results) == 200
+    assert sorted(result['i'] for result in results) == list(range(200))
+    for result in results:
+        assert result['conditions'][:2] == [CONN_OK, CONN_OK]
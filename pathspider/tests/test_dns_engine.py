@@ -0,0 +1,81 @@
+import asyncio
+import socket
+import threading
+
+import nose
+
+def test_dns_engine():
+    try:
+        from pathspider.base import CONN_OK
+        from pathspider.base import CONN_FAILED
+        from pathspider.helpers.dns import DNSEngine
+    except ImportError:
+        raise nose.SkipTest
+
+    # answers every query with its own header, as a response
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    def answer():
+        while True:
+            (data, client) = server.recvfrom(512)
+            # a reply with the wrong ID must be ignored
+            server.sendto(bytes([data[0] ^ 1, data[1], data[2] | 0x80]) + data[3:], client)
+            server.sendto(data[:2] + bytes([data[2] | 0x80]) + data[3:], client)
+    threading.Thread(target=answer, daemon=True).start()
+
+    source = ("127.0.0.1", "::1")
+    job = {'dip': "127.0.0.1", 'dp': server.getsockname()[1],
+           'domain': "example.com"}
+    engine = DNSEngine(sockets=8)
+    futures = [engine.submit(source, job, 2) for _ in range(100)]
+    ports = [future.result()['sp'] for future in futures]
+    assert all(future.result()['spdr_state'] == CONN_OK for future in futures)
+    # successive queries to the same server are sent from different ports
+    for i in range(0, 100, 8):
+        assert len(set(ports[i:i + 8])) == len(ports[i:i + 8])
+
+    job = {'dip': "127.0.0.1", 'dp': silent.getsockname()[1],
+           'domain': "example.com"}
+    conn = engine.submit(source, job, 1).result()
+    assert conn['spdr_state'] == CONN_FAILED
+    assert conn['sp'] in ports
+
+    engine.close()
+    server.close()
+    silent.close()
+
+def test_dns_udp_async():
+    try:
+        from pathspider.base import CONN_OK
+        from pathspider.helpers.dns import connect_dns_udp_async
+        from pathspider.helpers.dns import dns_engine
+    except ImportError:
+        raise nose.SkipTest
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    def answer():
+        while True:
+            (data, client) = server.recvfrom(512)
+            server.sendto(data[:2] + bytes([data[2] | 0x80]) + data[3:], client)
+    threading.Thread(target=answer, daemon=True).start()
+
+    source = ("127.0.0.1", "::1")
+    job = {'dip': "127.0.0.1", 'dp': server.getsockname()[1],
+           'domain': "example.com"}
+    async def query_all():
+        return await asyncio.gather(*[
+            connect_dns_udp_async(source, job, 2) for _ in range(50)])
+    loop = asyncio.new_event_loop()
+    try:
+        conns = loop.run_until_complete(query_all())
+    finally:
+        loop.close()
+    server.close()
+
+    assert all(conn['spdr_state'] == CONN_OK for conn in conns)
+    # the queries were sent from the shared engine's sockets
+    ports = set(sp for (_, sp) in dns_engine()._sockets.values()) # pylint: disable=protected-access
+    assert all(conn['sp'] in ports for conn in conns)
@@ -0,0 +1,47 @@
+from nose.tools import raises
+
+from pathspider.chains.basic import BasicChain
+from pathspider.chains.ecn import ECNChain
+from pathspider.flowrecord import record_type
+
+def test_flowrecord_defaults():
+    Record = record_type(BasicChain.fields + ECNChain.fields)
+    rec = Record()
+    assert rec.pkt_fwd == 0
+    assert rec.sip is None
+    assert rec.ecn_ce_syn_rev is False
+    assert list(rec.to_dict())[:3] == ['sip', 'dip', 'proto']
+    assert len(rec.to_dict()) == len(BasicChain.fields) + 12
+
+def test_flowrecord_item_access():
+    Record = record_type((('a', 1), ('b', None)))
+    rec = Record()
+    rec['a'] += 1
+    rec['extra'] = "x"
+    assert rec.a == 2
+    assert rec['extra'] == "x"
+    assert 'b' in rec and 'extra' in rec and 'c' not in rec
+    assert rec.get('c', 3) == 3
+    assert rec.to_dict() == {'a': 2, 'b': None, 'extra': "x"}
+    # records do not share state
+    assert Record().to_dict() == {'a': 1, 'b': None}
+
+@raises(ValueError)
+def test_flowrecord_conflicting_defaults():
+    record_type((('a', 1), ('a', 2)))
+
+@raises(ValueError)
+def test_flowrecord_invalid_name():
+    record_type((('to_dict', 1), ))
+
+def test_flowbatch_pack():
+    import pickle
+    from pathspider.flowrecord import FlowBatch
+
+    Record = record_type((('a', 1), ('b', None)))
+    records = [Record() for _ in range(3)]
+    records[1].b = "x"
+    records[2]['extra'] = 2
+    batch = pickle.loads(pickle.dumps(FlowBatch.pack(records)))
+    assert len(batch) == 3
+    assert list(batch) == [rec.to_dict() for rec in records]
@@ -0,0 +1,22 @@
+import nose
+
+def test_https_url():
+    try:
+        import pycurl
+        from pathspider.helpers.http import _https_curlopts
+    except ImportError:
+        raise nose.SkipTest
+
+    job = {'dip': "192.0.2.1", 'domain': "example.com"}
+    curlopts = _https_curlopts(job, None)
+    assert job['dp'] == 443
+    assert curlopts[pycurl.URL] == "https://example.com:443/"
+
+    curlopts = _https_curlopts({'dip': "2001:db8::1", 'dp': 8443}, None)
+    assert curlopts[pycurl.URL] == "https://[2001:db8::1]:8443/"
+
+    # a URL given by the caller is kept
+    curlopts = _https_curlopts({'dip': "192.0.2.1"},
+                               {pycurl.URL: "https://example.com/index.html"})
+    assert curlopts[pycurl.URL] == "https://example.com/index.html"
+    assert curlopts[pycurl.SSL_VERIFYPEER] == 0
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+import nose
+
+class HelloServer(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = ("hello " + self.headers["Host"]).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+def test_http_engine():
+    try:
+        from pathspider.base import CONN_OK
+        from pathspider.helpers.http import connect_http_async
+        from pathspider.helpers.http import HTTPEngine
+    except ImportError:
+        raise nose.SkipTest
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HelloServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    job = {'dip': "127.0.0.1", 'dp': server.server_port, 'domain': "example.com"}
+    source = ("127.0.0.1", "::1")
+
+    async def transfers():
+        # all of the transfers are in progress at once on a single event loop
+        return await asyncio.gather(
+            *[connect_http_async(source, dict(job), 2, engine=engine)
+              for _ in range(50)])
+
+    engine = HTTPEngine()
+    loop = asyncio.new_event_loop()
+    try:
+        conns = loop.run_until_complete(transfers())
+    finally:
+        loop.close()
+        engine.close()
+        server.shutdown()
+
+    for conn in conns:
+        assert conn['spdr_state'] == CONN_OK
+        assert conn['sp'] > 0
+        assert conn['http_response_code'] == 200
+        assert conn['http_response_body'] == "hello example.com:%d" % job['dp']
+
+def test_http_engine_closed():
+    try:
+        from pathspider.base import CONN_FAILED
+        from pathspider.helpers.http import connect_http_async
+        from pathspider.helpers.http import HTTPEngine
+    except ImportError:
+        raise nose.SkipTest
+
+    engine = HTTPEngine()
+    engine.close()
+    job = {'dip': "127.0.0.1", 'dp': 1}
+    loop = asyncio.new_event_loop()
+    try:
+        conn = loop.run_until_complete(
+            connect_http_async(("127.0.0.1", "::1"), job, 2, engine=engine))
+    finally:
+        loop.close()
+    assert conn['spdr_state'] == CONN_FAILED
+
+def test_http_engine_submit():
+    try:
+        from pathspider.base import CONN_OK
+        from pathspider.helpers.http import submit_http
+        from pathspider.helpers.http import HTTPEngine
+    except ImportError:
+        raise nose.SkipTest
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HelloServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    job = {'dip': "127.0.0.1", 'dp': server.server_port, 'domain': "example.com"}
+    source = ("127.0.0.1", "::1")
+
+    engine = HTTPEngine()
+    try:
+        # started from a plain thread, with no event loop
+        futures = [submit_http(source, dict(job), 2, engine=engine)
+                   for _ in range(20)]
+        conns = [future.result() for future in futures]
+        # the handles of the completed transfers are kept for reuse
+        handles = list(engine._handles) # pylint: disable=protected-access
+        assert len(handles) == 20
+        conn = submit_http(source, dict(job), 2, engine=engine).result()
+        assert engine._handles[-1] in handles # pylint: disable=protected-access
+    finally:
+        engine.close()
+        server.shutdown()
+
+    for conn in conns + [conn]:
+        assert conn['spdr_state'] == CONN_OK
+        assert conn['http_response_body'] == "hello example.com:%d" % job['dp']
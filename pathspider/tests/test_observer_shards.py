@@ -0,0 +1,51 @@
+import json
+import pkg_resources
+import queue
+
+import nose
+
+from pathspider.base import SHUTDOWN_SENTINEL
+from pathspider.bpf import shard_filter
+from pathspider.chains.basic import BasicChain
+from pathspider.chains.icmp import ICMPChain
+from pathspider.chains.tcp import TCPChain
+from pathspider.chains.udp import UDPChain
+
+TEST_TRACES = [
+    "tcp_http.pcap",
+    "tcp_ipv6_ecn.pcap",
+    "icmp_synack_unreachable.pcap",
+    "icmp_ipv6_unreachable.pcap",
+    "dns_valid_response.pcap",
+]
+
+def observe(test_trace, bpf_filter=None):
+    from pathspider.observer import Observer
+
+    lturi = "pcap:" + pkg_resources.resource_filename("pathspider",
+                                                      "tests/data/" +
+                                                      test_trace)
+    observer = Observer(lturi, [BasicChain, TCPChain, UDPChain, ICMPChain],
+                        bpf_filter=bpf_filter)
+    flowqueue = queue.Queue()
+    observer.run_flow_enqueuer(flowqueue)
+
+    flows = []
+    while True:
+        f = flowqueue.get()
+        if f == SHUTDOWN_SENTINEL:
+            return flows
+        flows.append(json.dumps(f, sort_keys=True))
+
+def test_observer_shards():
+    try:
+        import plt # libtrace may not be available
+    except ImportError:
+        raise nose.SkipTest
+
+    for test_trace in TEST_TRACES:
+        serial = observe(test_trace)
+        sharded = []
+        for shard in range(3):
+            sharded.extend(observe(test_trace, shard_filter(shard, 3)))
+        assert sorted(sharded) == sorted(serial)
@@ -1,3 +1,5 @@
+from argparse import Namespace
+
 from pathspider.chains.ecn import ECNChain
 from pathspider.plugins.ecn import ECN
 from pathspider.tests.chains import ChainTestCase
@@ -50,6 +52,21 @@ def test_plugin_ecn_combine():
         conditions = spider.combine_flows(flows)
         assert group[2] in conditions
 
+    # stateless probes never complete the handshake
+    args = Namespace(connect="tcpsyn")
+    for group in test_groups_ecn:
+        flows = [
+                {'observed': True, 'spdr_state': CONN_OK},
+                {'observed': True, 'spdr_state': CONN_OK, 'tcp_connected': False, 'tcp_synflags_rev': group[1], 'ecn_ect0_syn_rev': False, 'ecn_ect1_syn_rev': False, 'ecn_ce_syn_rev': False, 'ecn_ect0_data_rev': False, 'ecn_ect1_data_rev': False, 'ecn_ce_data_rev': False }
+               ]
+
+        spider = ECN(0, "", args)
+        conditions = spider.combine_flows(flows)
+        if group[1] & TCP_SA == TCP_SA:
+            assert group[2] in conditions
+        else:
+            assert not any(c.startswith("ecn.negotiation") for c in conditions)
+
     test_groups_mark = [
                        (True, "ecn.ipmark.ect0.seen"),
                        (False, "ecn.ipmark.ect0.not_seen"),
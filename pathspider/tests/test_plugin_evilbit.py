@@ -7,6 +7,7 @@ from scapy.all import Ether
 
 from pathspider.chains.evil import EvilChain
 from pathspider.plugins.evilbit import EvilBit
+from pathspider.inject import source_port
 from pathspider.tests.chains import ChainTestCase
 from pathspider.chains.tcp import TCP_SA 
 
@@ -69,6 +70,17 @@ def test_plugin_evilbit_forge_diff():
 
         assert bytes(packets[0]) == bytes(packets[1])
 
+def test_plugin_evilbit_forge_bytes():
+    for connect in EvilBit.connect_supported:
+        spider = EvilBit(0, "", TestArgs(connect=connect))
+
+        for seq in range(0, spider.packets):
+            packet = spider.forge(job, seq)
+            data = spider.forge_bytes(job, seq)
+            packet.payload.sport = source_port(data)
+
+            assert bytes(packet) == bytes(data)
+
 def test_plugin_evilbit_combine_not_observed():
     flows = [
              {'observed': True},
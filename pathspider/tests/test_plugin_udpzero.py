@@ -7,6 +7,7 @@ from scapy.all import Ether
 
 from pathspider.chains.udp import UDPChain
 from pathspider.plugins.udpzero import UDPZero
+from pathspider.inject import source_port
 from pathspider.tests.chains import ChainTestCase
 
 TestArgs = namedtuple('TestArgs', ['connect'])
@@ -61,6 +62,16 @@ def test_plugin_udpzero_forge_diff():
 
     assert bytes(packets[0]) == bytes(packets[1])
 
+def test_plugin_udpzero_forge_bytes():
+    spider = UDPZero(0, "", TestArgs(connect="dnsudp"))
+
+    for seq in range(0, spider.packets):
+        packet = spider.forge(job, seq)
+        data = spider.forge_bytes(job, seq)
+        packet.payload.sport = source_port(data)
+
+        assert bytes(packet) == bytes(data)
+
 def test_plugin_udpzero_combine():
     test_groups = [
                    (True,  True,  "udpzero.connectivity.works"),
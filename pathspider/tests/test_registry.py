@@ -0,0 +1,85 @@
+import ipaddress
+import time
+
+from pathspider.registry import ExpectedFlows
+
+def test_registry_keys():
+    expected = ExpectedFlows()
+    expected.connecting("192.0.2.1")
+    assert expected.is_expected(("192.0.2.1", 40000))
+    expected.connected("192.0.2.1", 40000)
+    assert expected.is_expected(("192.0.2.1", 40000))
+    assert not expected.is_expected(("192.0.2.1", 40001))
+    expected.discard(("192.0.2.1", 40000))
+    assert not expected.is_expected(("192.0.2.1", 40000))
+
+def test_registry_observer_view():
+    expected = ExpectedFlows()
+    view = expected.observer_view()
+    local = ipaddress.ip_address("198.51.100.1").packed
+    a = ipaddress.ip_address("192.0.2.1").packed
+    b = ipaddress.ip_address("2001:db8::1").packed
+
+    # announcements are seen without the background reader running
+    assert not view.admits(local, a)
+    expected.connecting("192.0.2.1")
+    assert view.admits(local, a)
+    assert view.admits(a, local)
+    assert not view.admits(local, b)
+    expected.connecting("2001:db8::1")
+    expected.connected("2001:db8::1")
+    assert view.admits(b, local)
+
+def test_registry_finished():
+    expected = ExpectedFlows(grace=2)
+    view = expected.observer_view()
+    view.start()
+    a = ipaddress.ip_address("192.0.2.1").packed
+    b = ipaddress.ip_address("2001:db8::1").packed
+
+    expected.connecting("192.0.2.1")
+    expected.connected("192.0.2.1", 40000)
+    expected.finished("192.0.2.1", 40000)
+    expected.finished("2001:db8::1", 443, grace=0.5)
+    expected.finished("not an address", 40000)
+
+    for _ in range(100):
+        if len(view._finished) == 2: # pylint: disable=protected-access
+            break
+        time.sleep(0.01)
+    assert view.finished() == [(a + b"\x9c\x40", 2), (b + b"\x01\xbb", 0.5)]
+    assert view.finished() == []
+    assert view.admits(a, b)
+
+def test_registry_closed_observer():
+    expected = ExpectedFlows()
+    view = expected.observer_view()
+    dead = expected.observer_view()
+    # the Observer holding this view has exited
+    dead._reader.close() # pylint: disable=protected-access
+    local = ipaddress.ip_address("198.51.100.1").packed
+    a = ipaddress.ip_address("192.0.2.1").packed
+
+    expected.connecting("192.0.2.1")
+    expected.connected("192.0.2.1", 40000)
+    expected.finished("192.0.2.1", 40000)
+    expected.close()
+    assert view.admits(local, a)
+    assert view.finished() == [(a + b"\x9c\x40", 2)]
+    assert len(expected._senders) == 1 # pylint: disable=protected-access
+
+def test_registry_written():
+    expected = ExpectedFlows()
+    view = expected.observer_view()
+    local = ipaddress.ip_address("198.51.100.1").packed
+    addresses = ["192.0.2.%d" % i for i in range(1, 51)]
+
+    # many addresses announced without waiting, then waited for once
+    for address in addresses:
+        expected.connecting(address, wait=False)
+    expected.written().result(1)
+    for address in addresses:
+        assert view.admits(local, ipaddress.ip_address(address).packed)
+    assert expected.written().done()
+
+    expected.close()
@@ -0,0 +1,49 @@
+import socket
+
+import nose
+
+from pathspider.base import CONN_OK
+from pathspider.base import CONN_FAILED
+from pathspider.base import CONN_TIMEOUT
+from pathspider.helpers.tcp import SYNProber
+
+def test_syn_prober():
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                      socket.IPPROTO_TCP).close()
+    except PermissionError:
+        raise nose.SkipTest
+
+    server = socket.socket(socket.AF_INET)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    port = server.getsockname()[1]
+
+    closed = socket.socket(socket.AF_INET)
+    closed.bind(("127.0.0.1", 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+
+    source = ("127.0.0.1", None)
+    prober = SYNProber()
+    futures = [prober.submit(source, {'dip': "127.0.0.1", 'dp': port}, 2,
+                             flags=0xc2, tos=0x02)
+               for _ in range(200)]
+    ports = set()
+    for future in futures:
+        conn = future.result()
+        assert conn['spdr_state'] == CONN_OK
+        ports.add(conn['sp'])
+    assert len(ports) == len(futures)
+
+    conn = prober.probe(source, {'dip': "127.0.0.1", 'dp': closed_port}, 2)
+    assert conn['spdr_state'] == CONN_FAILED
+
+    conn = prober.probe(source, {'dip': "192.0.2.1", 'dp': port}, 1)
+    assert conn['spdr_state'] in (CONN_TIMEOUT, CONN_FAILED)
+
+    conn = prober.probe(source, {'dip': "::1", 'dp': port}, 2)
+    assert conn == {'sp': 0, 'spdr_state': CONN_FAILED}
+
+    prober.close()
+    server.close()
@@ -0,0 +1,240 @@
+import argparse
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+from pathspider.base import CONN_OK
+from pathspider.base import SHUTDOWN_SENTINEL
+from pathspider.helpers.dns import dns_engine
+from pathspider.sync import SynchronizedSpider
+from pathspider.sync import CountedBarrier
+
+class EpochSpider(SynchronizedSpider):
+
+    name = "epoch"
+
+    def __init__(self, worker_count, libtrace_uri, args, server_mode=False):
+        super().__init__(worker_count, libtrace_uri, args, server_mode)
+        self.config = None
+        self.switches = 0
+
+    def config_a(self):
+        self.config = 0
+        self.switches += 1
+
+    def config_b(self):
+        self.config = 1
+        self.switches += 1
+
+    configurations = [config_a, config_b]
+
+    def connect(self, job, config):
+        time.sleep(0.01)
+        if (job['i'], config) in ((7, 0), (9, 1)):
+            # a straggler, which is abandoned
+            time.sleep(3)
+        return {'spdr_state': CONN_OK, 'sp': 0, 'active': self.config}
+
+    def combine_flows(self, flows):
+        return [flow['active'] for flow in flows]
+
+class SubmittedSpider(SynchronizedSpider):
+
+    name = "submitted"
+    connect_supported = ["tcp", "http", "dnsudp"]
+
+    def config_a(self):
+        pass
+
+    configurations = [config_a, config_a]
+
+    def combine_flows(self, flows):
+        return [flow['spdr_state'] for flow in flows]
+
+def read_results(spider, results):
+    while True:
+        result = spider.outqueue.get()
+        spider.outqueue.task_done()
+        if result == SHUTDOWN_SENTINEL:
+            break
+        results.append(result)
+
+def test_sync_epochs():
+    args = argparse.Namespace(epoch_size=50, timeout=1)
+    spider = EpochSpider(10, "pcapfile:/dev/null", args)
+
+    results = []
+    reader = threading.Thread(target=read_results, args=(spider, results))
+    reader.start()
+
+    for i in range(200):
+        spider.jobqueue.put({'dip': "192.0.2.1", 'i': i})
+    spider.start()
+    spider.shutdown()
+    reader.join()
+
+    # every connection was made in its own configuration
+    assert sorted(result['i'] for result in results) == list(range(200))
+    for result in results:
+        if result['i'] in (7, 9):
+            continue
+        assert result['conditions'][:2] == [0, 1]
+    assert spider.switches == 8
+
+def test_sync_epochs_abandoned():
+    args = argparse.Namespace(epoch_size=20, timeout=1)
+    spider = EpochSpider(10, "pcapfile:/dev/null", args)
+
+    results = []
+    reader = threading.Thread(target=read_results, args=(spider, results))
+    reader.start()
+
+    for i in range(20):
+        spider.jobqueue.put({'dip': "192.0.2.1", 'i': i})
+    spider.start()
+    spider.shutdown()
+    reader.join()
+
+    # jobs with connections abandoned are output as incomplete, with the
+    # results of the connections that did complete
+    assert len(results) == 20
+    abandoned = {result['i']: result for result in results
+                 if 'missing_configs' in result}
+    assert sorted(abandoned) == [7, 9]
+    assert abandoned[7]['missing_configs'] == [0, 1]
+    assert abandoned[7]['flow_results'] == []
+    assert abandoned[9]['missing_configs'] == [1]
+    assert [flow['active'] for flow in abandoned[9]['flow_results']] == [0]
+    for result in abandoned.values():
+        assert result['conditions'][0] == "pathspider.incomplete"
+
+def test_counted_barrier():
+    barrier = CountedBarrier()
+    generation = barrier.reset(2)
+    assert barrier.arrive(generation)
+    assert barrier.wait(0.01) == 1
+    assert barrier.idle() >= 0.01
+    assert not barrier.arrive(generation - 1)
+    assert barrier.arrive(generation)
+    assert barrier.wait() == 0
+    barrier.reset(1)
+    assert not barrier.current(generation)
+    assert not barrier.arrive(generation)
+
+def test_sync_epochs_idle():
+    spider = EpochSpider(2, "pcapfile:/dev/null",
+                         argparse.Namespace(timeout=1))
+    results = []
+    reader = threading.Thread(target=read_results, args=(spider, results))
+    reader.start()
+
+    spider.start()
+    time.sleep(0.5)
+    spider.jobqueue.put({'dip': "192.0.2.1", 'i': 0})
+    spider.shutdown()
+    reader.join()
+
+    assert len(results) == 1
+
+    # the configuration is only changed for the one epoch
+    assert spider.switches == 2
+
+def test_sync_submitted():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    port = server.getsockname()[1]
+
+    # a single worker, which is not used, as the connections of each phase
+    # are all submitted to the connector by the configurator
+    args = argparse.Namespace(connect="tcp", epoch_size=100, timeout=2)
+    spider = SubmittedSpider(1, "pcapfile:/dev/null", args)
+    spider.source = ("127.0.0.1", "::1")
+    assert spider.submitted
+    results = []
+    reader = threading.Thread(target=read_results, args=(spider, results))
+    reader.start()
+
+    for i in range(100):
+        spider.jobqueue.put({'dip': "127.0.0.1", 'dp': port, 'i': i})
+    spider.start()
+    spider.shutdown()
+    reader.join()
+    server.close()
+
+    assert len(results) == 100
+    for result in results:
+        assert result['conditions'][:2] == [CONN_OK, CONN_OK]
+
+def test_sync_submitted_dns():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    def answer():
+        while True:
+            (data, client) = server.recvfrom(512)
+            server.sendto(data[:2] + bytes([data[2] | 0x80]) + data[3:], client)
+    threading.Thread(target=answer, daemon=True).start()
+
+    args = argparse.Namespace(connect="dnsudp", epoch_size=100, timeout=2)
+    spider = SubmittedSpider(1, "pcapfile:/dev/null", args)
+    spider.source = ("127.0.0.1", "::1")
+    assert spider.submitted
+    results = []
+    reader = threading.Thread(target=read_results, args=(spider, results))
+    reader.start()
+
+    for i in range(100):
+        spider.jobqueue.put({'dip': "127.0.0.1", 'dp': server.getsockname()[1],
+                             'domain': "example.com", 'i': i})
+    spider.start()
+    spider.shutdown()
+    reader.join()
+    server.close()
+
+    assert len(results) == 100
+    for result in results:
+        assert result['conditions'][:2] == [CONN_OK, CONN_OK]
+    # the queries were sent by the engine shared by the process
+    assert dns_engine()._sockets # pylint: disable=protected-access
+
+class HelloServer(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "5")
+        self.end_headers()
+        self.wfile.write(b"hello")
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def test_sync_submitted_http():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HelloServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    args = argparse.Namespace(connect="http", epoch_size=50, timeout=2)
+    spider = SubmittedSpider(1, "pcapfile:/dev/null", args)
+    spider.source = ("127.0.0.1", "::1")
+    assert spider.submitted
+    results = []
+    reader = threading.Thread(target=read_results, args=(spider, results))
+    reader.start()
+
+    for i in range(50):
+        spider.jobqueue.put({'dip': "127.0.0.1", 'dp': server.server_port,
+                             'i': i})
+    spider.start()
+    spider.shutdown()
+    reader.join()
+    server.shutdown()
+
+    assert len(results) == 50
+    for result in results:
+        assert result['conditions'][:2] == [CONN_OK, CONN_OK]
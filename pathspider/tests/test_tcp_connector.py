@@ -0,0 +1,38 @@
+import socket
+import threading
+
+from pathspider.base import CONN_OK
+from pathspider.base import CONN_FAILED
+from pathspider.helpers.tcp import TCPConnector
+
+def test_tcp_connector():
+    server = socket.socket(socket.AF_INET)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    port = server.getsockname()[1]
+
+    def accept():
+        while True:
+            (sock, _) = server.accept()
+            sock.close()
+    threading.Thread(target=accept, daemon=True).start()
+
+    closed = socket.socket(socket.AF_INET)
+    closed.bind(("127.0.0.1", 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+
+    source = ("127.0.0.1", "::1")
+    connector = TCPConnector()
+    futures = [connector.submit(source, {'dip': "127.0.0.1", 'dp': port}, 2)
+               for _ in range(200)]
+    for future in futures:
+        conn = future.result()
+        assert conn['spdr_state'] == CONN_OK
+        assert conn['sp'] > 0
+
+    conn = connector.connect(source, {'dip': "127.0.0.1", 'dp': closed_port}, 2)
+    assert conn == {'sp': 0, 'spdr_state': CONN_FAILED}
+
+    connector.close()
+    server.close()
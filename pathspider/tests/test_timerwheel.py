@@ -0,0 +1,71 @@
+import math
+import random
+
+from pathspider.timerwheel import TimerWheel
+
+def test_timerwheel_fire():
+    wheel = TimerWheel(resolution=0.1)
+    wheel.advance(100.0)
+    wheel.schedule("a", 100.25)
+    wheel.schedule("b", 101.0)
+
+    assert wheel.advance(100.2) == []
+    assert wheel.advance(100.3) == ["a"]
+    assert wheel.advance(100.9) == []
+    assert wheel.advance(101.0) == ["b"]
+    assert len(wheel) == 0
+
+def test_timerwheel_reschedule():
+    wheel = TimerWheel(resolution=0.1)
+    wheel.advance(0.1)
+    wheel.schedule("a", 1.0)
+    wheel.schedule("a", 2.0)
+    assert wheel.advance(1.5) == []
+    assert "a" in wheel
+    wheel.schedule("a", 1.7)
+    assert wheel.advance(1.7) == ["a"]
+    assert wheel.advance(3.0) == []
+
+def test_timerwheel_cancel():
+    wheel = TimerWheel(resolution=1)
+    wheel.advance(1)
+    wheel.schedule("a", 5)
+    wheel.schedule("b", 5)
+    wheel.cancel("a")
+    assert "a" not in wheel
+    assert wheel.advance(10) == ["b"]
+
+def test_timerwheel_gap():
+    wheel = TimerWheel(resolution=0.01)
+    wheel.advance(1500000000)
+    wheel.schedule("a", 1500000030)
+    wheel.schedule("b", 1500086400)
+    wheel.schedule("c", 1600000000)
+    assert wheel.advance(1500000029.99) == []
+    assert wheel.advance(1500090000) == ["a", "b"]
+    assert wheel.advance(1599999999.99) == []
+    assert wheel.advance(1600000000) == ["c"]
+
+def test_timerwheel_random():
+    random.seed(0)
+    wheel = TimerWheel(resolution=0.1, levels=(4, 4, 4))
+    expected = {} # map key to the tick it should fire on
+    now = 1000.0
+    wheel.advance(now)
+    for _ in range(5000):
+        key = random.randrange(50)
+        if random.random() < 0.6:
+            deadline = now + random.choice([1, 30, 500, 10000]) * random.random()
+            wheel.schedule(key, deadline)
+            # deadlines in the current tick fire on the next one
+            expected[key] = max(math.ceil(deadline / 0.1),
+                                math.ceil(now / 0.1) + 1)
+        else:
+            now += random.random() * random.choice([1, 100])
+            fired = wheel.advance(now)
+            due = set(key for key in expected
+                      if expected[key] <= math.ceil(now / 0.1))
+            assert set(fired) == due
+            assert len(fired) == len(due)
+            for key in due:
+                del expected[key]
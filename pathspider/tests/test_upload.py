@@ -0,0 +1,93 @@
+import bz2
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import nose
+
+class PTOStandIn(BaseHTTPRequestHandler):
+    """
+    A stand-in for the raw data upload API of a PTO server, keeping the
+    uploaded files in memory.
+    """
+
+    files = {}
+    requests = []
+
+    def _send(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        if self.path in self.files and not self.path.endswith("/data"):
+            self._send(200, self.files[self.path])
+        else:
+            self._send(404, b"not found")
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", self.path))
+        if self.path in self.files:
+            self._send(200, self.files[self.path])
+        else:
+            self._send(404, b"not found")
+
+    def do_PUT(self):
+        self.requests.append(("PUT", self.path))
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path.endswith("/data"):
+            self.files[self.path] = body
+            self._send(201, self.files[self.path[:-len("/data")]])
+        else:
+            meta = json.loads(body.decode())
+            meta["__data"] = ("http://localhost:%d" % self.server.server_port +
+                              self.path + "/data")
+            self.files[self.path] = json.dumps(meta).encode()
+            self._send(201, self.files[self.path])
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+def test_upload_resume():
+    try:
+        from pathspider.cmd.upload import upload_files
+    except ImportError:
+        raise nose.SkipTest
+
+    server = HTTPServer(("localhost", 0), PTOStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://localhost:%d/raw/" % server.server_port
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = []
+        for i in range(3):
+            filename = os.path.join(tmp, "results%d.ndjson" % i)
+            with open(filename, "w") as fh:
+                for j in range(1000):
+                    fh.write(json.dumps({"n": j, "file": i}) + "\n")
+            with open(filename + ".meta.json", "w") as fh:
+                json.dump({"_file_type": "pathspider-v2-ndjson-bz2"}, fh)
+            filenames.append(filename)
+        files = [(filename, filename + ".meta.json") for filename in filenames]
+
+        assert upload_files(url, "test", "token", files, parallel=2) == []
+        for (i, filename) in enumerate(filenames):
+            path = "/raw/test/results%d.ndjson.bz2/data" % i
+            with open(filename, "rb") as fh:
+                assert bz2.decompress(PTOStandIn.files[path]) == fh.read()
+
+        # lose the data for one file, as if its upload was interrupted
+        del PTOStandIn.files["/raw/test/results1.ndjson.bz2/data"]
+        del PTOStandIn.requests[:]
+        assert upload_files(url, "test", "token", files) == []
+        puts = [path for (method, path) in PTOStandIn.requests
+                if method == "PUT"]
+        assert puts == ["/raw/test/results1.ndjson.bz2/data"]
+
+    server.shutdown()
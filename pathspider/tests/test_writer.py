@@ -0,0 +1,67 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+import tempfile
+
+from pathspider.writer import OutputWriter
+from pathspider.writer import compression_for
+
+def _results(count):
+    return [('{"n": %d, "pad": "%s"}\n' % (i, "x" * (i % 100))).encode()
+            for i in range(count)]
+
+def test_writer_compression_for():
+    assert compression_for("results.ndjson.bz2") == "bz2"
+    assert compression_for("results.ndjson.gz") == "gzip"
+    assert compression_for("results.ndjson.xz") == "xz"
+    assert compression_for("results.ndjson") is None
+
+def test_writer_compressed():
+    results = _results(30000)
+    with tempfile.TemporaryDirectory() as tmp:
+        for (compression, opener) in (("gzip", gzip.open), ("bz2", bz2.open),
+                                      ("xz", lzma.open)):
+            for threads in (0, 3):
+                filename = os.path.join(tmp, "out.ndjson." + compression)
+                with OutputWriter(filename, compression=compression,
+                                  threads=threads) as writer:
+                    for result in results:
+                        writer.write(result)
+                assert writer.files == [filename]
+                with opener(filename, "rb") as fh:
+                    assert fh.read() == b"".join(results)
+
+def test_writer_rotate_size():
+    results = _results(1000)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "out.ndjson.bz2")
+        with OutputWriter(filename, compression="bz2",
+                          rotate_size=20000) as writer:
+            for result in results:
+                writer.write(result)
+        assert len(writer.files) > 1
+        assert writer.files[0] == os.path.join(tmp, "out-0001.ndjson.bz2")
+        data = b""
+        for rotated in writer.files:
+            with bz2.open(rotated, "rb") as fh:
+                data += fh.read()
+        assert data == b"".join(results)
+
+def test_writer_metadata():
+    results = [
+        b'{"time": {"from": "2017-05-01 10:00:00.5", "to": "2017-05-01 10:00:01"}}\n',
+        b'{"time": {"from": "2017-05-01 09:59:59", "to": "2017-05-01 10:00:00.25"}}\n',
+        b'{"time": {"from": "2017-05-01 10:00:02.75", "to": "2017-05-01 10:30:00.1"}}\n',
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "out.ndjson")
+        with OutputWriter(filename, write_metadata=True) as writer:
+            for result in results:
+                writer.write(result)
+        with open(filename + ".meta.json") as fh:
+            assert json.load(fh) == {
+                "_time_start": "2017-05-01T09:59:59Z",
+                "_time_end": "2017-05-01T10:30:00Z",
+                "_file_type": "pathspider-v2-ndjson-bz2"}
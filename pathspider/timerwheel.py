@@ -0,0 +1,235 @@
+"""
+.. module:: pathspider.timerwheel
+   :synopsis: A hierarchical timer wheel driven by an external clock
+
+This module contains the hierarchical timer wheel used by PATHspider's Observer
+to track idle and expiry timeouts for flows. The wheel is driven by the packet
+clock rather than wall time, so it can be used for both live capture and
+offline analysis.
+
+Timers are identified by a hashable key. Cancelling a timer, or moving its
+deadline later, only updates the deadline table: stale wheel entries are
+discarded (or re-inserted at the new deadline) when their slot comes round.
+This makes rescheduling an idle timer on every packet of a flow a single
+dictionary store.
+
+"""
+
+import math
+
+
+class TimerWheel:
+    """
+    A hierarchical timer wheel with a configurable resolution.
+
+    :param resolution: The length of one tick of the lowest wheel, in seconds
+    :type resolution: float
+    :param levels: The number of bits of tick index covered by each wheel,
+                   starting with the lowest
+    :type levels: tuple(int)
+
+    With the defaults, the lowest wheel covers 51.2 seconds at 100 ms
+    resolution, so that the Observer's idle timers are placed on it directly
+    rather than cascaded down from a higher wheel, and the four wheels
+    together cover more than 77 days. Timers
+    further in the future than the wheels can cover are parked in the
+    highest wheel and re-examined each time its slot comes round.
+    """
+
+    def __init__(self, resolution=0.1, levels=(9, 6, 6, 5)):
+        self._resolution = resolution
+        self._shifts = []
+        shift = 0
+        for bits in levels:
+            self._shifts.append(shift)
+            shift += bits
+        self._masks = [(1 << bits) - 1 for bits in levels]
+        self._span = 1 << shift
+        # the wheel for a timer due in a given number of ticks, indexed by
+        # the bit length of that number
+        self._levels = []
+        for level, bits in enumerate(levels):
+            while len(self._levels) <= self._shifts[level] + bits:
+                self._levels.append(level)
+        self._wheels = [[[] for _ in range(1 << bits)] for bits in levels]
+        self._counts = [0] * len(levels)
+
+        self._deadlines = {}  # map key to current deadline
+        self._tick = None     # last tick processed
+
+        #: The time covered by the last tick processed. Advancing the clock
+        #: to a time no later than this does nothing, so callers advancing
+        #: it for every packet can skip the call.
+        self.until = -math.inf
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _ticks(self, t):
+        return math.ceil(t / self._resolution)
+
+    def _insert(self, key, tick):
+        base = self._tick + 1
+        delta = tick - base
+        if delta < 0:
+            # already due, fire on the next tick processed
+            tick = base
+            delta = 0
+        elif delta >= self._span:
+            # park in the highest wheel, to be re-examined later
+            tick = base + self._span - 1
+            delta = self._span - 1
+
+        level = self._levels[delta.bit_length()]
+        self._wheels[level][(tick >> self._shifts[level]) &
+                            self._masks[level]].append(key)
+        self._counts[level] += 1
+
+    def schedule(self, key, deadline):
+        """
+        Schedule the timer identified by ``key`` to fire once the clock
+        reaches ``deadline``. If the timer is already scheduled, its deadline
+        is replaced. A deadline that has already passed, or that falls in the
+        tick the clock has already reached, fires on the next tick.
+
+        :param key: The identifier for the timer
+        :type key: hashable
+        :param deadline: The time at which the timer should fire
+        :type deadline: float
+        """
+
+        if self._tick is None:
+            self._tick = 0
+            self.until = 0
+
+        old = self._deadlines.get(key)
+        self._deadlines[key] = deadline
+        if old is None or deadline < old:
+            self._insert(key, self._ticks(deadline))
+        # otherwise the existing wheel entry fires no later than the new
+        # deadline, and will re-insert the timer when it is examined
+
+    def is_due(self, deadline):
+        """
+        Check whether a timer with the given deadline would already have
+        fired by the time the clock has reached.
+
+        :param deadline: The deadline to check
+        :type deadline: float
+        :rtype: bool
+        """
+
+        return self._tick is not None and self._ticks(deadline) <= self._tick
+
+    def cancel(self, key):
+        """
+        Cancel the timer identified by ``key``, if it is scheduled.
+
+        :param key: The identifier for the timer
+        :type key: hashable
+        """
+
+        self._deadlines.pop(key, None)
+
+    def _cascade(self, level, tick):
+        shift = self._shifts[level]
+        slot = (tick >> shift) & self._masks[level]
+        keys = self._wheels[level][slot]
+        if not keys:
+            return
+        self._wheels[level][slot] = []
+        self._counts[level] -= len(keys)
+        for key in keys:
+            deadline = self._deadlines.get(key)
+            if deadline is not None:
+                self._insert(key, self._ticks(deadline))
+
+    def _expire(self, tick, due):
+        slot = tick & self._masks[0]
+        keys = self._wheels[0][slot]
+        if not keys:
+            return
+        self._wheels[0][slot] = []
+        self._counts[0] -= len(keys)
+        for key in keys:
+            deadline = self._deadlines.get(key)
+            if deadline is None:
+                # cancelled, or already fired from another entry
+                continue
+            dtick = self._ticks(deadline)
+            if dtick <= tick:
+                del self._deadlines[key]
+                due.append(key)
+            else:
+                # deadline was moved later since this entry was made
+                self._insert(key, dtick)
+
+    def advance(self, now):
+        """
+        Advance the clock to ``now`` and return the keys of all timers that
+        have fired. Ticks with nothing scheduled on the lower wheels are
+        skipped, so large jumps in the clock are cheap.
+
+        :param now: The current time
+        :type now: float
+        :return: The keys of the timers that fired, in order of firing
+        :rtype: list
+        """
+
+        if now <= self.until:
+            return []
+
+        target = math.ceil(now / self._resolution)
+        if self._tick is None:
+            self._tick = target
+            self.until = target * self._resolution
+            return []
+        elif target <= self._tick:
+            return []
+
+        due = []
+        while self._tick < target:
+            if not self._deadlines:
+                # only stale entries are left, if any
+                if any(self._counts):
+                    self.clear()
+                self._tick = target
+                break
+
+            # find the lowest wheel with entries: nothing can happen before
+            # the next slot boundary of that wheel
+            level = 0
+            while self._counts[level] == 0:
+                level += 1
+            shift = self._shifts[level]
+            tick = ((self._tick + (1 << shift)) >> shift) << shift
+            if tick > target:
+                self._tick = target
+                break
+
+            # cascade higher wheels whose slot boundary we have reached,
+            # while the clock still stands just before this tick
+            self._tick = tick - 1
+            for upper in range(len(self._shifts) - 1, 0, -1):
+                if (tick & ((1 << self._shifts[upper]) - 1)) == 0:
+                    self._cascade(upper, tick)
+
+            self._tick = tick
+            self._expire(tick, due)
+
+        self.until = self._tick * self._resolution
+        return due
+
+    def clear(self):
+        """
+        Cancel all timers.
+        """
+
+        self._deadlines.clear()
+        for level, wheel in enumerate(self._wheels):
+            for slot in range(len(wheel)):
+                wheel[slot] = []
+            self._counts[level] = 0
@@ -0,0 +1,321 @@
+"""
+.. module:: pathspider.writer
+   :synopsis: A buffered writer for results, with streaming compression
+
+This module contains the writer used by ``pspdr measure`` to write results to
+the output file. Encoded results are collected into large blocks before they
+are written, and may be compressed as they are written, so no separate
+compression pass is needed once the measurement has finished.
+
+Blocks can be compressed by a pool of threads. Each block is then compressed
+separately, and the compressed blocks are written in order. The result is a
+file made of several concatenated compressed streams, which the standard
+decompressors for gzip, bzip2 and xz, as well as Python's :mod:`gzip`,
+:mod:`bz2` and :mod:`lzma` modules, read as one file.
+
+The writer can also keep track of the times covered by the results in each
+file as they are written, and write the PTO metadata for the file alongside
+it when the file is closed.
+
+"""
+
+import bz2
+import collections
+import gzip
+import json
+import logging
+import lzma
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+#: The file name suffix for each supported compression format
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'xz': '.xz',
+}
+
+#: The size of the blocks written, or compressed separately when compressing
+#: in parallel, in bytes
+BLOCK_SIZE = 1 << 20
+
+
+#: The file type recorded in the metadata for results files
+FILE_TYPE = "pathspider-v2-ndjson-bz2"
+
+#: Matches the time range of an encoded result, as written by
+#: :meth:`pathspider.base.Spider.encode_jobs`, where both times are in the
+#: fixed format of :class:`datetime.datetime`, which sorts as a string
+_TIME_RE = re.compile(rb'"time": \{"from": '
+                      rb'"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?)", "to": '
+                      rb'"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?)"\}')
+
+
+class ResultTimes:
+    """
+    Keeps track of the earliest and latest times covered by a set of
+    results, without decoding them.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+
+    def update(self, data):
+        """
+        Take the times from encoded results, one per line.
+
+        :param data: The encoded results
+        :type data: bytes
+        :return: The number of results with times in the fixed format
+        :rtype: int
+        """
+
+        times = _TIME_RE.findall(data)
+        if len(times) > 0:
+            self.add(min(t[0] for t in times).decode(),
+                     max(t[1] for t in times).decode())
+        return len(times)
+
+    def add(self, start, end):
+        """
+        Take the time range of one or more results.
+
+        :param start: The start time, in the format of
+                      ``str(datetime.datetime)``
+        :type start: str
+        :param end: The end time, in the same format
+        :type end: str
+        """
+
+        if self.start is None or start < self.start:
+            self.start = start
+        if self.end is None or end > self.end:
+            self.end = end
+
+    def metadata(self):
+        """
+        Get the PTO metadata for the results.
+
+        :rtype: dict
+        """
+
+        metadata = {}
+        if self.start is not None:
+            metadata['_time_start'] = self.start[:10] + "T" + self.start[11:19] + "Z"
+            metadata['_time_end'] = self.end[:10] + "T" + self.end[11:19] + "Z"
+        metadata['_file_type'] = FILE_TYPE
+        return metadata
+
+
+def compression_for(filename):
+    """
+    Guess the compression format to use for a file from its name.
+
+    :param filename: The name of the file
+    :type filename: str
+    :return: The compression format, or ``None`` for no compression
+    :rtype: str
+    """
+
+    for (compression, suffix) in COMPRESSION_SUFFIXES.items():
+        if filename.endswith(suffix):
+            return compression
+    return None
+
+
+def _compressor(compression):
+    if compression == 'gzip':
+        return zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    elif compression == 'bz2':
+        return bz2.BZ2Compressor(9)
+    elif compression == 'xz':
+        return lzma.LZMACompressor()
+    raise ValueError("Unknown compression format: " + repr(compression))
+
+
+def _compress(compression, data):
+    if compression == 'gzip':
+        return gzip.compress(data, 9)
+    elif compression == 'bz2':
+        return bz2.compress(data, 9)
+    elif compression == 'xz':
+        return lzma.compress(data)
+    raise ValueError("Unknown compression format: " + repr(compression))
+
+
+class OutputWriter:
+    """
+    Writes encoded results to an output file, in large blocks and optionally
+    compressed, starting a new file when the current one grows too large or
+    has been open for too long.
+
+    :param filename: The name of the output file. When rotating, the files
+                     are named by inserting a sequence number before the
+                     extension, e.g. ``results-0001.ndjson.bz2``.
+    :type filename: str
+    :param compression: The compression format, one of
+                        :data:`COMPRESSION_SUFFIXES`, or ``None`` to write
+                        uncompressed data
+    :type compression: str
+    :param threads: The number of threads to compress blocks in, or 0 to
+                    compress as a single stream in the calling thread
+    :type threads: int
+    :param rotate_size: The amount of uncompressed data, in bytes, after
+                        which a new file is started, or ``None``
+    :type rotate_size: int
+    :param rotate_interval: The time, in seconds, after which a new file is
+                            started, or ``None``
+    :type rotate_interval: float
+    :param write_metadata: Whether to write the PTO metadata for each file,
+                           to the file name followed by ``.meta.json``, when
+                           the file is closed
+    :type write_metadata: bool
+    """
+
+    def __init__(self, filename, compression=None, threads=0,
+                 rotate_size=None, rotate_interval=None,
+                 write_metadata=False):
+        if compression is not None and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError("Unknown compression format: " +
+                             repr(compression))
+        self._filename = filename
+        self._compression = compression
+        self._rotate_size = rotate_size
+        self._rotate_interval = rotate_interval
+        self._rotating = rotate_size is not None or rotate_interval is not None
+        self._write_metadata = write_metadata
+        self._times = None
+
+        self._pool = None
+        self._pending = collections.deque()
+        self._threads = threads
+        if compression is not None and threads > 0:
+            self._pool = ThreadPoolExecutor(threads)
+
+        self._logger = logging.getLogger("writer")
+        self._sequence = 0
+        self._fh = None
+        self._compressor = None
+        self._blocks = []
+        self._buffered = 0
+        self._written = 0
+        self._opened = None
+
+        #: The names of the files that have been completely written
+        self.files = []
+
+        self._open()
+
+    def _next_filename(self):
+        if not self._rotating:
+            return self._filename
+        self._sequence += 1
+        (base, ext) = (self._filename, "")
+        for suffix in (COMPRESSION_SUFFIXES.get(self._compression, ""),
+                       ".ndjson", ".json"):
+            if suffix and base.endswith(suffix):
+                base = base[:-len(suffix)]
+                ext = suffix + ext
+        return "{}-{:04d}{}".format(base, self._sequence, ext)
+
+    def _open(self):
+        self._current = self._next_filename()
+        self._logger.info("opening output file %s", self._current)
+        self._fh = open(self._current, 'wb')
+        if self._compression is not None and self._pool is None:
+            self._compressor = _compressor(self._compression)
+        self._written = 0
+        self._opened = time.monotonic()
+        if self._write_metadata:
+            self._times = ResultTimes()
+
+    def write(self, data):
+        """
+        Write encoded results. The data must end at the end of a result, as
+        a new file may be started after it.
+
+        :param data: The encoded results
+        :type data: bytes
+        """
+
+        if self._fh is None:
+            self._open()
+
+        if self._times is not None:
+            self._times.update(data)
+        self._blocks.append(data)
+        self._buffered += len(data)
+        self._written += len(data)
+        if self._buffered >= BLOCK_SIZE:
+            self._write_block()
+
+        if ((self._rotate_size is not None and
+             self._written >= self._rotate_size) or
+                (self._rotate_interval is not None and
+                 time.monotonic() - self._opened >= self._rotate_interval)):
+            self._close_file()
+
+    def _write_block(self):
+        data = b"".join(self._blocks)
+        self._blocks = []
+        self._buffered = 0
+        if len(data) == 0:
+            return
+
+        if self._pool is not None:
+            self._pending.append(
+                self._pool.submit(_compress, self._compression, data))
+            # write out blocks that are done, keeping them in order, and
+            # don't let more blocks queue up than there are threads
+            while self._pending and (self._pending[0].done() or
+                                     len(self._pending) > self._threads):
+                self._fh.write(self._pending.popleft().result())
+        elif self._compressor is not None:
+            self._fh.write(self._compressor.compress(data))
+        else:
+            self._fh.write(data)
+
+    def _close_file(self):
+        self._write_block()
+        while self._pending:
+            self._fh.write(self._pending.popleft().result())
+        if self._compressor is not None:
+            self._fh.write(self._compressor.flush())
+            self._compressor = None
+        self._fh.close()
+        self._fh = None
+        self.files.append(self._current)
+        if self._times is not None:
+            with open(self._current + ".meta.json", "w") as mfp:
+                json.dump(self._times.metadata(), mfp, indent=2)
+
+    def flush(self):
+        """
+        Write out all buffered results. The output is only a complete
+        compressed file once the writer has been closed.
+        """
+
+        if self._fh is not None:
+            self._write_block()
+            while self._pending:
+                self._fh.write(self._pending.popleft().result())
+            self._fh.flush()
+
+    def close(self):
+        """
+        Write out all buffered results and close the output file.
+        """
+
+        if self._fh is not None:
+            self._close_file()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()